@@ -0,0 +1,18 @@
+"""
+Benchmark cho solver: sinh payload nhà máy dệt kim tổng hợp theo cấp kích thước, chạy
+Engine và so sánh với baseline đã lưu.
+
+    python -m benchmarks.run --tiers xs,s,m                  # chạy và so với baseline
+    python -m benchmarks.run --tiers xs,s,m --save-baseline  # ghi lại baseline
+    python -m benchmarks.run --tiers xs,s --require-baseline  # CI: thiếu baseline cũng là lỗi
+
+Baseline phụ thuộc máy đo (CPU, --workers) nên không commit sẵn: mỗi máy CI tự ghi baseline
+một lần rồi chạy với --require-baseline.
+    python -m benchmarks.run --tiers m --dump /tmp/payloads  # lưu payload đã sinh (JSON)
+
+Replay payload production đã ghi (worker chạy với RECORD_PAYLOADS=1, xem cp_app/recorder.py):
+
+    python -m benchmarks.replay recordings --list                      # các job đã ghi
+    python -m benchmarks.replay recordings --index 3 --workers 8       # giải lại, so với lần ghi
+    python -m benchmarks.replay recordings --profile cprofile --profile-out /tmp/prof
+"""
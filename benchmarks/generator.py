@@ -0,0 +1,222 @@
+import math
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Any, Tuple
+
+DAY = 1440
+
+
+@dataclass(frozen=True)
+class Tier:
+    """Quy mô một payload benchmark"""
+    orders: int
+    knitting_machines: int
+    linking_machines: int
+    washers: int
+    packing_lines: int
+    days: int
+    max_search_time: int
+
+
+TIERS: Dict[str, Tier] = {
+    "xs": Tier(orders=10, knitting_machines=4, linking_machines=2, washers=1, packing_lines=2, days=7,
+               max_search_time=5),
+    "s": Tier(orders=50, knitting_machines=12, linking_machines=4, washers=2, packing_lines=3, days=14,
+              max_search_time=10),
+    "m": Tier(orders=200, knitting_machines=40, linking_machines=10, washers=4, packing_lines=6, days=21,
+              max_search_time=30),
+    "l": Tier(orders=800, knitting_machines=120, linking_machines=30, washers=8, packing_lines=12, days=42,
+              max_search_time=60),
+    "xl": Tier(orders=2500, knitting_machines=300, linking_machines=80, washers=20, packing_lines=30, days=84,
+               max_search_time=120),
+}
+
+GAUGES = ("7G", "12G", "14G")
+WASHER_CAPACITY_KG = 120
+SLICE_QTY = 150
+
+
+def knitting_calendar(days: int) -> List[Dict[str, int]]:
+    """Máy dệt chạy 3 ca: nghỉ 30 phút lúc giao ca (06:00, 14:00, 22:00), nghỉ Chủ nhật"""
+    windows = []
+    for d in range(days):
+        if d % 7 == 6:
+            windows.append({"start": d * DAY, "end": (d + 1) * DAY})
+            continue
+        for hour in (6, 14, 22):
+            windows.append({"start": d * DAY + hour * 60, "end": d * DAY + hour * 60 + 30})
+    return windows
+
+
+def day_shift_calendar(days: int) -> List[Dict[str, int]]:
+    """Khâu / giặt / đóng gói chạy ca ngày 06:00-22:00, nghỉ trưa 11:30-12:00, nghỉ Chủ nhật"""
+    windows = []
+    for d in range(days):
+        if d % 7 == 6:
+            windows.append({"start": d * DAY, "end": (d + 1) * DAY})
+            continue
+        windows.append({"start": d * DAY, "end": d * DAY + 6 * 60})
+        windows.append({"start": d * DAY + 11 * 60 + 30, "end": d * DAY + 12 * 60})
+        windows.append({"start": d * DAY + 22 * 60, "end": (d + 1) * DAY})
+    return windows
+
+
+def _task(task_id: str, order_id: str, operation: str, qty: float, duration: int, design: str,
+          compatible: List[str], priority: int, release: int, due: int, **extra) -> Dict[str, Any]:
+    depends_on = extra.pop("final_depends_on", [])
+    return {
+        "task_id": task_id,
+        "original_order_id": order_id,
+        "group_id": order_id,
+        "operation": operation,
+        "qty": qty,
+        "total_qty": extra.pop("total_qty", qty),
+        "priority": priority,
+        "original_depends_on": list(depends_on),
+        "final_depends_on": list(depends_on),
+        "start_after_min": release,
+        "due_at_min": due,
+        "duration": max(1, int(duration)),
+        "design_item_id": design,
+        "compatible_resource_ids": compatible,
+        **extra,
+    }
+
+
+def _washing_batches(orders: List[Dict[str, Any]], rnd: random.Random) -> List[List[Dict[str, Any]]]:
+    """Gom đơn theo thứ tự release thành mẻ giặt 1-5 đơn, tổng khối lượng <= tải máy giặt"""
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    size = rnd.randint(1, 5)
+    for o in sorted(orders, key=lambda o: (o["release"], o["id"])):
+        if current and (len(current) >= size or sum(x["kg"] for x in current) + o["kg"] > WASHER_CAPACITY_KG):
+            batches.append(current)
+            current = []
+            size = rnd.randint(1, 5)
+        current.append(o)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def generate_payload(tier: Tier, seed: int = 0, job_id: str = "bench") -> Dict[str, Any]:
+    """
+    Payload kiểu SolverPayload của một nhà máy dệt kim: mỗi đơn được dệt thành các slice
+    (nối bằng `internal_dep`, cùng máy), khâu, giặt theo mẻ (task batch với
+    `sub_task_completion_offsets`, cumulative theo kg) rồi đóng gói (cumulative theo line).
+    Máy dệt chia theo gauge, có lịch 3 ca; các khâu sau chạy ca ngày.
+    """
+    rnd = random.Random(seed)
+    horizon = tier.days * DAY
+
+    knit_cal = knitting_calendar(tier.days)
+    day_cal = day_shift_calendar(tier.days)
+    knitting: Dict[str, List[str]] = {g: [] for g in GAUGES}
+    resources = []
+    for m in range(tier.knitting_machines):
+        gauge = GAUGES[m % len(GAUGES)]
+        r_id = f"KN-{gauge}-{m:03d}"
+        knitting[gauge].append(r_id)
+        resources.append({"id": r_id, "type": "serial", "capacity": 1, "operation": "knitting",
+                          "unavailability": list(knit_cal)})
+    linking = [f"LK-{m:03d}" for m in range(tier.linking_machines)]
+    resources += [{"id": r_id, "type": "serial", "capacity": 1, "operation": "linking",
+                   "unavailability": list(day_cal)} for r_id in linking]
+    washers = [f"WS-{m:02d}" for m in range(tier.washers)]
+    resources += [{"id": r_id, "type": "batch", "capacity": WASHER_CAPACITY_KG, "operation": "washing",
+                   "unavailability": list(day_cal)} for r_id in washers]
+    resources.append({"id": "PACK", "type": "batch", "capacity": tier.packing_lines, "operation": "packing",
+                      "unavailability": list(day_cal)})
+
+    n_designs = max(3, tier.orders // 8)
+    designs = []
+    for d in range(n_designs):
+        designs.append({
+            "id": f"D{d:04d}",
+            "gauge": GAUGES[d % len(GAUGES)],
+            "knit_min_per_pc": rnd.uniform(0.8, 3.5),
+            "link_min_per_pc": rnd.uniform(0.2, 0.8),
+            "kg_per_pc": rnd.uniform(0.05, 0.2),
+            "setup": rnd.randint(20, 90),
+        })
+    machines = []
+    for gauge, ids in knitting.items():
+        routing = [{"operation": "knitting", "design_item_id": d["id"], "duration": round(d["knit_min_per_pc"], 2),
+                    "setup_time": float(d["setup"])} for d in designs if d["gauge"] == gauge]
+        machines += [{"id": r_id, "capacity": 1, "type": "serial", "worker_req": 1, "routing": routing}
+                     for r_id in ids]
+
+    # Release rải trong 60% đầu horizon, hạn = release + thời gian gia công x hệ số chùng 1.5-3
+    tasks: List[Dict[str, Any]] = []
+    orders = []
+    for o in range(tier.orders):
+        design = rnd.choice(designs)
+        qty = rnd.randint(50, 600)
+        order = {
+            "id": f"O{o:05d}",
+            "design": design,
+            "qty": qty,
+            "kg": round(qty * design["kg_per_pc"], 1),
+            "priority": rnd.randint(1, 5),
+            "release": rnd.randint(0, int(horizon * 0.6)) // 30 * 30,
+        }
+        work = qty * (design["knit_min_per_pc"] + design["link_min_per_pc"]) + 240
+        order["due"] = min(horizon, order["release"] + int(work * rnd.uniform(1.5, 3.0)) + DAY)
+        orders.append(order)
+
+        n_slices = max(1, min(4, math.ceil(qty / SLICE_QTY)))
+        slice_ids = []
+        for s in range(n_slices):
+            slice_qty = qty // n_slices + (1 if s < qty % n_slices else 0)
+            slice_id = f"{order['id']}-KN-{s}"
+            tasks.append(_task(
+                slice_id, order["id"], "knitting", slice_qty, slice_qty * design["knit_min_per_pc"], design["id"],
+                list(knitting[design["gauge"]]), order["priority"], order["release"], order["due"],
+                total_qty=qty, is_slice=n_slices > 1, parent_task_id=f"{order['id']}-KN",
+                internal_dep=slice_ids[-1] if slice_ids else "", slice_index=s,
+            ))
+            slice_ids.append(slice_id)
+        order["linking"] = f"{order['id']}-LK"
+        tasks.append(_task(
+            order["linking"], order["id"], "linking", qty, qty * design["link_min_per_pc"], design["id"],
+            list(linking), order["priority"], order["release"], order["due"], final_depends_on=slice_ids,
+        ))
+
+    for b, members in enumerate(_washing_batches(orders, rnd)):
+        batch_id = f"WB{b:05d}"
+        duration = rnd.randint(90, 150)
+        # Đơn thứ k trong mẻ xong (ra máy sấy) sau (k + 1) / n thời lượng mẻ
+        offsets = {o["id"]: duration * (k + 1) // len(members) for k, o in enumerate(members)}
+        tasks.append(_task(
+            batch_id, members[0]["id"], "washing", round(sum(o["kg"] for o in members)), duration,
+            members[0]["design"]["id"], list(washers), min(o["priority"] for o in members),
+            max(o["release"] for o in members), max(o["due"] for o in members),
+            final_depends_on=[o["linking"] for o in members], is_batch=True,
+            sub_task_completion_offsets=offsets,
+            sub_tasks=[{"task_id": f"{o['id']}-WS", "original_order_id": o["id"], "operation": "washing",
+                        "qty": o["kg"], "duration": duration, "design_item_id": o["design"]["id"]}
+                       for o in members],
+        ))
+        for o in members:
+            tasks.append(_task(
+                f"{o['id']}-PK", o["id"], "packing", o["qty"], 30 + o["qty"] // 20, o["design"]["id"],
+                ["PACK"], o["priority"], o["release"], o["due"], final_depends_on=[batch_id],
+            ))
+
+    return {
+        "job_id": job_id,
+        "config": {
+            "horizon_minutes": horizon,
+            "max_search_time": tier.max_search_time,
+            "setup_time_minutes": 60,
+        },
+        "machines": machines,
+        "resources": resources,
+        "tasks": tasks,
+    }
+
+
+def payload_stats(payload: Dict[str, Any]) -> Tuple[int, int, int]:
+    """(số task, số resource, số cặp task x máy tương thích)"""
+    tasks = payload["tasks"]
+    return len(tasks), len(payload["resources"]), sum(len(t["compatible_resource_ids"]) for t in tasks)
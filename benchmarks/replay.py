@@ -0,0 +1,187 @@
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from cp_app.recorder import load_recording, outcome_of, read_recordings
+
+# Pha được bọc profiler: tên -> method của Engine
+PROFILED_PHASES = {
+    "build_model": "_build_model",
+    "extract_solution": "_extract_solution",
+}
+
+
+class PhaseProfiler:
+    """
+    Profile từng pha của Engine: cProfile (deterministic) hoặc pyinstrument (sampling,
+    cài riêng `pip install pyinstrument`). Kết quả ghi vào `out_dir` nếu có.
+    """
+
+    def __init__(self, kind: str, out_dir: Optional[str] = None, top: int = 20):
+        self.kind = kind
+        self.out_dir = out_dir
+        self.top = top
+        self.reports: Dict[str, str] = {}
+
+    def run(self, name: str, fn, *args, **kwargs):
+        if self.kind == "pyinstrument":
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.stop()
+                self.reports[name] = profiler.output_text(unicode=True, color=False)
+                if self.out_dir:
+                    with open(os.path.join(self.out_dir, f"{name}.html"), "w") as f:
+                        f.write(profiler.output_html())
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(self.top)
+            self.reports[name] = out.getvalue()
+            if self.out_dir:
+                profiler.dump_stats(os.path.join(self.out_dir, f"{name}.prof"))
+
+
+def profiled_engine(profiler: Optional[PhaseProfiler]):
+    """Lớp Engine có các pha trong PROFILED_PHASES chạy dưới profiler"""
+    from cp_app.engine import Engine
+    if profiler is None:
+        return Engine
+
+    def wrap(phase_name, method_name):
+        def method(self, *args, **kwargs):
+            return profiler.run(phase_name, getattr(Engine, method_name).__get__(self), *args, **kwargs)
+        return method
+
+    return type("ProfiledEngine", (Engine,), {
+        method_name: wrap(phase_name, method_name) for phase_name, method_name in PROFILED_PHASES.items()
+    })
+
+
+def replay(entry: Dict[str, Any], seed: int = 0, workers: Optional[int] = None,
+           max_search_time: Optional[int] = None, use_hints: bool = True, decompose: bool = True,
+           profiler: Optional[PhaseProfiler] = None) -> Dict[str, Any]:
+    """Giải lại một bản ghi với seed / số worker cố định; trả về outcome + stats cùng dạng bản ghi"""
+    payload, hints = load_recording(entry)
+    config = dict(payload.get("config") or {}, random_seed=seed)
+    if workers:
+        config["num_search_workers"] = workers
+    if max_search_time:
+        config["max_search_time"] = max_search_time
+    if not decompose:
+        # Thành phần độc lập giải ở thread pool, profiler của thread này không thấy
+        config["decompose_components"] = False
+    payload = dict(payload, config=config)
+
+    started = time.perf_counter()
+    engine = profiled_engine(profiler)(payload, hints=hints if use_hints else None)
+    result = engine.solve()
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "outcome": outcome_of(result),
+        "stats": result.get("stats"),
+    }
+
+
+def _rows(recorded: Dict[str, Any], replayed: Dict[str, Any]) -> List[tuple]:
+    rows = [("seconds", recorded.get("seconds"), replayed.get("seconds"))]
+    for key in ("status", "objective_value", "scheduled", "dropped", "late", "stop_reason"):
+        rows.append((key, (recorded.get("outcome") or {}).get(key), replayed["outcome"].get(key)))
+    before = (recorded.get("stats") or {}).get("timings") or {}
+    after = (replayed.get("stats") or {}).get("timings") or {}
+    for key in list(before) + [k for k in after if k not in before]:
+        rows.append((f"phase.{key}", before.get(key), after.get(key)))
+    before = (recorded.get("stats") or {}).get("search") or {}
+    after = (replayed.get("stats") or {}).get("search") or {}
+    for key in ("status", "variables", "constraints", "conflicts", "branches", "walltime", "objective", "bound", "gap"):
+        rows.append((f"search.{key}", before.get(key), after.get(key)))
+    return rows
+
+
+def format_comparison(recorded: Dict[str, Any], replayed: Dict[str, Any]) -> str:
+    lines = [f"{'metric':<26} {'recorded':>16} {'replay':>16} {'delta':>12}"]
+    for key, before, after in _rows(recorded, replayed):
+        delta = ""
+        if isinstance(before, (int, float)) and isinstance(after, (int, float)) \
+                and not isinstance(before, bool) and not isinstance(after, bool):
+            delta = f"{after - before:+.3f}" if isinstance(after - before, float) else f"{after - before:+d}"
+        lines.append(f"{key:<26} {str(before):>16} {str(after):>16} {delta:>12}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Giải lại payload production đã ghi (RECORD_PAYLOADS) và so sánh")
+    parser.add_argument("path", help="File payloads.jsonl hoặc thư mục RECORD_DIR")
+    parser.add_argument("--list", action="store_true", help="Liệt kê các bản ghi")
+    parser.add_argument("--index", type=int, default=-1, help="Bản ghi thứ N (mặc định: mới nhất)")
+    parser.add_argument("--job-id", help="Chọn bản ghi theo job_id (đã ẩn danh nếu bản ghi ẩn danh)")
+    parser.add_argument("--seed", type=int, default=0, help="random_seed của CP-SAT")
+    parser.add_argument("--workers", type=int, help="num_search_workers (mặc định: như lúc ghi)")
+    parser.add_argument("--max-search-time", type=int, help="Ghi đè max_search_time")
+    parser.add_argument("--no-hints", action="store_true", help="Bỏ hints warm-start đã ghi")
+    parser.add_argument("--no-decompose", action="store_true", help="Giải một model (profile được mọi pha)")
+    parser.add_argument("--profile", choices=("cprofile", "pyinstrument"), help="Profile các pha build / extract")
+    parser.add_argument("--profile-out", help="Thư mục ghi .prof / .html của profiler")
+    parser.add_argument("--top", type=int, default=20, help="Số dòng cProfile in ra mỗi pha")
+    args = parser.parse_args(argv)
+
+    entries = list(read_recordings(args.path))
+    if not entries:
+        print(f"⚠️ No recordings in {args.path}")
+        return 1
+
+    if args.list:
+        for k, e in enumerate(entries):
+            outcome = e.get("outcome") or {}
+            print(f"{k:>4} {datetime.fromtimestamp(e['recorded_at']):%Y-%m-%d %H:%M:%S} {e.get('job_id')} "
+                  f"{e.get('tasks')} tasks {e.get('seconds')}s {outcome.get('status')} "
+                  f"obj {outcome.get('objective_value')} dropped {outcome.get('dropped')}")
+        return 0
+
+    if args.job_id:
+        matches = [e for e in entries if e.get("job_id") == args.job_id]
+        if not matches:
+            parser.error(f"job {args.job_id} not recorded")
+        entry = matches[-1]
+    else:
+        try:
+            entry = entries[args.index]
+        except IndexError:
+            parser.error(f"index {args.index} out of range ({len(entries)} recordings)")
+
+    if args.profile == "pyinstrument":
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            parser.error("--profile pyinstrument needs `pip install pyinstrument`")
+    if args.profile_out:
+        os.makedirs(args.profile_out, exist_ok=True)
+    profiler = PhaseProfiler(args.profile, args.profile_out, args.top) if args.profile else None
+
+    print(f"⏱️ Replaying {entry.get('job_id')} ({entry.get('tasks')} tasks, recorded {entry.get('seconds')}s)...",
+          flush=True)
+    replayed = replay(entry, seed=args.seed, workers=args.workers, max_search_time=args.max_search_time,
+                      use_hints=not args.no_hints, decompose=not args.no_decompose, profiler=profiler)
+    print(format_comparison(entry, replayed))
+    if profiler:
+        for name, report in profiler.reports.items():
+            print(f"\n===== {name} ({args.profile}) =====\n{report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional
+
+from .generator import TIERS, generate_payload, payload_stats
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss tính theo KB trên Linux, byte trên macOS
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(usage / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _silence_stdout():
+    """Tắt log của Engine và CP-SAT (CP-SAT ghi thẳng vào fd 1)"""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    sys.stdout = open(os.devnull, "w")
+
+
+def run_tier(name: str, seed: int = 0, max_search_time: Optional[int] = None,
+             num_search_workers: Optional[int] = None, verbose: bool = False) -> Dict[str, Any]:
+    """Chạy Engine trên payload của một tier, trả về các chỉ số (chạy trong process riêng để đo RSS)"""
+    if not verbose:
+        _silence_stdout()
+    from cp_app.engine import Engine
+
+    payload = generate_payload(TIERS[name], seed=seed)
+    if max_search_time:
+        payload["config"]["max_search_time"] = max_search_time
+    if num_search_workers:
+        payload["config"]["num_search_workers"] = num_search_workers
+    n_tasks, n_resources, pairs = payload_stats(payload)
+
+    events: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+    engine = Engine(payload, progress=events.append)
+    result = engine.solve()
+    total_seconds = time.perf_counter() - started
+
+    solutions = [e for e in events if e.get("type") == "solution"]
+    search = engine.search_stats or {}
+    build_seconds = engine.timings.get("build_model")
+    overloads = result.get("overloads", [])
+    return {
+        "tier": name,
+        "seed": seed,
+        "tasks": n_tasks,
+        "resources": n_resources,
+        "task_machine_pairs": pairs,
+        "status": result.get("status"),
+        "solver_status": result.get("solver_status"),
+        "build_seconds": round(build_seconds, 3) if build_seconds is not None else None,
+        "variables": search.get("variables"),
+        "constraints": search.get("constraints"),
+        "first_solution_seconds": solutions[0]["elapsed"] if solutions else None,
+        "total_seconds": round(total_seconds, 3),
+        "objective": result.get("objective_value"),
+        "bound": search.get("bound"),
+        "gap": round(search["gap"], 4) if search.get("gap") is not None else None,
+        "dropped": sum(1 for o in overloads if o["status"] == "DROPPED"),
+        "late": sum(1 for o in overloads if o["status"] == "LATE"),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_isolated(name: str, **kwargs) -> Dict[str, Any]:
+    # Process mới cho mỗi tier (peak RSS riêng)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_tier, name, **kwargs).result()
+
+
+# Ngưỡng coi là hồi quy: chỉ số hiện tại > baseline x (1 + tolerance) + slack tuyệt đối
+CHECKS = {
+    # metric: (tolerance key, slack tuyệt đối)
+    "build_seconds": ("time", 0.05),
+    "first_solution_seconds": ("time", 0.5),
+    "objective": ("quality", 1.0),
+    "dropped": ("quality", 0.0),
+    "peak_rss_mb": ("memory", 20.0),
+}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerances: Dict[str, float]) -> List[str]:
+    """Danh sách hồi quy của một tier so với baseline (rỗng nếu không có)"""
+    regressions = []
+    for metric, (kind, slack) in CHECKS.items():
+        now, before = current.get(metric), baseline.get(metric)
+        if before is None:
+            continue
+        if now is None:
+            regressions.append(f"{metric}: missing (baseline {before})")
+            continue
+        limit = before * (1 + tolerances[kind]) + slack if metric != "dropped" else before
+        if now > limit:
+            regressions.append(f"{metric}: {now} > {round(limit, 3)} (baseline {before})")
+    if baseline.get("status") == "feasible" and current.get("status") != "feasible":
+        regressions.append(f"status: {current.get('status')} (baseline feasible)")
+    return regressions
+
+
+def _format_row(r: Dict[str, Any]) -> str:
+    return (f"{r['tier']:>3} | {r['tasks']:>6} tasks | build {r['build_seconds']}s | "
+            f"{r['variables']} vars / {r['constraints']} cons | first {r['first_solution_seconds']}s | "
+            f"obj {r['objective']} gap {r['gap']} | dropped {r['dropped']} late {r['late']} | "
+            f"{r['peak_rss_mb']} MB")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Engine trên payload dệt kim tổng hợp")
+    parser.add_argument("--tiers", default="xs,s", help=f"Danh sách tier ({','.join(TIERS)})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-search-time", type=int, help="Ghi đè max_search_time của tier")
+    parser.add_argument("--workers", type=int, default=8, help="num_search_workers (cố định để so sánh được)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Ghi kết quả lần này làm baseline")
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="Báo lỗi khi thiếu baseline hoặc tier không có trong baseline (dùng cho CI)")
+    parser.add_argument("--out", help="Ghi kết quả (JSON) ra file")
+    parser.add_argument("--dump", help="Chỉ sinh payload và ghi vào thư mục, không giải")
+    parser.add_argument("--time-tolerance", type=float, default=0.25)
+    parser.add_argument("--quality-tolerance", type=float, default=0.01)
+    parser.add_argument("--memory-tolerance", type=float, default=0.20)
+    parser.add_argument("--verbose", action="store_true", help="Giữ log của Engine / CP-SAT")
+    args = parser.parse_args(argv)
+
+    tiers = [t.strip() for t in args.tiers.split(",") if t.strip()]
+    unknown = [t for t in tiers if t not in TIERS]
+    if unknown:
+        parser.error(f"unknown tiers: {unknown}")
+
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+        for name in tiers:
+            path = os.path.join(args.dump, f"{name}-seed{args.seed}.json")
+            with open(path, "w") as f:
+                json.dump(generate_payload(TIERS[name], seed=args.seed, job_id=f"bench-{name}"), f)
+            print(f"📝 {path}")
+        return 0
+
+    results = {}
+    for name in tiers:
+        print(f"⏱️ Running tier {name}...", flush=True)
+        results[name] = run_isolated(name, seed=args.seed, max_search_time=args.max_search_time,
+                                     num_search_workers=args.workers, verbose=args.verbose)
+        print(_format_row(results[name]), flush=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)
+        stored.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2)
+        print(f"💾 Baseline saved: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        if args.require_baseline:
+            print(f"❌ No baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        print(f"⚠️ No baseline at {args.baseline}; run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    tolerances = {"time": args.time_tolerance, "quality": args.quality_tolerance, "memory": args.memory_tolerance}
+    failed = False
+    for name, current in results.items():
+        if name not in baseline:
+            if args.require_baseline:
+                print(f"❌ {name}: not in baseline")
+                failed = True
+            else:
+                print(f"⚠️ Tier {name} not in baseline")
+            continue
+        regressions = compare(current, baseline[name], tolerances)
+        if baseline[name].get("seed") != current["seed"]:
+            regressions.append(f"seed differs from baseline ({baseline[name].get('seed')})")
+        for r in regressions:
+            print(f"❌ {name}: {r}")
+        failed = failed or bool(regressions)
+        if not regressions:
+            print(f"✅ {name}: no regression")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import bisect
+from typing import Dict, List, Any, Optional, Tuple
+
+# Mốc "vô cực" cho khoảng trống cuối cùng của lịch máy (sau giờ nghỉ cuối)
+OPEN_END = 1 << 40
+
+
+class DependencyCycleError(ValueError):
+    """Đồ thị phụ thuộc (final_depends_on / internal_dep) có chu trình"""
+
+
+class FeasibleStarts:
+    """
+    Tập các thời điểm bắt đầu hợp lệ của một task (không cắt ngang giờ nghỉ),
+    lưu dưới dạng các đoạn [lo, hi] đã sắp xếp và không giao nhau.
+    """
+
+    def __init__(self, intervals: List[Tuple[int, int]]):
+        merged: List[List[int]] = []
+        for lo, hi in sorted(intervals):
+            if hi < lo:
+                continue
+            if merged and lo <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+        self.lows = [m[0] for m in merged]
+        self.highs = [m[1] for m in merged]
+
+    def __bool__(self):
+        return bool(self.lows)
+
+    def next_at_or_after(self, x: int) -> Optional[int]:
+        """Thời điểm bắt đầu hợp lệ nhỏ nhất >= x (None nếu không có)"""
+        i = bisect.bisect_right(self.highs, x - 1)
+        if i >= len(self.lows):
+            return None
+        return max(x, self.lows[i])
+
+    def clip(self, lo: int, hi: int) -> List[int]:
+        """Các đoạn nằm trong [lo, hi], dạng phẳng cho `Domain.FromFlatIntervals`"""
+        flat: List[int] = []
+        i = bisect.bisect_right(self.highs, lo - 1)
+        while i < len(self.lows) and self.lows[i] <= hi:
+            flat.extend((max(lo, self.lows[i]), min(hi, self.highs[i])))
+            i += 1
+        return flat
+
+
+def planning_horizon(config: Dict[str, Any], total_duration: int) -> int:
+    """Horizon mặc định: `horizon_minutes` của config, tối thiểu tổng duration + 1 tuần dư ra"""
+    config_horizon = int(config.get("horizon_minutes", 100000))
+    return max(config_horizon, total_duration + 10080)
+
+
+def free_start_intervals(windows: List[Tuple[int, int]], duration: int) -> List[Tuple[int, int]]:
+    """
+    Các đoạn start hợp lệ để task dài `duration` nằm trọn trong một khoảng trống của lịch máy
+    (`windows`: các cặp (start, end) giờ nghỉ)
+    """
+    intervals = []
+    current = 0
+    for start, end in sorted(windows):
+        if end <= start:
+            continue
+        if start - current >= duration:
+            intervals.append((current, start - duration))
+        current = max(current, end)
+    intervals.append((current, OPEN_END))
+    return intervals
+
+
+def dependency_edges(tasks: List[Dict[str, Any]]) -> List[Tuple[str, str, str, int]]:
+    """
+    Cạnh phụ thuộc (cha, con, loại, lag) đúng như `_build_model` áp dụng:
+    - "end":   con.start >= cha.end
+    - "start": con.start >= cha.start + lag (interleaved batching qua sub_task_completion_offsets)
+    """
+    by_id = {t.get("task_id"): t for t in tasks if t.get("task_id")}
+    edges = []
+    for t_id, t in by_id.items():
+        child_order_id = t.get("original_order_id")
+        for parent_id in t.get("final_depends_on") or []:
+            if parent_id not in by_id:
+                continue
+            offsets = by_id[parent_id].get("sub_task_completion_offsets") or {}
+            if offsets and child_order_id and child_order_id in offsets:
+                edges.append((parent_id, t_id, "start", int(offsets[child_order_id])))
+            else:
+                edges.append((parent_id, t_id, "end", 0))
+        prev_id = t.get("internal_dep")
+        if prev_id and prev_id in by_id:
+            edges.append((prev_id, t_id, "end", 0))
+    return edges
+
+
+def topological_order(task_ids: List[str], edges: List[Tuple[str, str, str, int]]) -> List[str]:
+    children: Dict[str, List[str]] = {t_id: [] for t_id in task_ids}
+    in_degree = {t_id: 0 for t_id in task_ids}
+    for parent_id, child_id, _, _ in edges:
+        children[parent_id].append(child_id)
+        in_degree[child_id] += 1
+
+    queue = [t_id for t_id in task_ids if in_degree[t_id] == 0]
+    order = []
+    while queue:
+        t_id = queue.pop()
+        order.append(t_id)
+        for c_id in children[t_id]:
+            in_degree[c_id] -= 1
+            if in_degree[c_id] == 0:
+                queue.append(c_id)
+
+    if len(order) < len(task_ids):
+        in_cycle = sorted(t_id for t_id, d in in_degree.items() if d > 0)
+        raise DependencyCycleError(
+            f"Dependency cycle detected among {len(in_cycle)} tasks: {in_cycle[:10]}"
+        )
+    return order
+
+
+def order_sinks(tasks: List[Dict[str, Any]], edges: List[Tuple[str, str, str, int]]) -> Dict[str, List[str]]:
+    """
+    Task cuối của từng đơn (`original_order_id`): task không có task con cùng đơn qua cạnh "end".
+    Mọi task khác của đơn kết thúc trước start của một task cuối, nên makespan và trễ hạn của
+    đơn chỉ cần xét các task này. Task không có mã đơn là một đơn riêng (khoá là task_id).
+    """
+    order_of = {t.get("task_id"): t.get("original_order_id") or "" for t in tasks if t.get("task_id")}
+    has_next = {parent_id for parent_id, child_id, kind, _ in edges
+                if kind == "end" and order_of[parent_id] and order_of[parent_id] == order_of[child_id]}
+    sinks: Dict[str, List[str]] = {}
+    for t_id, order_id in order_of.items():
+        if t_id not in has_next:
+            sinks.setdefault(order_id or t_id, []).append(t_id)
+    return sinks
+
+
+def compute_time_bounds(tasks: List[Dict[str, Any]], horizon: int,
+                        frozen: Optional[Dict[str, Dict[str, Any]]] = None,
+                        feasible_starts: Optional[Dict[str, FeasibleStarts]] = None):
+    """
+    Phân tích đường dài nhất tiến/lùi trên DAG phụ thuộc.
+
+    Trả về ({task_id: (earliest_start, latest_end)}, horizon). Earliest start tính từ
+    start_after_min và các task cha (có snap sang khoảng trống đầu tiên đủ chỗ nếu có
+    `feasible_starts`), latest end tính ngược từ horizon theo chuỗi task con.
+    Nếu chuỗi dài nhất không vừa horizon thì horizon được nới ra.
+    """
+    frozen = frozen or {}
+    feasible_starts = feasible_starts or {}
+    by_id = {t.get("task_id"): t for t in tasks if t.get("task_id")}
+    edges = dependency_edges(tasks)
+    order = topological_order(list(by_id), edges)
+
+    duration = {}
+    for t_id, t in by_id.items():
+        if t_id in frozen:
+            duration[t_id] = int(frozen[t_id]["end_min"]) - int(frozen[t_id]["start_min"])
+        else:
+            duration[t_id] = int(t.get("duration") or 0)
+
+    parents: Dict[str, List[Tuple[str, str, int]]] = {t_id: [] for t_id in by_id}
+    children: Dict[str, List[Tuple[str, str, int]]] = {t_id: [] for t_id in by_id}
+    for parent_id, child_id, kind, lag in edges:
+        parents[child_id].append((parent_id, kind, lag))
+        children[parent_id].append((child_id, kind, lag))
+
+    # Forward pass: earliest start
+    est: Dict[str, int] = {}
+    for t_id in order:
+        if t_id in frozen:
+            est[t_id] = int(frozen[t_id]["start_min"])
+            continue
+        value = int(by_id[t_id].get("start_after_min") or 0)
+        for parent_id, kind, lag in parents[t_id]:
+            if kind == "start":
+                value = max(value, est[parent_id] + lag)
+            else:
+                value = max(value, est[parent_id] + duration[parent_id])
+        starts = feasible_starts.get(t_id)
+        if starts:
+            snapped = starts.next_at_or_after(value)
+            if snapped is not None:
+                value = snapped
+        est[t_id] = value
+
+    # Backward pass: latest start (tính theo horizon, nới horizon nếu thiếu)
+    def backward(h: int) -> Dict[str, int]:
+        lst: Dict[str, int] = {}
+        for t_id in reversed(order):
+            if t_id in frozen:
+                lst[t_id] = est[t_id]
+                continue
+            value = h - duration[t_id]
+            for child_id, kind, lag in children[t_id]:
+                if kind == "start":
+                    value = min(value, lst[child_id] - lag)
+                else:
+                    value = min(value, lst[child_id] - duration[t_id])
+            lst[t_id] = value
+        return lst
+
+    lst = backward(horizon)
+    deficit = max((est[t_id] - lst[t_id] for t_id in by_id if t_id not in frozen), default=0)
+    if deficit > 0:
+        horizon += deficit
+        lst = backward(horizon)
+
+    bounds = {t_id: (est[t_id], lst[t_id] + duration[t_id]) for t_id in by_id}
+    return bounds, horizon
@@ -0,0 +1,265 @@
+import logging
+import os
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from .analysis import DependencyCycleError, dependency_edges, order_sinks, topological_order
+
+logger = logging.getLogger(__name__)
+
+# Task giặt lẻ được gom khi release / hạn lệch nhau không quá BATCH_WINDOW_MINUTES
+BATCH_WINDOW_MINUTES = int(os.getenv("BATCH_WINDOW_MINUTES", "480"))
+BATCH_MAX_MEMBERS = int(os.getenv("BATCH_MAX_MEMBERS", "10"))
+
+AUTO_BATCH_PREFIX = "AUTOBATCH:"
+
+
+def _is_cumulative(r: Dict[str, Any]) -> bool:
+    return r.get("type") == "batch" or r.get("operation") == "washing"
+
+
+def _candidates(payload: Dict[str, Any], frozen: Dict[str, Dict[str, Any]]) -> Dict[str, Tuple[Any, int]]:
+    """
+    Task gom được: không phải mẻ sẵn, không frozen, không thuộc chuỗi slice, mọi máy tương
+    thích là cumulative và qty vừa capacity nhỏ nhất của chúng. Trả về task_id -> (khoá nhóm, capacity).
+    """
+    resources = {r["id"]: r for r in payload.get("resources", [])}
+    tasks = [t for t in payload.get("tasks", []) if t.get("task_id")]
+    sliced = {t["internal_dep"] for t in tasks if t.get("internal_dep")}
+    result = {}
+    for t in tasks:
+        t_id = t["task_id"]
+        compatible = t.get("compatible_resource_ids") or []
+        if (t.get("is_batch") or t.get("sub_tasks") or t.get("sub_task_completion_offsets") or t_id in frozen
+                or t.get("internal_dep") or t_id in sliced or not compatible
+                or not all(r_id in resources and _is_cumulative(resources[r_id]) for r_id in compatible)):
+            continue
+        capacity = min(int(resources[r_id].get("capacity", 100)) for r_id in compatible)
+        qty = float(t.get("qty") or 0)
+        if qty <= 0 or qty >= capacity or int(t.get("duration") or 0) <= 0:
+            continue
+        key = (t.get("operation"), t.get("design_item_id"), tuple(sorted(set(compatible))), bool(t.get("can_pause")))
+        result[t_id] = (key, capacity)
+    return result
+
+
+def _batch_levels(payload: Dict[str, Any], candidates) -> Optional[Dict[str, int]]:
+    """
+    Mức của task = số task ứng viên lớn nhất trên một đường phụ thuộc đi tới nó (không tính
+    chính nó). Chỉ gom task cùng mức: đường phụ thuộc giữa hai mẻ luôn đi lên mức cao hơn
+    nên model sau khi gom không có chu trình. None nếu payload đã có chu trình.
+    """
+    tasks = [t for t in payload.get("tasks", []) if t.get("task_id")]
+    edges = dependency_edges(tasks)
+    try:
+        order = topological_order([t["task_id"] for t in tasks], edges)
+    except DependencyCycleError:
+        return None
+    parents: Dict[str, List[str]] = {}
+    for parent_id, child_id, _, _ in edges:
+        parents.setdefault(child_id, []).append(parent_id)
+    level: Dict[str, int] = {}
+    for t_id in order:
+        level[t_id] = max((level[p] + (p in candidates) for p in parents.get(t_id, [])), default=0)
+    return level
+
+
+def plan_batches(payload: Dict[str, Any], frozen: Optional[Dict[str, Dict[str, Any]]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Gom task giặt lẻ thành mẻ vừa capacity: cùng công đoạn, mã hàng, tập máy; release và
+    hạn lệch nhau không quá `batch_window_minutes`; tối đa `batch_max_members` task một mẻ.
+    Trong nhóm, task xếp theo (release, hạn) và được gom tham lam. Chỉ trả về mẻ >= 2 task.
+    Task cuối của đơn (`order_sinks`) chỉ gom với task cuối cùng đơn: mẻ mang mã đơn của task
+    đầu tiên, nên trộn đơn sẽ làm mất trễ hạn của các đơn còn lại trong mục tiêu.
+    """
+    config = payload.get("config") or {}
+    window = int(config.get("batch_window_minutes") or BATCH_WINDOW_MINUTES)
+    max_members = int(config.get("batch_max_members") or BATCH_MAX_MEMBERS)
+    candidates = _candidates(payload, frozen or {})
+    if len(candidates) < 2:
+        return []
+    levels = _batch_levels(payload, candidates)
+    if levels is None:
+        return []
+
+    tasks = [t for t in payload.get("tasks", []) if t.get("task_id")]
+    sinks = {t_id for ids in order_sinks(tasks, dependency_edges(tasks)).values() for t_id in ids}
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for t in tasks:
+        t_id = t["task_id"]
+        if t_id in candidates:
+            order = (t.get("original_order_id") or t_id) if t_id in sinks else None
+            groups.setdefault((candidates[t_id][0], levels[t_id], order), []).append(t)
+
+    batches = []
+    for members in groups.values():
+        capacity = candidates[members[0]["task_id"]][1]
+        members.sort(key=lambda t: (int(t.get("start_after_min") or 0), int(t.get("due_at_min") or 0) or float("inf"),
+                                    t["task_id"]))
+        current: List[Dict[str, Any]] = []
+        for t in members:
+            if current and not _fits(current, t, capacity, window, max_members):
+                batches.append(current)
+                current = []
+            current.append(t)
+        batches.append(current)
+    return [b for b in batches if len(b) > 1]
+
+
+def _fits(batch: List[Dict[str, Any]], t: Dict[str, Any], capacity: int, window: int, max_members: int) -> bool:
+    if len(batch) >= max_members or sum(float(m.get("qty") or 0) for m in batch) + float(t.get("qty") or 0) > capacity:
+        return False
+    if int(t.get("start_after_min") or 0) - int(batch[0].get("start_after_min") or 0) > window:
+        return False
+    dues = [int(m.get("due_at_min") or 0) for m in batch + [t] if m.get("due_at_min")]
+    return not dues or max(dues) - min(dues) <= window
+
+
+def batch_task(batch_id: str, members: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Task mẻ như backend vẫn gửi: qty là tổng, thời lượng là chu kỳ dài nhất, hạn sớm nhất,
+    `sub_tasks` là các task lẻ. Mã đơn lấy theo task đầu tiên: mẻ trộn đơn chỉ gồm task có task
+    con cùng đơn (xem `plan_batches`), nên không mẻ nào là task cuối của đơn khác. Không đặt `sub_task_completion_offsets`: cả mẻ ra khỏi máy giặt
+    cùng lúc nên task sau của mọi đơn phải chờ hết chu kỳ (cạnh "end" như khi chưa gộp).
+    """
+    first = members[0]
+    duration = max(int(m.get("duration") or 0) for m in members)
+    dues = [int(m["due_at_min"]) for m in members if m.get("due_at_min")]
+    member_ids = {m["task_id"] for m in members}
+
+    def merged(field):
+        return list(dict.fromkeys(p for m in members for p in m.get(field) or [] if p not in member_ids))
+
+    qty = round(sum(float(m.get("qty") or 0) for m in members))
+    return {
+        "task_id": batch_id,
+        "original_order_id": first.get("original_order_id", ""),
+        "group_id": first.get("group_id", ""),
+        "operation": first.get("operation", ""),
+        "qty": qty,
+        "total_qty": qty,
+        "priority": min(int(m.get("priority") or 3) for m in members),
+        "original_depends_on": merged("original_depends_on"),
+        "final_depends_on": merged("final_depends_on"),
+        "start_after_min": max(int(m.get("start_after_min") or 0) for m in members),
+        "due_at_min": min(dues) if dues else 0,
+        "duration": duration,
+        "is_batch": True,
+        "design_item_id": first.get("design_item_id", ""),
+        "compatible_resource_ids": list(first.get("compatible_resource_ids") or []),
+        "can_pause": bool(first.get("can_pause")),
+        "sub_tasks": [{
+            "task_id": m["task_id"],
+            "original_order_id": m.get("original_order_id", ""),
+            "group_id": m.get("group_id", ""),
+            "operation": m.get("operation", ""),
+            "qty": m.get("qty", 0),
+            "duration": int(m.get("duration") or 0),
+            "design_item_id": m.get("design_item_id", ""),
+        } for m in members],
+    }
+
+
+def batch_payload(payload: Dict[str, Any], batches: List[List[Dict[str, Any]]]) -> Tuple[Dict[str, Any], Dict[str, List[Dict[str, Any]]]]:
+    """Payload đã thay task lẻ bằng task mẻ (phụ thuộc vào task lẻ chuyển sang mẻ); trả về kèm mẻ -> task lẻ"""
+    members_of = {f"{AUTO_BATCH_PREFIX}{k}": members for k, members in enumerate(batches)}
+    batch_of = {m["task_id"]: batch_id for batch_id, members in members_of.items() for m in members}
+
+    def rewire(ids):
+        return list(dict.fromkeys(batch_of.get(p, p) for p in ids))
+
+    tasks = []
+    for t in payload.get("tasks", []):
+        if t.get("task_id") in batch_of:
+            continue
+        if any(p in batch_of for p in (t.get("final_depends_on") or []) + (t.get("original_depends_on") or [])):
+            t = dict(t, final_depends_on=rewire(t.get("final_depends_on") or []),
+                     original_depends_on=rewire(t.get("original_depends_on") or []))
+        tasks.append(t)
+    tasks += [batch_task(batch_id, members) for batch_id, members in members_of.items()]
+    config = dict(payload.get("config") or {}, auto_batching=False)
+    return dict(payload, config=config, tasks=tasks), members_of
+
+
+def expand_batches(result: Dict[str, Any], members_of: Dict[str, List[Dict[str, Any]]]) -> None:
+    """
+    Đổi assignment / overload của task mẻ về các task lẻ: mỗi task lẻ chiếm trọn mẻ
+    (cùng máy, start, end, kèm `batch_id`); trễ hạn tính lại theo hạn của từng task lẻ.
+    """
+    assignments = []
+    for a in result.get("assignments") or []:
+        members = members_of.get(a["task_id"])
+        if not members:
+            assignments.append(a)
+            continue
+        for m in members:
+            assignments.append(dict(a, task_id=m["task_id"], order_id=m.get("original_order_id", ""),
+                                    batch_id=a["task_id"]))
+    if "assignments" in result:
+        result["assignments"] = assignments
+
+    end_of = {a["task_id"]: a for a in assignments}
+    overloads = []
+    for o in result.get("overloads") or []:
+        members = members_of.get(o["task_id"])
+        if not members:
+            overloads.append(o)
+        elif o["status"] == "DROPPED":
+            overloads += [dict(o, task_id=m["task_id"], order_id=m.get("original_order_id", "")) for m in members]
+    for members in members_of.values():
+        for m in members:
+            a = end_of.get(m["task_id"])
+            due = int(m.get("due_at_min") or 0)
+            if a and due > 0 and a["end_min"] > due:
+                overloads.append({
+                    "task_id": m["task_id"],
+                    "order_id": m.get("original_order_id", ""),
+                    "status": "LATE",
+                    "delay_minutes": a["end_min"] - due,
+                    "root_cause_code": "CAPACITY_FULL",
+                    "bottleneck_resource_id": a["machine_id"],
+                })
+    if "overloads" in result:
+        result["overloads"] = overloads
+
+
+def _to_batch_schedule(schedule: Dict[str, Dict[str, Any]], members_of: Dict[str, List[Dict[str, Any]]]):
+    """Hint theo task lẻ -> hint cho mẻ (lấy task lẻ đầu tiên có hint)"""
+    converted = dict(schedule)
+    for batch_id, members in members_of.items():
+        hinted = [schedule[m["task_id"]] for m in members if m["task_id"] in schedule]
+        if hinted:
+            converted[batch_id] = hinted[0]
+    return converted
+
+
+def solve_batched(payload: Dict[str, Any], frozen: Optional[Dict[str, Dict[str, Any]]] = None,
+                  hints: Optional[Dict[str, Dict[str, Any]]] = None,
+                  progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  should_cancel: Optional[Callable[[], bool]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Chế độ `auto_batching`: gom task giặt lẻ thành mẻ (`plan_batches`), giải trên payload
+    đã gom rồi trả kết quả theo ID task gốc. Trả None nếu không gom được mẻ nào.
+    """
+    from .engine import Engine
+
+    batches = plan_batches(payload, frozen)
+    if not batches:
+        return None
+    batched, members_of = batch_payload(payload, batches)
+    logger.info("washing tasks batched", extra={
+        "batches": len(batches), "tasks": sum(len(b) for b in batches),
+        "removed": sum(len(b) for b in batches) - len(batches),
+    })
+
+    def batch_progress(event):
+        if event.get("assignments"):
+            expand_batches(event, members_of)
+        progress(event)
+
+    result = Engine(
+        batched, frozen=frozen, hints=_to_batch_schedule(hints or {}, members_of),
+        progress=batch_progress if progress else None, should_cancel=should_cancel,
+    ).solve()
+    expand_batches(result, members_of)
+    result["batching"] = {"batches": len(batches), "tasks": sum(len(b) for b in batches)}
+    return result
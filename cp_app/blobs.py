@@ -0,0 +1,54 @@
+import os
+from typing import Any, Optional
+
+import msgpack
+import zstandard
+
+BLOB_TTL_SECONDS = int(os.getenv("BLOB_TTL_SECONDS", str(24 * 3600)))
+BLOB_ZSTD_LEVEL = int(os.getenv("BLOB_ZSTD_LEVEL", "3"))
+
+
+def payload_key(celery_task_id: str) -> str:
+    return f"cp:blob:payload:{celery_task_id}"
+
+
+def result_key(celery_task_id: str) -> str:
+    return f"cp:blob:result:{celery_task_id}"
+
+
+def encode_blob(obj: Any) -> bytes:
+    """msgpack + zstd (frame ghi sẵn kích thước gốc để giải nén một lần)"""
+    packed = msgpack.packb(obj, use_bin_type=True)
+    return zstandard.ZstdCompressor(level=BLOB_ZSTD_LEVEL).compress(packed)
+
+
+def decode_blob(data: bytes) -> Any:
+    raw = zstandard.ZstdDecompressor().decompress(data)
+    # unpackb đọc thẳng trên buffer, không copy thêm
+    return msgpack.unpackb(memoryview(raw), raw=False, strict_map_key=False)
+
+
+class BlobStore:
+    """
+    Payload / kết quả lớn lưu một lần trên Redis dạng nén; message Celery và webhook
+    chỉ mang key tham chiếu thay vì cả payload JSON.
+    """
+
+    def __init__(self, client, ttl: int = BLOB_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url: str) -> "BlobStore":
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def put(self, key: str, obj: Any) -> int:
+        """Lưu obj tại key, trả về số byte đã nén"""
+        data = encode_blob(obj)
+        self.client.set(key, data, ex=self.ttl)
+        return len(data)
+
+    def get(self, key: str) -> Optional[Any]:
+        data = self.client.get(key)
+        return decode_blob(data) if data else None
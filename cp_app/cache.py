@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Any, Optional
+
+from .blobs import encode_blob, decode_blob
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(6 * 3600)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+INFLIGHT_TTL_SECONDS = int(os.getenv("INFLIGHT_TTL_SECONDS", str(2 * 3600)))
+
+# Các khoá config không ảnh hưởng tới lịch kết quả
+NON_SEMANTIC_CONFIG_KEYS = {"hint_key", "progress_throttle_seconds", "progress_assignments"}
+
+# Giữ fingerprint cho task mới, hoặc ghi tên chờ vào task đang giữ (một bước nguyên tử, để job
+# không lọt giữa lúc task đang chạy xong và lúc ghi tên chờ)
+# KEYS: inflight, waiters, task -> fingerprint; ARGV: task ID, job ID, TTL, fingerprint
+_JOIN_INFLIGHT_SCRIPT = """
+local running = redis.call('GET', KEYS[1])
+if running then
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return running
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+redis.call('SET', KEYS[3], ARGV[4], 'EX', ARGV[3])
+return false
+"""
+
+INDEX_KEY = "cp:cache:index"   # sorted set: fingerprint -> thời điểm lưu
+SIZES_KEY = "cp:cache:sizes"   # hash: fingerprint -> số byte
+BYTES_KEY = "cp:cache:bytes"   # tổng số byte đang lưu
+
+
+def _result_key(fingerprint: str) -> str:
+    return f"cp:cache:result:{fingerprint}"
+
+
+def _inflight_key(fingerprint: str) -> str:
+    return f"cp:cache:inflight:{fingerprint}"
+
+
+def _task_fingerprint_key(celery_task_id: str) -> str:
+    return f"cp:cache:task:{celery_task_id}"
+
+
+def _waiters_key(fingerprint: str) -> str:
+    return f"cp:cache:waiters:{fingerprint}"
+
+
+def _sorted_strings(values) -> List[str]:
+    return sorted(str(v) for v in (values or []))
+
+
+def _normalize_task(t: Dict[str, Any]) -> Dict[str, Any]:
+    t = dict(t)
+    for field in ("compatible_resource_ids", "final_depends_on", "original_depends_on"):
+        t[field] = _sorted_strings(t.get(field))
+    if t.get("sub_tasks"):
+        t["sub_tasks"] = sorted((_normalize_task(s) for s in t["sub_tasks"]), key=lambda s: str(s.get("task_id")))
+    return t
+
+
+def payload_fingerprint(payload: Dict[str, Any]) -> str:
+    """
+    Hash nội dung của payload đã chuẩn hoá: bỏ `job_id`, sắp task / resource / machine
+    theo ID và các danh sách bên trong theo giá trị, để hai payload giống nhau về ngữ nghĩa
+    (chỉ khác thứ tự hoặc job_id) có cùng fingerprint.
+    """
+    config = {k: v for k, v in (payload.get("config") or {}).items() if k not in NON_SEMANTIC_CONFIG_KEYS}
+    resources = []
+    for r in payload.get("resources") or []:
+        r = dict(r)
+        r["unavailability"] = sorted(
+            (int(w["start"]), int(w["end"])) for w in (r.get("unavailability") or [])
+        )
+        resources.append(r)
+    machines = []
+    for m in payload.get("machines") or []:
+        m = dict(m)
+        m["routing"] = sorted(m.get("routing") or [], key=lambda x: json.dumps(x, sort_keys=True))
+        machines.append(m)
+
+    normalized = {
+        "config": config,
+        "resources": sorted(resources, key=lambda r: str(r["id"])),
+        "machines": sorted(machines, key=lambda m: str(m["id"])),
+        "tasks": sorted((_normalize_task(t) for t in payload.get("tasks") or []), key=lambda t: str(t.get("task_id"))),
+    }
+    data = json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache kết quả theo fingerprint payload trên Redis, có TTL và giới hạn tổng dung lượng
+    (evict bản cũ nhất trước). Đồng thời theo dõi task đang chạy cho mỗi fingerprint để
+    request trùng được gộp vào task đó thay vì xếp hàng một lần solve mới.
+    """
+
+    def __init__(self, client, ttl: int = RESULT_CACHE_TTL_SECONDS, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.client = client
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_url(cls, url: str) -> "ResultCache":
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        data = self.client.get(_result_key(fingerprint))
+        if not data:
+            return None
+        try:
+            return decode_blob(data)
+        except Exception:
+            # Bản ghi cũ (JSON) hoặc hỏng -> coi như cache miss
+            return None
+
+    def put(self, fingerprint: str, result: Dict[str, Any]) -> None:
+        data = encode_blob(result)
+        old_size = int(self.client.hget(SIZES_KEY, fingerprint) or 0)
+        pipe = self.client.pipeline()
+        pipe.set(_result_key(fingerprint), data, ex=self.ttl)
+        pipe.zadd(INDEX_KEY, {fingerprint: time.time()})
+        pipe.hset(SIZES_KEY, fingerprint, len(data))
+        pipe.incrby(BYTES_KEY, len(data) - old_size)
+        pipe.execute()
+        self._evict()
+
+    def _evict(self) -> None:
+        # Bỏ các bản đã hết TTL khỏi index, rồi evict bản cũ nhất tới khi dưới giới hạn
+        expired = self.client.zrangebyscore(INDEX_KEY, 0, time.time() - self.ttl)
+        for fingerprint in expired:
+            self._drop(fingerprint)
+        while int(self.client.get(BYTES_KEY) or 0) > self.max_bytes:
+            oldest = self.client.zrange(INDEX_KEY, 0, 0)
+            if not oldest:
+                break
+            self._drop(oldest[0])
+
+    def _drop(self, fingerprint) -> None:
+        if isinstance(fingerprint, bytes):
+            fingerprint = fingerprint.decode()
+        size = int(self.client.hget(SIZES_KEY, fingerprint) or 0)
+        pipe = self.client.pipeline()
+        pipe.delete(_result_key(fingerprint))
+        pipe.zrem(INDEX_KEY, fingerprint)
+        pipe.hdel(SIZES_KEY, fingerprint)
+        pipe.decrby(BYTES_KEY, size)
+        pipe.execute()
+
+    def join_inflight(self, fingerprint: str, celery_task_id: str, job_id: str) -> Optional[str]:
+        """
+        Đánh dấu fingerprint đang được giải bởi `celery_task_id` (trả về None), hoặc nếu đã có
+        task khác giữ thì ghi `job_id` vào danh sách chờ của task đó và trả về task ID của nó
+        """
+        running = self.client.eval(_JOIN_INFLIGHT_SCRIPT, 3, _inflight_key(fingerprint), _waiters_key(fingerprint),
+                                   _task_fingerprint_key(celery_task_id), celery_task_id, job_id,
+                                   INFLIGHT_TTL_SECONDS, fingerprint)
+        if not running:
+            return None
+        return running.decode() if isinstance(running, bytes) else running
+
+    def inflight_fingerprint(self, celery_task_id: str) -> Optional[str]:
+        """Fingerprint mà task đang giữ (None nếu task không giữ fingerprint nào hoặc đã xong)"""
+        fingerprint = self.client.get(_task_fingerprint_key(celery_task_id))
+        if not fingerprint:
+            return None
+        fingerprint = fingerprint.decode()
+        return fingerprint if self.inflight_task(fingerprint) == celery_task_id else None
+
+    def inflight_task(self, fingerprint: str) -> Optional[str]:
+        existing = self.client.get(_inflight_key(fingerprint))
+        return existing.decode() if existing else None
+
+    def remove_waiter(self, fingerprint: str, job_id: str) -> bool:
+        """Bỏ job khỏi danh sách chờ (VD job huỷ riêng phần của mình); False nếu job không có trong danh sách"""
+        return bool(self.client.lrem(_waiters_key(fingerprint), 1, job_id))
+
+    def waiters(self, fingerprint: str) -> List[str]:
+        """Các job đang chờ kết quả của task giữ fingerprint"""
+        return [w.decode() if isinstance(w, bytes) else w for w in self.client.lrange(_waiters_key(fingerprint), 0, -1)]
+
+    def finish_inflight(self, fingerprint: str) -> List[str]:
+        """Bỏ đánh dấu đang chạy và trả về các job đã gộp vào task này"""
+        pipe = self.client.pipeline()
+        pipe.lrange(_waiters_key(fingerprint), 0, -1)
+        pipe.delete(_waiters_key(fingerprint), _inflight_key(fingerprint))
+        waiters, _ = pipe.execute()
+        return [w.decode() if isinstance(w, bytes) else w for w in waiters]
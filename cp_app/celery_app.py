@@ -1,13 +1,29 @@
 import os
+import resource
 from celery import Celery
+from celery.signals import (celeryd_init, setup_logging, task_postrun, task_prerun, worker_init,
+                            worker_process_shutdown)
+from kombu import Queue
+
+from .observability import PROMETHEUS_MULTIPROC_DIR, WORKER_PEAK_RSS, bind_job_context, configure_logging, \
+    metrics_registry, unbind_job_context
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+INTERACTIVE_QUEUE = os.getenv("INTERACTIVE_QUEUE", "interactive")
+BATCH_QUEUE = os.getenv("BATCH_QUEUE", "batch")
+WEBHOOK_QUEUE = os.getenv("WEBHOOK_QUEUE", "webhooks")
+# Cổng HTTP /metrics của worker (0 = tắt). Với pool prefork cần đặt PROMETHEUS_MULTIPROC_DIR
+# để process con ghi metric ra file và process chính gộp lại
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+# Process con có RSS vượt ngưỡng (MB) sau một task được thay bằng process mới: bộ nhớ của model lớn
+# không được trả lại hệ điều hành. Mặc định: phần ngân sách bộ nhớ của một lời giải (xem governor), -1 = tắt
+WORKER_MAX_MEMORY_PER_CHILD_MB = int(os.getenv("WORKER_MAX_MEMORY_PER_CHILD_MB", "0"))
 
 celery_app = Celery(
     "solver_worker",
     broker=REDIS_URL,
     backend=REDIS_URL,
-    include=['cp_app.tasks']  # Import tasks module
+    include=['cp_app.tasks', 'cp_app.delivery']  # Import tasks modules
 )
 
 celery_app.conf.update(
@@ -17,4 +33,76 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
     task_acks_late=True,
-)
\ No newline at end of file
+    # Job nhỏ (what-if) và job lớn (kế hoạch cả nhà máy) nằm ở hai hàng đợi riêng:
+    #   celery -A cp_app.celery_app worker -Q interactive -c 4
+    #   celery -A cp_app.celery_app worker -Q batch -c 1
+    # Webhook gửi ở hàng đợi riêng (I/O, không chiếm worker giải):
+    #   celery -A cp_app.celery_app worker -Q webhooks -c 8
+    task_queues=(Queue(INTERACTIVE_QUEUE), Queue(BATCH_QUEUE), Queue(WEBHOOK_QUEUE)),
+    task_default_queue=BATCH_QUEUE,
+    # Mỗi process chỉ giữ một job, job dài không giữ chỗ của job đang chờ
+    worker_prefetch_multiplier=1,
+    broker_transport_options={"priority_steps": list(range(10)), "queue_order_strategy": "priority"},
+)
+
+if os.getenv("CELERY_WORKER_CONCURRENCY"):
+    celery_app.conf.worker_concurrency = int(os.getenv("CELERY_WORKER_CONCURRENCY"))
+
+
+@celeryd_init.connect
+def _record_concurrency(sender=None, conf=None, options=None, **kwargs):
+    """Ghi lại concurrency của worker (`-c`) để chia ngân sách CPU cho từng lời giải"""
+    if options and options.get("concurrency"):
+        conf.worker_concurrency = int(options["concurrency"])
+    _set_max_memory_per_child(conf)
+
+
+def _set_max_memory_per_child(conf):
+    """`worker_max_memory_per_child` (KB): billiard so với RSS của process con sau mỗi task (peak RSS qua getrusage khi không có psutil)"""
+    limit_mb = WORKER_MAX_MEMORY_PER_CHILD_MB
+    if not limit_mb:
+        from .governor import GOVERNOR_BASE_MB, solver_memory_share
+        # Process con rỗng (Python + OR-Tools) đã chiếm GOVERNOR_BASE_MB: không thay sau mỗi task
+        limit_mb = max(solver_memory_share(conf.worker_concurrency or os.cpu_count()), 2 * GOVERNOR_BASE_MB)
+    if limit_mb > 0:
+        conf.worker_max_memory_per_child = limit_mb * 1024
+
+
+@setup_logging.connect
+def _setup_logging(**kwargs):
+    """Dùng log có cấu trúc (JSON) thay cho cấu hình logging mặc định của Celery"""
+    configure_logging()
+
+
+_job_tokens = {}
+
+
+@task_prerun.connect
+def _bind_job(task_id=None, task=None, args=None, kwargs=None, **extra):
+    kwargs = kwargs or {}
+    payload = args[0] if args and isinstance(args[0], dict) else {}
+    _job_tokens[task_id] = bind_job_context(celery_task_id=task_id, task=task.name if task else None,
+                                            job_id=kwargs.get("job_id") or payload.get("job_id"))
+
+
+@task_postrun.connect
+def _after_task(task_id=None, task=None, **extra):
+    WORKER_PEAK_RSS.labels(task=task.name if task else "").observe(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    token = _job_tokens.pop(task_id, None)
+    if token is not None:
+        unbind_job_context(token)
+
+
+@worker_init.connect
+def _start_metrics_server(**kwargs):
+    if WORKER_METRICS_PORT:
+        from prometheus_client import start_http_server
+        start_http_server(WORKER_METRICS_PORT, registry=metrics_registry())
+
+
+@worker_process_shutdown.connect
+def _mark_metrics_process_dead(pid=None, **kwargs):
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
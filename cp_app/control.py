@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from ortools.sat.python import cp_model
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_POLL_SECONDS = 1.0
+
+
+def cancel_key(celery_task_id: str) -> str:
+    """Khoá Redis báo worker dừng lần solve đang chạy"""
+    return f"cp:cancel:{celery_task_id}"
+
+
+class RedisCancellation:
+    """
+    `should_cancel` đọc cờ huỷ từ Redis. Client tạo lười (pickle được), dùng chung được
+    giữa các thread giải song song các thành phần độc lập.
+    """
+
+    def __init__(self, url: str, celery_task_id: str):
+        self.url = url
+        self.celery_task_id = celery_task_id
+        self._client = None
+
+    def __getstate__(self):
+        return {"url": self.url, "celery_task_id": self.celery_task_id, "_client": None}
+
+    def __call__(self) -> bool:
+        try:
+            if self._client is None:
+                import redis
+                self._client = redis.Redis.from_url(self.url)
+            return bool(self._client.exists(cancel_key(self.celery_task_id)))
+        except Exception as e:
+            logger.warning("could not check cancellation", extra={"error": str(e)})
+            return False
+
+
+class SolveWatchdog(threading.Thread):
+    """
+    Luồng phụ chạy song song với `CpSolver.Solve`: gọi `StopSearch` khi người dùng huỷ
+    lần solve hoặc khi không có lời giải cải thiện trong `no_improvement_seconds`.
+    Solver vẫn trả về lời giải tốt nhất đã tìm được.
+    """
+
+    def __init__(self, solver: cp_model.CpSolver, callback,
+                 should_cancel: Optional[Callable[[], bool]] = None,
+                 no_improvement_seconds: Optional[float] = None,
+                 poll_seconds: float = WATCHDOG_POLL_SECONDS):
+        super().__init__(daemon=True)
+        self.solver = solver
+        self.callback = callback
+        self.should_cancel = should_cancel
+        self.no_improvement_seconds = no_improvement_seconds
+        self.poll_seconds = poll_seconds
+        self.stop_reason: Optional[str] = None
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.poll_seconds):
+            if self.should_cancel and self.should_cancel():
+                self._stop_search("cancelled")
+                return
+            last = self.callback.last_improvement
+            if self.no_improvement_seconds and last is not None \
+                    and time.monotonic() - last >= self.no_improvement_seconds:
+                self._stop_search("no_improvement")
+                return
+
+    def _stop_search(self, reason: str):
+        logger.info("stopping search early", extra={"reason": reason})
+        self.stop_reason = reason
+        self.solver.StopSearch()
+
+    def finish(self):
+        self._done.set()
+        self.join()
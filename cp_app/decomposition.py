@@ -0,0 +1,462 @@
+import heapq
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Mặc định cho chế độ rolling horizon
+DEFAULT_WINDOW_SIZE = 300     # Số task được chốt sau mỗi cửa sổ
+DEFAULT_WINDOW_OVERLAP = 60   # Số task gối sang cửa sổ kế tiếp (được giải lại)
+MIN_WINDOW_SEARCH_TIME = 5    # Giây tối thiểu cho mỗi cửa sổ
+
+# Mặc định cho chế độ giải song song các bài toán con độc lập
+PARALLEL_MIN_TASKS = 200      # Dưới ngưỡng này giải tuần tự trong process hiện tại
+MIN_COMPONENT_SEARCH_TIME = 5 # Giây tối thiểu cho mỗi bài toán con
+
+
+def _task_id(t: Dict[str, Any]) -> str:
+    return t.get("task_id") or t.get("TaskID")
+
+
+def _parents(t: Dict[str, Any]) -> List[str]:
+    parents = list(t.get("final_depends_on") or t.get("FinalDependsOn") or [])
+    internal = t.get("internal_dep") or t.get("InternalDep")
+    if internal:
+        parents.append(internal)
+    return parents
+
+
+def order_tasks_for_horizon(tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sắp task theo (start_after_min, due_at_min) nhưng vẫn giữ thứ tự topo:
+    task cha luôn đứng trước task con để cửa sổ sau chỉ phụ thuộc cửa sổ trước.
+    """
+    by_id = {_task_id(t): t for t in tasks if _task_id(t)}
+
+    def key(t):
+        release = int(t.get("start_after_min") or 0)
+        due = int(t.get("due_at_min") or 0) or float("inf")
+        return (release, due, _task_id(t))
+
+    children: Dict[str, List[str]] = {t_id: [] for t_id in by_id}
+    in_degree = {t_id: 0 for t_id in by_id}
+    for t_id, t in by_id.items():
+        for p_id in set(_parents(t)):
+            if p_id in by_id and p_id != t_id:
+                children[p_id].append(t_id)
+                in_degree[t_id] += 1
+
+    heap = [(key(t), t_id) for t_id, t in by_id.items() if in_degree[t_id] == 0]
+    heapq.heapify(heap)
+    ordered = []
+    while heap:
+        _, t_id = heapq.heappop(heap)
+        ordered.append(by_id[t_id])
+        for c_id in children[t_id]:
+            in_degree[c_id] -= 1
+            if in_degree[c_id] == 0:
+                heapq.heappush(heap, (key(by_id[c_id]), c_id))
+
+    if len(ordered) < len(by_id):
+        # Có chu trình phụ thuộc: giữ nguyên phần còn lại theo key, model sẽ tự xử lý
+        seen = {_task_id(t) for t in ordered}
+        ordered.extend(sorted((t for t_id, t in by_id.items() if t_id not in seen), key=key))
+    return ordered
+
+
+def merge_windows(windows: List[Dict[str, int]]) -> List[Dict[str, int]]:
+    merged = []
+    for w in sorted(windows, key=lambda x: int(x["start"])):
+        start, end = int(w["start"]), int(w["end"])
+        if end <= start:
+            continue
+        if merged and start <= merged[-1]["end"]:
+            merged[-1]["end"] = max(merged[-1]["end"], end)
+        else:
+            merged.append({"start": start, "end": end})
+    return merged
+
+
+def _is_cumulative(r: Dict[str, Any]) -> bool:
+    return r.get("type") == "batch" or r.get("operation") == "washing"
+
+
+def build_frozen_payload(payload: Dict[str, Any], tasks: List[Dict[str, Any]],
+                         committed: Dict[str, Dict[str, Any]], tasks_by_id: Dict[str, Dict[str, Any]],
+                         config: Dict[str, Any]):
+    """
+    Dựng payload con cho `tasks` với các task đã chốt (`committed`) làm hằng số.
+
+    - Task đã chốt là cha (final_depends_on / internal_dep) của task trong payload
+      được đưa vào dạng frozen để giữ ràng buộc phụ thuộc và cùng máy qua biên cửa sổ.
+    - Các task đã chốt khác trên máy serial được gộp vào `unavailability` của máy.
+    - Trên máy cumulative (giặt) chúng được đưa vào dạng frozen để giữ đúng demand.
+    Task chốt kết thúc trước release nhỏ nhất của payload không ảnh hưởng nên bị bỏ qua.
+    """
+    task_ids = {_task_id(t) for t in tasks}
+    used_resources: Set[str] = set()
+    frozen_ids: Set[str] = set()
+    for t in tasks:
+        used_resources.update(t.get("compatible_resource_ids") or [])
+        for p_id in _parents(t):
+            if p_id in committed and p_id not in task_ids:
+                frozen_ids.add(p_id)
+
+    min_release = min((int(t.get("start_after_min") or 0) for t in tasks), default=0)
+    resource_map = {r["id"]: r for r in payload.get("resources", [])}
+
+    extra_windows: Dict[str, List[Dict[str, int]]] = {}
+    for t_id, a in committed.items():
+        r_id = a["machine_id"]
+        if t_id in frozen_ids or r_id not in used_resources or int(a["end_min"]) <= min_release:
+            continue
+        if _is_cumulative(resource_map.get(r_id, {})):
+            frozen_ids.add(t_id)
+        else:
+            extra_windows.setdefault(r_id, []).append(
+                {"start": int(a["start_min"]), "end": int(a["end_min"])}
+            )
+
+    frozen_resources = {committed[t_id]["machine_id"] for t_id in frozen_ids}
+    resources = []
+    for r in payload.get("resources", []):
+        if r["id"] not in used_resources and r["id"] not in frozen_resources:
+            continue
+        if r["id"] in extra_windows:
+            r = dict(r)
+            r["unavailability"] = merge_windows(list(r.get("unavailability", [])) + extra_windows[r["id"]])
+        resources.append(r)
+
+    frozen = {t_id: committed[t_id] for t_id in frozen_ids}
+    sub_payload = {
+        "job_id": payload.get("job_id"),
+        "config": config,
+        "machines": payload.get("machines", []),
+        "resources": resources,
+        "tasks": [tasks_by_id[t_id] for t_id in frozen_ids] + list(tasks),
+    }
+    return sub_payload, frozen
+
+
+def _sum_hint_stats(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    total = {"kept": 0, "repaired": 0, "missing": 0}
+    for result in results:
+        for k, v in (result.get("hints") or {}).items():
+            total[k] = total.get(k, 0) + v
+    return total
+
+
+def _merged_stop_reason(reasons: List[Optional[str]]) -> Optional[str]:
+    """Lý do dừng của kết quả gộp: "cancelled" nếu một phần bị huỷ, không thì lý do đầu tiên có"""
+    reasons = [r for r in reasons if r]
+    if "cancelled" in reasons:
+        return "cancelled"
+    return reasons[0] if reasons else None
+
+
+def _merged_solver_status(results: List[Dict[str, Any]]) -> str:
+    """OPTIMAL nếu mọi phần OPTIMAL, FEASIBLE nếu mọi phần có lời giải CP-SAT, không thì UNKNOWN"""
+    statuses = {r.get("solver_status") if r["status"] == "feasible" else None for r in results}
+    if statuses <= {"OPTIMAL"}:
+        return "OPTIMAL"
+    return "FEASIBLE" if statuses <= {"OPTIMAL", "FEASIBLE"} else "UNKNOWN"
+
+
+def solve_rolling_horizon(payload: Dict[str, Any], hints: Optional[Dict[str, Dict[str, Any]]] = None,
+                          progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                          should_cancel: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+    """
+    Giải kế hoạch lớn theo các cửa sổ gối nhau (rolling horizon).
+
+    Cửa sổ được cắt theo số task chứ không theo trục thời gian: task xếp theo (release, due)
+    giữ thứ tự topo (`order_tasks_for_horizon`), mỗi cửa sổ gồm `window_size` task được chốt
+    cộng `window_overlap` task gối sang cửa sổ sau. Cắt theo số task giữ kích thước model
+    (và bộ nhớ, xem governor) đều nhau kể cả khi đơn dồn vào vài ngày cao điểm, và task cha
+    luôn nằm ở cửa sổ trước task con. Task đã chốt ở các cửa sổ trước là hằng số trong model
+    của cửa sổ hiện tại. Khi lần solve bị huỷ, các cửa sổ còn lại được xếp bằng heuristic.
+
+    `objective_value` được tính lại một lần trên lịch đã gộp (objective của từng cửa sổ còn
+    tính cả các task đã chốt nên không cộng dồn được).
+    """
+    from .engine import Engine
+
+    config = payload.get("config", {})
+    tasks = [t for t in payload.get("tasks", []) if _task_id(t)]
+    tasks_by_id = {_task_id(t): t for t in tasks}
+    ordered = order_tasks_for_horizon(tasks)
+
+    window_size = max(1, int(config.get("window_size", DEFAULT_WINDOW_SIZE)))
+    overlap = max(0, int(config.get("window_overlap", DEFAULT_WINDOW_OVERLAP)))
+    max_time = int(config.get("max_search_time", 60))
+    config_horizon = int(config.get("horizon_minutes", 100000))
+
+    committed: Dict[str, Dict[str, Any]] = {}
+    assignments: List[Dict[str, Any]] = []
+    overloads: List[Dict[str, Any]] = []
+    windows: List[Dict[str, Any]] = []
+    results: List[Dict[str, Any]] = []
+    all_feasible = True
+
+    logger.info("rolling horizon", extra={"tasks": len(ordered), "window": window_size, "overlap": overlap})
+
+    for w_idx, w_start in enumerate(range(0, len(ordered), window_size)):
+        window_tasks = ordered[w_start:w_start + window_size + overlap]
+        commit_ids = {_task_id(t) for t in ordered[w_start:w_start + window_size]}
+
+        window_duration = sum(int(t.get("duration") or 0) for t in window_tasks)
+        latest_end = max((int(a["end_min"]) for a in committed.values()), default=0)
+        search_time = int(config.get("window_search_time") or max(
+            MIN_WINDOW_SEARCH_TIME, max_time * len(window_tasks) / max(1, len(ordered))
+        ))
+        sub_config = dict(config)
+        sub_config.pop("rolling_horizon", None)
+        sub_config["decompose_components"] = False
+        sub_config["max_search_time"] = search_time
+        sub_config["horizon_minutes"] = max(config_horizon, latest_end + window_duration + 10080)
+        cancelled = bool(should_cancel and should_cancel())
+        if cancelled:
+            sub_config["mode"] = "heuristic"
+
+        sub_payload, frozen = build_frozen_payload(payload, window_tasks, committed, tasks_by_id, sub_config)
+
+        t0 = time.time()
+        window_progress = None
+        if progress:
+            window_progress = lambda event, w_idx=w_idx: progress(dict(event, window=w_idx))
+        result = Engine(sub_payload, frozen=frozen, hints=hints, progress=window_progress,
+                        should_cancel=should_cancel).solve()
+        wall_time = round(time.time() - t0, 3)
+        results.append(result)
+
+        if result["status"] == "feasible":
+            for a in result["assignments"]:
+                if a["task_id"] in commit_ids:
+                    committed[a["task_id"]] = a
+                    assignments.append(a)
+            overloads.extend(o for o in result["overloads"] if o["task_id"] in commit_ids)
+        else:
+            all_feasible = False
+            for t_id in commit_ids:
+                overloads.append({
+                    "task_id": t_id,
+                    "order_id": tasks_by_id[t_id].get("original_order_id", ""),
+                    "status": "DROPPED",
+                    "delay_minutes": 0,
+                    "root_cause_code": "WINDOW_NOT_SOLVED",
+                    "bottleneck_resource_id": ""
+                })
+
+        windows.append({
+            "window": w_idx,
+            "tasks": len(window_tasks),
+            "committed": len(commit_ids),
+            "frozen": len(frozen),
+            "status": result["status"],
+            "objective_value": result.get("objective_value"),
+            "search_time": search_time,
+            "wall_time": wall_time,
+            "stop_reason": "cancelled" if cancelled else result.get("stop_reason"),
+        })
+        logger.info("window solved", extra=windows[-1])
+        if progress:
+            progress(dict(windows[-1], type="window", windows_total=-(-len(ordered) // window_size)))
+
+    from .heuristic import schedule_objective
+    dropped = sum(1 for o in overloads if o["status"] == "DROPPED")
+    return {
+        "status": "feasible" if all_feasible or assignments else "infeasible",
+        "objective_value": schedule_objective(tasks, assignments, dropped),
+        "assignments": assignments,
+        "overloads": overloads,
+        "windows": windows,
+        "hints": _sum_hint_stats(results),
+        "stop_reason": _merged_stop_reason([w["stop_reason"] for w in windows]),
+        "solver_status": _merged_solver_status(results),
+    }
+
+
+def find_independent_components(payload: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+    """
+    Tìm các thành phần liên thông của đồ thị task - máy - phụ thuộc.
+
+    Hai task thuộc cùng một thành phần nếu chúng dùng chung một máy tương thích
+    hoặc nối với nhau qua `final_depends_on` / `internal_dep`.
+    """
+    tasks = [t for t in payload.get("tasks", []) if _task_id(t)]
+    known_resources = {r["id"] for r in payload.get("resources", [])}
+    index = {_task_id(t): i for i, t in enumerate(tasks)}
+    parent = list(range(len(tasks)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[rj] = ri
+
+    first_user: Dict[str, int] = {}
+    for i, t in enumerate(tasks):
+        for r_id in t.get("compatible_resource_ids") or []:
+            if r_id not in known_resources:
+                continue
+            if r_id in first_user:
+                union(first_user[r_id], i)
+            else:
+                first_user[r_id] = i
+        for p_id in _parents(t):
+            if p_id in index:
+                union(index[p_id], i)
+
+    groups: Dict[int, List[Dict[str, Any]]] = {}
+    for i, t in enumerate(tasks):
+        groups.setdefault(find(i), []).append(t)
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def _solve_component(args) -> Dict[str, Any]:
+    from .engine import Engine
+    sub_payload, sub_hints, should_cancel = args
+    t0 = time.time()
+    result = Engine(sub_payload, hints=sub_hints, should_cancel=should_cancel).solve()
+    result["wall_time"] = round(time.time() - t0, 3)
+    return result
+
+
+def _split_budget(sub_config: Dict[str, Any], config: Dict[str, Any], share: float, max_time: float,
+                  cpu_budget: int, pool_size: int, min_time: float = MIN_COMPONENT_SEARCH_TIME) -> None:
+    """
+    Phần thời gian / CPU / bộ nhớ của một thành phần chiếm `share` số task khi `pool_size`
+    thành phần chạy cùng lúc (thời gian không vượt `max_time`)
+    """
+    sub_config["max_search_time"] = int(min(max_time, max(min_time, max_time * share * pool_size)))
+    sub_config["num_search_workers"] = max(1, cpu_budget // pool_size)
+    if config.get("max_memory_mb"):
+        # Các thành phần chạy cùng lúc chia nhau ngân sách bộ nhớ của job
+        sub_config["max_memory_mb"] = max(1, int(config["max_memory_mb"]) // pool_size)
+
+
+def _solve_sequentially(jobs, config: Dict[str, Any], deadline: float, cpu_budget: int) -> List[Dict[str, Any]]:
+    """
+    Giải lần lượt từng thành phần trong hạn chung `deadline`: mỗi thành phần nhận phần thời gian
+    còn lại tỉ lệ với số task của nó (dùng trọn CPU và bộ nhớ). Hết hạn thì các thành phần
+    còn lại được xếp bằng heuristic, để tổng thời gian không vượt `max_search_time`.
+    """
+    remaining_tasks = sum(len(sp["tasks"]) for sp, _, _ in jobs)
+    results = []
+    for k, (sp, sub_hints, should_cancel) in enumerate(jobs):
+        remaining = max(0.0, deadline - time.time())
+        share = len(sp["tasks"]) / max(1, remaining_tasks)
+        remaining_tasks -= len(sp["tasks"])
+        # Mức sàn không được lấn phần chia đều của các thành phần chưa giải
+        min_time = min(MIN_COMPONENT_SEARCH_TIME, remaining / (len(jobs) - k))
+        _split_budget(sp["config"], config, share, remaining, cpu_budget, 1, min_time)
+        if sp["config"]["max_search_time"] < 1:
+            sp["config"]["mode"] = "heuristic"
+        results.append(_solve_component((sp, sub_hints, should_cancel)))
+    return results
+
+
+def solve_components(payload: Dict[str, Any], components: List[List[Dict[str, Any]]],
+                     hints: Optional[Dict[str, Dict[str, Any]]] = None,
+                     progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     should_cancel: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+    """
+    Giải từng thành phần độc lập thành một model riêng rồi gộp kết quả về đúng dạng
+    response của `Engine.solve`. Các thành phần chạy song song trên thread pool: CP-SAT
+    nhả GIL khi giải nên thread đủ dùng, và chạy được trong process daemon của Celery
+    (prefork) vốn không được tạo process con.
+
+    Mỗi thành phần nhận một phần ngân sách CPU (`num_search_workers`) và thời gian
+    (`max_search_time`) tỉ lệ với số task của nó; bài nhỏ giải tuần tự theo một hạn chung.
+    Tiến độ chỉ được báo theo từng thành phần.
+    """
+    config = payload.get("config", {})
+    n_tasks = sum(len(c) for c in components)
+    max_time = int(config.get("max_search_time", 60))
+    cpu_budget = int(config.get("num_search_workers") or os.cpu_count() or 1)
+    pool_size = max(1, min(len(components), int(config.get("component_workers") or cpu_budget)))
+    parallel = pool_size > 1 and n_tasks >= int(config.get("parallel_min_tasks", PARALLEL_MIN_TASKS))
+    if not parallel:
+        pool_size = 1
+
+    resource_map = {r["id"]: r for r in payload.get("resources", [])}
+    sub_payloads = []
+    for comp in components:
+        used = {r_id for t in comp for r_id in (t.get("compatible_resource_ids") or [])}
+        sub_config = dict(config)
+        sub_config["decompose_components"] = False
+        _split_budget(sub_config, config, len(comp) / max(1, n_tasks), max_time, cpu_budget, pool_size)
+        sub_payloads.append({
+            "job_id": payload.get("job_id"),
+            "config": sub_config,
+            "machines": payload.get("machines", []),
+            "resources": [resource_map[r_id] for r_id in sorted(used) if r_id in resource_map],
+            "tasks": comp,
+        })
+
+    hints = hints or {}
+    jobs = [
+        (sp, {_task_id(t): hints[_task_id(t)] for t in sp["tasks"] if _task_id(t) in hints}, should_cancel)
+        for sp in sub_payloads
+    ]
+
+    logger.info("independent components", extra={"components": len(components), "tasks": n_tasks, "pool_size": pool_size})
+
+    deadline = time.time() + max_time
+    if parallel:
+        with ThreadPoolExecutor(max_workers=pool_size) as pool:
+            results = list(pool.map(_solve_component, jobs))
+    else:
+        results = _solve_sequentially(jobs, config, deadline, cpu_budget)
+
+    assignments: List[Dict[str, Any]] = []
+    overloads: List[Dict[str, Any]] = []
+    stats: List[Dict[str, Any]] = []
+    objective_total = 0
+    any_feasible = False
+    for comp, sp, result in zip(components, sub_payloads, results):
+        if result["status"] == "feasible":
+            any_feasible = True
+            objective_total += result.get("objective_value", 0)
+            assignments.extend(result.get("assignments", []))
+            overloads.extend(result.get("overloads", []))
+        else:
+            for t in comp:
+                overloads.append({
+                    "task_id": _task_id(t),
+                    "order_id": t.get("original_order_id", ""),
+                    "status": "DROPPED",
+                    "delay_minutes": 0,
+                    "root_cause_code": "COMPONENT_NOT_SOLVED",
+                    "bottleneck_resource_id": ""
+                })
+        stats.append({
+            "tasks": len(comp),
+            "resources": len(sp["resources"]),
+            "status": result["status"],
+            "objective_value": result.get("objective_value"),
+            "search_time": sp["config"]["max_search_time"],
+            "num_search_workers": sp["config"]["num_search_workers"],
+            "wall_time": result.get("wall_time"),
+            "stop_reason": result.get("stop_reason"),
+        })
+        if progress:
+            progress(dict(stats[-1], type="component", component=len(stats) - 1, components_total=len(components)))
+
+    return {
+        "status": "feasible" if any_feasible else "infeasible",
+        "objective_value": objective_total,
+        "assignments": assignments,
+        "overloads": overloads,
+        "components": stats,
+        "hints": _sum_hint_stats(results),
+        "stop_reason": _merged_stop_reason([c["stop_reason"] for c in stats]),
+        "solver_status": _merged_solver_status(results),
+    }
@@ -0,0 +1,168 @@
+import gzip
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, List, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .celery_app import celery_app, REDIS_URL, WEBHOOK_QUEUE
+from .blobs import BlobStore
+from .observability import WEBHOOK_DELIVERIES_TOTAL, phase
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "http://backend:8082/api/webhook/solver")
+WEBHOOK_GZIP = os.getenv("WEBHOOK_GZIP", "0") == "1"  # body webhook nén gzip (Content-Encoding: gzip)
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+WEBHOOK_POOL_SIZE = int(os.getenv("WEBHOOK_POOL_SIZE", "10"))
+# Retry: backoff = base * 2^lần thử (có jitter), tối đa WEBHOOK_BACKOFF_MAX_SECONDS
+WEBHOOK_MAX_RETRIES = int(os.getenv("WEBHOOK_MAX_RETRIES", "8"))
+WEBHOOK_BACKOFF_BASE_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_BASE_SECONDS", "5"))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "600"))
+WEBHOOK_DELIVERED_TTL_SECONDS = int(os.getenv("WEBHOOK_DELIVERED_TTL_SECONDS", str(24 * 3600)))
+WEBHOOK_DEAD_LETTER_MAX = int(os.getenv("WEBHOOK_DEAD_LETTER_MAX", "1000"))
+
+# Mã HTTP đáng thử lại; 4xx khác là lỗi vĩnh viễn -> dead-letter ngay
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+DEAD_LETTER_KEY = "cp:webhook:dead"
+
+
+def _delivered_key(idempotency_key: str) -> str:
+    return f"cp:webhook:delivered:{idempotency_key}"
+
+
+_session: Optional[requests.Session] = None
+
+
+def _http_session() -> requests.Session:
+    """Session dùng chung trong process (giữ kết nối keep-alive tới backend)"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WEBHOOK_POOL_SIZE)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def backoff_seconds(retries: int) -> float:
+    delay = min(WEBHOOK_BACKOFF_MAX_SECONDS, WEBHOOK_BACKOFF_BASE_SECONDS * (2 ** retries))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class DeadLetterStore:
+    """Webhook không gửi được sau mọi lần thử (mới nhất trước, giữ tối đa WEBHOOK_DEAD_LETTER_MAX)"""
+
+    def __init__(self, client, max_entries: int = WEBHOOK_DEAD_LETTER_MAX):
+        self.client = client
+        self.max_entries = max_entries
+
+    @classmethod
+    def from_url(cls, url: str) -> "DeadLetterStore":
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        pipe = self.client.pipeline()
+        pipe.lpush(DEAD_LETTER_KEY, json.dumps(entry))
+        pipe.ltrim(DEAD_LETTER_KEY, 0, self.max_entries - 1)
+        pipe.execute()
+
+    def list(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return [json.loads(e) for e in self.client.lrange(DEAD_LETTER_KEY, 0, limit - 1)]
+
+
+def post_webhook(response_data: Dict[str, Any], idempotency_key: str) -> requests.Response:
+    body = json.dumps(response_data).encode()
+    headers = {"Content-Type": "application/json", "Idempotency-Key": idempotency_key}
+    if WEBHOOK_GZIP:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    logger.info("sending webhook", extra={
+        "job_id": response_data.get("job_id"),
+        "status": response_data.get("status"),
+        "assignments": len(response_data.get("assignments") or []),
+        "overloads": len(response_data.get("overloads") or []),
+        "bytes": len(body),
+        "gzip": WEBHOOK_GZIP,
+        "url": WEBHOOK_URL,
+    })
+    with phase("webhook"):
+        return _http_session().post(WEBHOOK_URL, data=body, headers=headers, timeout=WEBHOOK_TIMEOUT_SECONDS)
+
+
+def enqueue_delivery(idempotency_key: str, job_id: Optional[str] = None,
+                     result_ref: Optional[str] = None, message: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Xếp webhook vào hàng đợi gửi riêng; worker giải không chờ backend.
+    Kết quả lớn đi theo `result_ref` (blob đã lưu), `message` chỉ dùng cho body nhỏ
+    (báo lỗi) hoặc khi không lưu được blob. `job_id` ghi đè job_id của kết quả
+    (job trùng gộp vào cùng một task).
+    """
+    deliver_webhook.apply_async(kwargs={
+        "idempotency_key": idempotency_key,
+        "job_id": job_id,
+        "result_ref": result_ref,
+        "message": message,
+    })
+
+
+@celery_app.task(bind=True, name="deliver_webhook", queue=WEBHOOK_QUEUE, acks_late=True)
+def deliver_webhook(self, idempotency_key: str, job_id: str = None, result_ref: str = None, message: dict = None):
+    import redis
+    client = redis.Redis.from_url(REDIS_URL)
+    if client.exists(_delivered_key(idempotency_key)):
+        logger.info("webhook already delivered", extra={"idempotency_key": idempotency_key})
+        WEBHOOK_DELIVERIES_TOTAL.labels(outcome="duplicate").inc()
+        return "Already delivered"
+
+    def dead_letter(error: str, status_code: Optional[int] = None):
+        logger.error("webhook dead-lettered", extra={"idempotency_key": idempotency_key, "error": error})
+        WEBHOOK_DELIVERIES_TOTAL.labels(outcome="dead_letter").inc()
+        DeadLetterStore(client).add({
+            "idempotency_key": idempotency_key,
+            "job_id": job_id,
+            "result_ref": result_ref,
+            "message": message,
+            "error": error,
+            "status_code": status_code,
+            "attempts": self.request.retries + 1,
+            "failed_at": time.time(),
+        })
+        return "Dead-lettered"
+
+    response_data = message
+    if result_ref:
+        response_data = BlobStore(client).get(result_ref)
+        if response_data is None:
+            return dead_letter(f"result {result_ref} not found (expired?)")
+    if job_id:
+        response_data = dict(response_data, job_id=job_id)
+
+    try:
+        resp = post_webhook(response_data, idempotency_key)
+        error, status_code = None, resp.status_code
+        if 200 <= resp.status_code < 300:
+            client.set(_delivered_key(idempotency_key), 1, ex=WEBHOOK_DELIVERED_TTL_SECONDS)
+            WEBHOOK_DELIVERIES_TOTAL.labels(outcome="delivered").inc()
+            return "Callback Successful"
+        error = f"HTTP {resp.status_code}: {resp.text[:500]}"
+        if resp.status_code not in RETRYABLE_STATUS:
+            return dead_letter(error, status_code)
+    except requests.RequestException as e:
+        error, status_code = str(e), None
+
+    if self.request.retries >= WEBHOOK_MAX_RETRIES:
+        return dead_letter(error, status_code)
+    countdown = backoff_seconds(self.request.retries)
+    logger.warning("webhook failed, retrying", extra={
+        "idempotency_key": idempotency_key, "error": error, "retry": self.request.retries + 1,
+        "max_retries": WEBHOOK_MAX_RETRIES, "countdown": round(countdown, 1),
+    })
+    WEBHOOK_DELIVERIES_TOTAL.labels(outcome="retry").inc()
+    raise self.retry(countdown=countdown, max_retries=WEBHOOK_MAX_RETRIES)
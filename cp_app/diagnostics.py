@@ -0,0 +1,218 @@
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from .tables import ProblemTables
+
+# Số issue tối đa trả về trong báo cáo (đếm đầy đủ vẫn nằm trong summary)
+DIAGNOSTICS_MAX_ISSUES = 100
+
+# Task chắc chắn bị drop
+NO_COMPATIBLE_RESOURCE = "NO_COMPATIBLE_RESOURCE"
+# Task không vừa khoảng trống nào trong horizon (sau release): bị drop nếu horizon cứng,
+# ngược lại chỉ xếp được sau horizon (Engine nới horizon khi thu hẹp miền)
+SLOT_TOO_SMALL = "SLOT_TOO_SMALL"
+NO_SLOT_AFTER_RELEASE = "NO_SLOT_AFTER_RELEASE"
+# Payload không giải được
+DEPENDENCY_CYCLE = "DEPENDENCY_CYCLE"
+# Cảnh báo
+UNKNOWN_RESOURCE = "UNKNOWN_RESOURCE"
+
+
+class FreeSlotIndex:
+    """
+    Khoảng trống của lịch một máy trên [0, horizon]: giờ nghỉ đã gộp và sắp xếp,
+    các khoảng trống (`slot_starts`, `slot_ends`, `slot_lengths`), khoảng trống dài nhất
+    từ khoảng thứ k trở đi (`suffix_max`) và tổng phút trống cộng dồn (`prefix_free`).
+    """
+
+    def __init__(self, windows, horizon: int):
+        starts: List[int] = []
+        ends: List[int] = []
+        for start, end in sorted(windows):
+            start, end = max(0, start), min(horizon, end)
+            if end <= start:
+                continue
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.busy_starts = np.array(starts, dtype=np.int64)
+        self.busy_ends = np.array(ends, dtype=np.int64)
+
+        slot_starts = np.concatenate(([0], self.busy_ends))
+        slot_ends = np.concatenate((self.busy_starts, [horizon]))
+        keep = slot_ends > slot_starts
+        self.slot_starts = slot_starts[keep]
+        self.slot_ends = slot_ends[keep]
+        self.slot_lengths = self.slot_ends - self.slot_starts
+        self.suffix_max = np.maximum.accumulate(self.slot_lengths[::-1])[::-1] if len(self.slot_lengths) else \
+            np.zeros(0, dtype=np.int64)
+        self.prefix_free = np.concatenate(([0], np.cumsum(self.slot_lengths)))
+
+    @property
+    def max_slot(self) -> int:
+        return int(self.suffix_max[0]) if len(self.suffix_max) else 0
+
+    @property
+    def free_minutes(self) -> int:
+        return int(self.prefix_free[-1])
+
+    def max_slot_after(self, releases: np.ndarray) -> np.ndarray:
+        """Khoảng trống dài nhất bắt đầu không sớm hơn từng mốc release (vector hoá)"""
+        if not len(self.slot_lengths):
+            return np.zeros(len(releases), dtype=np.int64)
+        n = len(self.slot_lengths)
+        k = np.searchsorted(self.slot_ends, releases, side="right")
+        inside = k < n
+        k_safe = np.minimum(k, n - 1)
+        # Khoảng chứa release bị cắt bớt phần trước release
+        clipped = np.where(inside, self.slot_ends[k_safe] - np.maximum(self.slot_starts[k_safe], releases), 0)
+        after = np.where(k + 1 < n, self.suffix_max[np.minimum(k + 1, n - 1)], 0)
+        return np.maximum(clipped, after)
+
+
+def build_free_slot_index(tables: ProblemTables, horizon: int) -> List[FreeSlotIndex]:
+    return [FreeSlotIndex(windows, horizon) for windows in tables.unavailability]
+
+
+def _segment_max(values: np.ndarray, ptr: np.ndarray) -> np.ndarray:
+    """Max theo từng đoạn CSR values[ptr[i]:ptr[i + 1]] (đoạn rỗng -> -1)"""
+    n = len(ptr) - 1
+    out = np.full(n, -1, dtype=np.int64)
+    non_empty = ptr[1:] > ptr[:-1]
+    if values.size:
+        out[non_empty] = np.maximum.reduceat(values, ptr[:-1][non_empty])
+    return out
+
+
+def _cycle_members(tables: ProblemTables) -> List[str]:
+    """Task nằm trên (hoặc sau) một chu trình phụ thuộc, theo Kahn trên dạng CSR"""
+    n = tables.n_tasks
+    child_of_edge = np.repeat(np.arange(n), np.diff(tables.dep_ptr))
+    parents = np.concatenate((tables.dep_idx, tables.internal_dep[tables.internal_dep >= 0]))
+    children = np.concatenate((child_of_edge, np.nonzero(tables.internal_dep >= 0)[0]))
+    in_degree = np.bincount(children, minlength=n)
+    order = np.argsort(parents, kind="stable")
+    sorted_children = children[order].tolist()
+    child_ptr = np.searchsorted(parents[order], np.arange(n + 1)).tolist()
+
+    degree = in_degree.tolist()
+    queue = [i for i in range(n) if degree[i] == 0]
+    seen = 0
+    while queue:
+        i = queue.pop()
+        seen += 1
+        for c in sorted_children[child_ptr[i]:child_ptr[i + 1]]:
+            degree[c] -= 1
+            if degree[c] == 0:
+                queue.append(c)
+    if seen == n:
+        return []
+    return sorted(tables.task_ids[i] for i in range(n) if degree[i] > 0)
+
+
+def diagnose_payload(tables: ProblemTables, horizon: int,
+                     frozen: Optional[Dict[str, Any]] = None,
+                     slots: Optional[List[FreeSlotIndex]] = None,
+                     max_issues: Optional[int] = DIAGNOSTICS_MAX_ISSUES,
+                     hard_horizon: bool = False) -> Dict[str, Any]:
+    """
+    Kiểm tra nhanh payload trước khi giải (không cần CP-SAT):
+    - task không có máy tương thích -> chắc chắn bị drop ("error");
+    - task dài hơn mọi khoảng trống trong horizon trên các máy tương thích, hoặc không còn
+      khoảng trống đủ dài sau `start_after_min` -> "error" nếu `hard_horizon`, ngược lại
+      "warning" (chỉ xếp được sau horizon);
+    - chu trình phụ thuộc -> payload không giải được (`fatal`);
+    - máy tương thích không có trong `resources` -> cảnh báo.
+
+    Trả về báo cáo dạng dict (đưa thẳng vào response API), giữ tối đa `max_issues` issue
+    (None = tất cả, xem `compact_report`).
+    """
+    frozen = frozen or {}
+    slots = slots if slots is not None else build_free_slot_index(tables, horizon)
+    n = tables.n_tasks
+
+    max_slot = np.array([s.max_slot for s in slots], dtype=np.int64)
+    entry_resource = tables.compat_idx
+    entry_task = np.repeat(np.arange(n), np.diff(tables.compat_ptr))
+
+    # Khoảng trống dài nhất trên mọi máy tương thích, và sau release
+    task_max_slot = _segment_max(max_slot[entry_resource], tables.compat_ptr)
+    entry_after = np.zeros(len(entry_resource), dtype=np.int64)
+    by_resource = np.argsort(entry_resource, kind="stable")
+    group_ptr = np.searchsorted(entry_resource[by_resource], np.arange(len(slots) + 1)).tolist()
+    for j, slot in enumerate(slots):
+        entries = by_resource[group_ptr[j]:group_ptr[j + 1]]
+        if len(entries):
+            entry_after[entries] = slot.max_slot_after(tables.release[entry_task[entries]])
+    task_max_after = _segment_max(entry_after, tables.compat_ptr)
+
+    not_frozen = np.array([t_id not in frozen for t_id in tables.task_ids], dtype=bool)
+    no_resource = (task_max_slot < 0) & not_frozen
+    too_long = (task_max_slot >= 0) & (tables.duration > task_max_slot) & not_frozen
+    after_release = (task_max_slot >= 0) & ~too_long & (tables.duration > task_max_after) & not_frozen
+
+    issues: List[Dict[str, Any]] = []
+    counts: Dict[str, int] = {}
+
+    def add(code: str, severity: str, task_ids: List[str], **fields):
+        if task_ids:
+            counts[code] = counts.get(code, 0) + len(task_ids)
+        for k, t_id in enumerate(task_ids):
+            if max_issues is not None and len(issues) >= max_issues:
+                break
+            issues.append({"code": code, "severity": severity, "task_id": t_id,
+                           **{name: values[k] for name, values in fields.items()}})
+
+    cycle = _cycle_members(tables)
+    if cycle:
+        add(DEPENDENCY_CYCLE, "fatal", cycle)
+    idx = np.nonzero(no_resource)[0]
+    add(NO_COMPATIBLE_RESOURCE, "error", [tables.task_ids[i] for i in idx])
+    slot_severity = "error" if hard_horizon else "warning"
+    idx = np.nonzero(too_long)[0]
+    add(SLOT_TOO_SMALL, slot_severity, [tables.task_ids[i] for i in idx],
+        duration=tables.duration[idx].tolist(), max_slot=task_max_slot[idx].tolist())
+    idx = np.nonzero(after_release)[0]
+    add(NO_SLOT_AFTER_RELEASE, slot_severity, [tables.task_ids[i] for i in idx],
+        duration=tables.duration[idx].tolist(), start_after_min=tables.release[idx].tolist(),
+        max_slot_after_release=task_max_after[idx].tolist())
+    unknown = sorted(tables.unknown_resource_refs.items())
+    if unknown:
+        add(UNKNOWN_RESOURCE, "warning", [tables.task_ids[i] for i, _ in unknown],
+            resource_ids=[refs for _, refs in unknown])
+
+    impossible = int(no_resource.sum())
+    if hard_horizon:
+        impossible += int(too_long.sum() + after_release.sum())
+    schedulable = int(not_frozen.sum())
+    return {
+        "ok": impossible == 0 and not cycle,
+        "fatal": bool(cycle) or (schedulable > 0 and impossible == schedulable),
+        "horizon": int(horizon),
+        "summary": {
+            "tasks": n,
+            "resources": len(slots),
+            "impossible_tasks": impossible,
+            "counts": counts,
+        },
+        "issues": issues,
+        "issues_truncated": sum(counts.values()) > len(issues),
+    }
+
+
+def compact_report(report: Dict[str, Any], max_issues: int = DIAGNOSTICS_MAX_ISSUES) -> Dict[str, Any]:
+    """Bản báo cáo chỉ giữ `max_issues` issue đầu (để trả về API / webhook)"""
+    if len(report["issues"]) <= max_issues:
+        return report
+    return dict(report, issues=report["issues"][:max_issues], issues_truncated=True)
+
+
+def task_issue_codes(report: Dict[str, Any]) -> Dict[str, str]:
+    """task_id -> mã issue về khả năng xếp lịch của task (dùng làm nguyên nhân khi task bị drop)"""
+    return {
+        i["task_id"]: i["code"] for i in report.get("issues", [])
+        if i["code"] in (NO_COMPATIBLE_RESOURCE, SLOT_TOO_SMALL, NO_SLOT_AFTER_RELEASE)
+    }
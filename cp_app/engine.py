@@ -1,158 +1,476 @@
 from ortools.sat.python import cp_model
-from typing import Dict, List, Any
+from typing import Callable, Dict, List, Any, Optional
+import logging
+import os
 import sys
+import time
+
+from .batching import solve_batched
+from .analysis import (FeasibleStarts, compute_time_bounds, dependency_edges, free_start_intervals, order_sinks,
+                       planning_horizon)
+from .diagnostics import compact_report, diagnose_payload, task_issue_codes
+from .heuristic import ListScheduler
+from .progress import PROGRESS_THROTTLE_SECONDS, SolutionProgressCallback
+from .control import SolveWatchdog
+from .tables import ProblemTables
+from .working_time import WORKING_TIME_BREAKS_KEY, segment_start_intervals, solve_working_time
+from .setups import (SETUP_CIRCUIT_MAX_TASKS, SETUP_NEIGHBOURS, SetupConstraints, SetupItem, SetupTimes,
+                     changeover_summary, setup_machines)
+from .symmetry import (POOL_PREFIX, _calendar, assign_pooled_machines, canonical_hints,
+                       machine_equivalence_classes, poolable)
+from .observability import (MODEL_CONSTRAINTS, MODEL_VARIABLES, SEARCH_BRANCHES, SEARCH_CONFLICTS, SEARCH_GAP,
+                            SEARCH_STATUS_TOTAL, SEARCH_WALLTIME, TASK_OUTCOMES_TOTAL, phase)
+
+logger = logging.getLogger(__name__)
+cpsat_logger = logging.getLogger("cp_app.cpsat")
+
+# Log tiến trình tìm kiếm của CP-SAT (chuyển vào logger "cp_app.cpsat", không ghi stdout)
+CPSAT_LOG_SEARCH_PROGRESS = os.getenv("CPSAT_LOG_SEARCH_PROGRESS", "0") == "1"
 
 # Buffer time (phút) an toàn giữa các task phụ thuộc
 BUFFER_TIME = 0 
 # Phạt nặng nếu bỏ qua task (để Solver cố gắng xếp bằng được)
 DROP_PENALTY = 1000000 
+MAKESPAN_WEIGHT = 100
+# Trọng số mỗi phút chuyển đổi (setup) khi bật minimize_changeovers
+CHANGEOVER_WEIGHT = 100
+# Chế độ lexicographic: thứ tự các tầng objective và tỉ lệ max_search_time cho từng tầng
+OBJECTIVE_STAGES = ("drops", "lateness", "makespan", "changeovers")
+STAGE_TIME_FRACTIONS = (0.3, 0.4, 0.3)
 
 class Engine:
-    def __init__(self, payload: Dict[str, Any]):
+    def __init__(self, payload: Dict[str, Any], frozen: Optional[Dict[str, Dict[str, Any]]] = None,
+                 hints: Optional[Dict[str, Dict[str, Any]]] = None,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 should_cancel: Optional[Callable[[], bool]] = None):
+        self.payload = payload
         self.config = payload.get("config", {})
         self.resources = payload.get("resources", []) 
         self.tasks = payload.get("tasks", [])
+        # Task đã chốt lịch (task_id -> {machine_id, start_min, end_min}): là hằng số, không phải biến quyết định
+        self.frozen = frozen or {}
+        # Lịch lần trước (task_id -> {start_min, machine_id}) dùng làm solution hint cho CP-SAT
+        self.hints = hints or {}
+        self.hint_stats = {"kept": 0, "repaired": 0, "missing": 0}
+        # Nhận sự kiện tiến độ (mỗi lời giải cải thiện) trong lúc CP-SAT đang chạy
+        self.progress = progress
+        # Trả True khi người dùng huỷ lần solve -> StopSearch, vẫn trả lời giải tốt nhất
+        self.should_cancel = should_cancel
+        self.stop_reason = None
+        # Lớp máy giống hệt nhau: (máy, task) để phá đối xứng, và pool "POOL:<i>" -> máy thành viên
+        self.symmetry_classes = []
+        self.pools = {}
+        self.pool_of = {}
+        self.pool_resources = {}
+        # Setup phụ thuộc thứ tự (đổi mã hàng) trên máy serial khai báo trong `machines`
+        self.setup_times = SetupTimes(payload)
+        self.setup_machines = set()
+        if self.config.get("setup_mode", "auto") != "off":
+            self.setup_machines = setup_machines(payload, self.setup_times)
+        self.setups: Optional[SetupConstraints] = None
+        self._tables = None
+        self.diagnostics = None
+        self._drop_codes = {}
+        # Thời gian từng pha (giây) và thống kê model / tìm kiếm của CP-SAT
+        self.timings: Dict[str, float] = {}
+        self.search_stats: Optional[Dict[str, Any]] = None
+        # Thành phần objective (drops / lateness / makespan / weighted) và kết quả từng tầng lexicographic
+        self.objectives: Dict[str, Any] = {}
+        # Đơn (original_order_id) -> biến trễ và ràng buộc trễ của từng task cuối có hạn
+        self.order_lateness: Dict[str, Dict[str, Any]] = {}
+        self.stages: List[Dict[str, Any]] = []
         
         self.model = cp_model.CpModel()
         self.solver = cp_model.CpSolver()
-        print(f"Engine initialized with {len(self.tasks)} tasks and {len(self.resources)} resources.")
+        logger.info("engine initialized", extra={"tasks": len(self.tasks), "resources": len(self.resources)})
 
     def solve(self) -> Dict[str, Any]:
         if not self.tasks:
             return {"status": "feasible", "assignments": []}
 
-        # --- STEP 0: DIAGNOSE INPUT DATA (Tìm nguyên nhân Infeasible trước) ---
-        self._diagnose_input_issues()
+        self._prepare()
+        return self._finish(self._solve())
 
-        print("\n🕵️ DIAGNOSING DROPPED BATCHES:")
-        resource_map = {r["id"]: r for r in self.resources}
-        
-        # Chỉ check các task có trong danh sách bị drop
-        target_ids = ['BATCH_0-646_1', 'BATCH_0-646_2'] # ID bạn thấy trong log
+    def build(self):
+        """
+        Chẩn đoán và dựng model (kèm hint) mà chưa giải. Trả về (task_vars, lịch heuristic);
+        model dựng một lần được sao chép cho từng kịch bản what-if (xem `scenarios`).
+        """
+        self._prepare()
+        with phase("build_model", self.timings):
+            task_vars = self._build_model()
+        return task_vars, self._add_hints(task_vars)
 
-        for t in self.tasks:
-            if t.get("task_id") not in target_ids: continue
-            
-            print(f"\n>> ANALYZING {t.get('task_id')}:")
-            
-            # 1. Check Duration
-            duration = int(t.get("duration") or 0)
-            print(f"   - Duration Required: {duration} mins")
-            
-            # 2. Check Resources
-            comp_res = t.get("compatible_resource_ids") or []
-            print(f"   - Compatible Resources: {comp_res}")
-            
-            if not comp_res:
-                print("   ❌ ERROR: No compatible resources found! Check Mapping Logic.")
-                continue
+    def solve_built(self, task_vars, heuristic_result=None) -> Dict[str, Any]:
+        """Giải model đã dựng bằng `build` (hoặc bản sao đã chỉnh của nó)"""
+        return self._finish(self._solve_model(task_vars, heuristic_result))
 
-            # 3. Check Slot trên từng máy
-            for r_id in comp_res:
-                if r_id not in resource_map: continue
-                res = resource_map[r_id]
-                windows = res.get("unavailability", [])
-                
-                # Tính Max Gap
-                sorted_windows = sorted(windows, key=lambda x: int(x['start']))
-                current_time = 0
-                max_gap = 0
-                
-                print(f"   - Machine {r_id} Breaks:")
-                for w in sorted_windows:
-                    start, end = int(w['start']), int(w['end'])
-                    gap = start - current_time
-                    if gap > max_gap: max_gap = gap
-                    print(f"     [{current_time} -> {start}] (Gap: {gap}m) | Break: {start}->{end}")
-                    current_time = end
-                
-                # Check đoạn cuối
-                gap = 100000 - current_time
-                if gap > max_gap: max_gap = gap
-                
-                print(f"   => Max Continuous Slot on {r_id}: {max_gap} mins")
-                
-                if duration > max_gap:
-                    print(f"   ❌ FAIL: Task duration ({duration}) > Max Slot ({max_gap})")
-                else:
-                    print(f"   ✅ PASS: Task fits in slot!")
-        # ---------------------------------------------------------------------
+    def _prepare(self):
+        with phase("normalize", self.timings):
+            tables = self.tables
+
+        # --- STEP 0: DIAGNOSE INPUT DATA (Tìm nguyên nhân Infeasible trước) ---
+        with phase("diagnose", self.timings):
+            self.diagnostics = diagnose_payload(tables, self._base_horizon(), self.frozen, max_issues=None,
+                                                hard_horizon=not self.config.get("tighten_domains", True))
+        self._drop_codes = task_issue_codes(self.diagnostics)
+        self._log_diagnostics()
+
+    def _finish(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        result["diagnostics"] = compact_report(self.diagnostics)
+        # Kết quả của Engine lồng (mẻ tự gom, working-time) giữ thống kê tìm kiếm của nó
+        nested = result.get("stats") or {}
+        result["stats"] = {
+            "timings": {**self.timings, **(nested.get("timings") or {})},
+            "search": self.search_stats or nested.get("search"),
+        }
+        if self.setup_machines and result.get("assignments"):
+            tables = self.tables
+            task_info = {t_id: (tables.design_ids[i], tables.operations[i]) for i, t_id in enumerate(tables.task_ids)}
+            result["changeovers"] = changeover_summary(result["assignments"], task_info, self.setup_times)
+            if self.setups:
+                result["stats"]["setups"] = self.setups.stats
+        overloads = result.get("overloads", [])
+        TASK_OUTCOMES_TOTAL.labels(outcome="scheduled").inc(len(result.get("assignments", [])))
+        TASK_OUTCOMES_TOTAL.labels(outcome="dropped").inc(sum(1 for o in overloads if o["status"] == "DROPPED"))
+        TASK_OUTCOMES_TOTAL.labels(outcome="late").inc(sum(1 for o in overloads if o["status"] == "LATE"))
+        return result
+
+    def _solve(self) -> Dict[str, Any]:
+        # Gom task giặt lẻ thành mẻ vừa capacity rồi giải trên các mẻ, kết quả trả theo task gốc
+        if self.config.get("auto_batching"):
+            result = solve_batched(self.payload, self.frozen, self.hints, self.progress, self.should_cancel)
+            if result is not None:
+                return result
+
+        # Working-time: giải trên trục phút làm việc (nén giờ nghỉ), đổi kết quả về phút thực
+        if self.config.get("time_mode") == "working":
+            result = solve_working_time(self.payload, self.frozen, self.hints, self.progress, self.should_cancel)
+            if result is not None:
+                return result
+
+        # What-if nhanh: chỉ chạy heuristic, bỏ qua CP-SAT
+        if self.config.get("mode") == "heuristic":
+            logger.info("heuristic mode: skipping CP-SAT")
+            with phase("heuristic", self.timings):
+                return ListScheduler(self.payload, self._base_horizon(), self.frozen).run()
+
+        # Tách các bài toán con độc lập (không chung máy, không phụ thuộc) để giải riêng
+        if self.config.get("decompose_components", True) and not self.frozen:
+            from .decomposition import find_independent_components, solve_components
+            components = find_independent_components(self.payload)
+            if len(components) > 1:
+                return solve_components(self.payload, components, self.hints, self.progress, self.should_cancel)
+
+        # Rolling horizon: chia kế hoạch lớn thành các cửa sổ task gối nhau (theo thứ tự release / due)
+        if self.config.get("rolling_horizon") and not self.frozen:
+            from .decomposition import solve_rolling_horizon
+            return solve_rolling_horizon(self.payload, self.hints, self.progress, self.should_cancel)
 
         # --- STEP 1: BUILD MODEL ---
-        task_vars = self._build_model()
-        
+        with phase("build_model", self.timings):
+            task_vars = self._build_model()
+        return self._solve_model(task_vars, self._add_hints(task_vars))
+
+    def _add_hints(self, task_vars):
+        """Hint từ lịch lần trước và từ heuristic; trả về lịch heuristic (fallback khi CP-SAT không ra lời giải)"""
+        # Lời giải heuristic làm hint (hint từ lịch lần trước được ưu tiên) và làm fallback
+        heuristic_result = None
+        heuristic_hints = {}
+        if self.config.get("heuristic_hint", True):
+            with phase("heuristic", self.timings):
+                heuristic_result = ListScheduler(self.payload, self.horizon, self.frozen).run()
+            logger.info("heuristic schedule", extra={"objective": heuristic_result["objective_value"]})
+            heuristic_hints = {
+                a["task_id"]: a for a in heuristic_result["assignments"] if a["task_id"] not in self.hints
+            }
+        # Đổi tên máy trong hint (trên lịch gộp) cho khớp thứ tự phá đối xứng
+        hints = canonical_hints({**heuristic_hints, **self.hints}, self.symmetry_classes)
+        if heuristic_hints:
+            self._apply_hints(task_vars, {t_id: hints[t_id] for t_id in heuristic_hints})
+        if self.hints:
+            self._apply_hints(task_vars, {t_id: hints[t_id] for t_id in self.hints}, self.hint_stats)
+        if self.setups and (heuristic_hints or self.hints):
+            # Thứ tự / máy của các cặp và circuit setup theo cùng lịch hint
+            placement = {tv["index"]: (hints[t_id]["machine_id"], int(hints[t_id].get("start_min", 0)))
+                         for t_id, tv in task_vars.items() if t_id in hints and not tv["is_frozen"]}
+            placement.update({task_vars[t_id]["index"]: (a["machine_id"], int(a["start_min"]))
+                              for t_id, a in self.frozen.items() if t_id in task_vars})
+            self.setups.hint(placement)
+        return heuristic_result
+
+    def _solve_model(self, task_vars, heuristic_result=None):
         # --- STEP 2: CONFIGURE SOLVER ---
         max_time = int(self.config.get("max_search_time", 60))
         self.solver.parameters.max_time_in_seconds = max_time
-        self.solver.parameters.log_search_progress = True 
+        if self.config.get("num_search_workers"):
+            self.solver.parameters.num_workers = int(self.config["num_search_workers"])
+        # Giới hạn bộ nhớ (MB) của governor: CP-SAT dừng tìm kiếm và trả lời giải tốt nhất khi vượt
+        if self.config.get("max_memory_mb"):
+            self.solver.parameters.max_memory_in_mb = int(self.config["max_memory_mb"])
+        if self.config.get("random_seed") is not None:
+            self.solver.parameters.random_seed = int(self.config["random_seed"])
+        if self.config.get("log_search_progress", CPSAT_LOG_SEARCH_PROGRESS):
+            self.solver.parameters.log_search_progress = True
+            self.solver.parameters.log_to_stdout = False
+            self.solver.log_callback = cpsat_logger.info
         # self.solver.parameters.linearization_level = 2 # Uncomment để debug sâu hơn nếu cần
 
-        print("🚀 Solving...")
-        status = self.solver.Solve(self.model)
-        print(f"🏁 Solver Status: {self.solver.StatusName(status)}")
+        # Early-stop: gap tương đối; không cải thiện sau N giây và dừng khi không còn drop nằm ở `_search`
+        if self.config.get("relative_gap_limit"):
+            self.solver.parameters.relative_gap_limit = float(self.config["relative_gap_limit"])
+
+        logger.info("solving", extra={"max_search_time": max_time})
+        if self.config.get("objective_mode") == "lexicographic":
+            status = self._solve_lexicographic(task_vars, max_time)
+        else:
+            status = self._search(task_vars)
+        self._record_search_stats(status)
 
         # --- STEP 3: RESULT ---
         if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-            self._analyze_overlaps(task_vars)
-            assignments, overloads = self._extract_solution(task_vars)
+            with phase("analyze_overlaps", self.timings):
+                self._analyze_overlaps(task_vars)
+            with phase("extract_solution", self.timings):
+                assignments, overloads = self._extract_solution(task_vars)
             return {
                 "status": "feasible",
-                "objective_value": int(self.solver.ObjectiveValue()),
+                "objective_value": int(self.solver.Value(self.objectives["weighted"])),
                 "assignments": assignments,
-                "overloads": overloads
+                "overloads": overloads,
+                "hints": self.hint_stats,
+                "stop_reason": self.stop_reason,
+                "solver_status": self.solver.StatusName(status)
             }
+        elif status == cp_model.UNKNOWN:
+            # Hết giờ mà CP-SAT chưa tìm được lời giải -> trả lịch heuristic
+            logger.warning("no CP-SAT solution within max_search_time, returning heuristic schedule")
+            if heuristic_result is None:
+                heuristic_result = ListScheduler(self.payload, self.horizon, self.frozen).run()
+            heuristic_result["solver_status"] = "UNKNOWN"
+            heuristic_result["hints"] = self.hint_stats
+            heuristic_result["stop_reason"] = self.stop_reason
+            return heuristic_result
         else:
-            print("❌ MODEL IS INFEASIBLE. Please check the Diagnosis logs above.")
+            logger.error("model is infeasible, see input diagnosis")
             return {
                 "status": "infeasible",
                 "assignments": [],
-                "overloads": []
+                "overloads": [],
+                "hints": self.hint_stats
             }
 
+    def _search(self, task_vars, stage: Optional[str] = None):
+        """Một lần CpSolver.Solve với progress callback / watchdog (huỷ, không cải thiện, zero drops)"""
+        no_improvement_seconds = self.config.get("no_improvement_seconds")
+        stop_on_zero_drops = bool(self.config.get("stop_on_zero_drops", False))
+        callback = None
+        if self.progress or no_improvement_seconds or stop_on_zero_drops or self.should_cancel:
+            callback = SolutionProgressCallback(
+                self.progress, task_vars,
+                throttle_seconds=float(self.config.get("progress_throttle_seconds", PROGRESS_THROTTLE_SECONDS)),
+                include_assignments=bool(self.config.get("progress_assignments", False)),
+                stop_on_zero_drops=stop_on_zero_drops,
+                pools=self.pools,
+                stage=stage,
+            )
+        watchdog = None
+        if self.should_cancel or no_improvement_seconds:
+            watchdog = SolveWatchdog(
+                self.solver, callback, self.should_cancel,
+                float(no_improvement_seconds) if no_improvement_seconds else None,
+            )
+            watchdog.start()
+        with phase(f"solve_{stage}" if stage else "solve", self.timings):
+            status = self.solver.Solve(self.model, callback)
+        if watchdog:
+            watchdog.finish()
+        if callback:
+            callback.flush()
+        self.stop_reason = (watchdog and watchdog.stop_reason) or (callback and callback.stop_reason)
+        return status
+
+    def _solve_lexicographic(self, task_vars, max_time: int):
+        """
+        Giải objective theo tầng thay cho một tổng hệ số lớn: tối thiểu số task drop, chặn
+        giá trị đó rồi tối thiểu lateness có trọng số, chặn tiếp rồi tối thiểu makespan.
+        Mỗi tầng có phần thời gian riêng (`stage_time_fractions`, tầng xong sớm nhường phần dư)
+        và được hint bằng toàn bộ lời giải của tầng trước. Tầng đầu chưa ra lời giải thì tìm tiếp
+        bằng toàn bộ thời gian còn lại; tầng sau không ra lời giải thì giữ lời giải của tầng trước
+        (giải lại với biến cố định theo hint).
+        """
+        fractions = self.config.get("stage_time_fractions") or STAGE_TIME_FRACTIONS
+        stages = [(name, self.objectives[name]) for name in OBJECTIVE_STAGES
+                  if not isinstance(self.objectives[name], int)]
+        weights = [float(f) for f in fractions][:len(stages)]
+        weights += [weights[-1] if weights else 1.0] * (len(stages) - len(weights))
+        deadline = time.monotonic() + max_time
+        self.stages = []
+        status = cp_model.UNKNOWN
+        for k, (name, expr) in enumerate(stages):
+            # Tầng xong sớm (OPTIMAL) nhường thời gian còn lại cho các tầng sau theo đúng tỉ lệ
+            remaining = deadline - time.monotonic()
+            budget = remaining * weights[k] / sum(weights[k:])
+            if budget <= 0.05 and k > 0:
+                break
+            self.model.Minimize(expr)
+            self.solver.parameters.max_time_in_seconds = max(budget, 0.05)
+            stage_status = self._search(task_vars, stage=name)
+            remaining = deadline - time.monotonic()
+            if k == 0 and stage_status == cp_model.UNKNOWN and remaining > 0.05 and self.stop_reason != "cancelled":
+                # Chưa có lời giải nào: tầng đầu tìm tiếp bằng toàn bộ thời gian còn lại
+                self.solver.parameters.max_time_in_seconds = remaining
+                stage_status = self._search(task_vars, stage=name)
+            if stage_status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                if k > 0:
+                    status = self._restore_hinted_solution(task_vars)
+                self.stages.append({"stage": name, "status": self.solver.StatusName(stage_status)})
+                break
+            status = stage_status
+            value = int(self.solver.ObjectiveValue())
+            self.stages.append({
+                "stage": name,
+                "status": self.solver.StatusName(stage_status),
+                "value": value,
+                "bound": self.solver.BestObjectiveBound(),
+                "walltime": round(self.solver.WallTime(), 3),
+            })
+            logger.info("objective stage done", extra=self.stages[-1])
+            if self.stop_reason in ("cancelled", "zero_drops") or k == len(stages) - 1:
+                break
+            # Chặn tầng vừa giải (bằng giá trị tốt nhất; là cố định nếu OPTIMAL) và hint tầng sau
+            self.model.Add(expr <= value)
+            self._hint_current_solution()
+        return status
+
+    def _hint_current_solution(self):
+        """Hint đầy đủ mọi biến bằng lời giải vừa tìm được (thay các hint cũ)"""
+        values = self.solver.ResponseProto().solution
+        self.model.ClearHints()
+        for index, value in enumerate(values):
+            self.model.AddHint(self.model.GetIntVarFromProtoIndex(index), value)
+
+    def _restore_hinted_solution(self, task_vars):
+        # Lời giải tầng trước đang là hint đầy đủ và thoả các ràng buộc chặn -> giải lại với biến cố định
+        self.solver.parameters.fix_variables_to_their_hinted_value = True
+        try:
+            return self._search(task_vars, stage="restore")
+        finally:
+            self.solver.parameters.fix_variables_to_their_hinted_value = False
+
+    def _record_search_stats(self, status):
+        """Thống kê lần tìm kiếm (status, conflict, nhánh, wall time, bound) và kích thước model"""
+        proto = self.model.Proto()
+        stats = {
+            "status": self.solver.StatusName(status),
+            "conflicts": self.solver.NumConflicts(),
+            "branches": self.solver.NumBranches(),
+            "walltime": round(self.solver.WallTime(), 3),
+            "variables": len(proto.variables),
+            "constraints": len(proto.constraints),
+            "objective": None,
+            "bound": None,
+            "gap": None,
+        }
+        if self.stages:
+            stats["stages"] = self.stages
+        if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            objective, bound = self.solver.ObjectiveValue(), self.solver.BestObjectiveBound()
+            stats.update(objective=objective, bound=bound,
+                         gap=round(abs(objective - bound) / max(1.0, abs(objective)), 6))
+            SEARCH_GAP.observe(stats["gap"])
+        self.search_stats = stats
+        SEARCH_STATUS_TOTAL.labels(status=stats["status"]).inc()
+        SEARCH_CONFLICTS.observe(stats["conflicts"])
+        SEARCH_BRANCHES.observe(stats["branches"])
+        SEARCH_WALLTIME.observe(stats["walltime"])
+        MODEL_VARIABLES.observe(stats["variables"])
+        MODEL_CONSTRAINTS.observe(stats["constraints"])
+        logger.info("search finished", extra={**stats, "stop_reason": self.stop_reason})
+
+    def _base_horizon(self) -> int:
+        # Tự động tính Horizon nếu config quá bé
+        return planning_horizon(self.config, int(self.tables.duration.sum()))
+
+    @property
+    def tables(self) -> ProblemTables:
+        # Chuẩn hoá payload một lần, mọi bước sau đọc từ bảng
+        if self._tables is None:
+            self._tables = ProblemTables(self.payload)
+        return self._tables
+
     def _build_model(self):
         task_vars = {}
+        tables = self.tables
         
-        resource_map = {r["id"]: r for r in self.resources}
-        resource_intervals = {r["id"]: [] for r in self.resources}
-        resource_demands = {r["id"]: [] for r in self.resources}
+        resource_map = dict(tables.resource_by_id)
+        resource_intervals = {r_id: [] for r_id in tables.resource_ids}
+        resource_demands = {r_id: [] for r_id in tables.resource_ids}
         
-        # Tự động tính Horizon nếu config quá bé
-        total_duration = sum(int(t.get("duration") or 0) for t in self.tasks)
-        config_horizon = int(self.config.get("horizon_minutes", 100000))
-        horizon = max(config_horizon, total_duration + 10080) # Min là 1 tuần dư ra
-
-        # ---------------------------------------------------------
-        # 1. BUILD UNAVAILABILITY INTERVALS (DUMMY TASKS)
-        # ---------------------------------------------------------
-        resource_unavail_intervals = {}
-        for r in self.resources:
-            r_id = r["id"]
-            unavail_list = []
-            
-            for window in r.get("unavailability", []):
-                start = int(window["start"]) # Force int
-                end = int(window["end"])     # Force int
-                size = end - start
-                if size > 0:
-                    # Tạo Fixed Interval chặn giờ nghỉ
-                    ival = self.model.NewFixedSizeIntervalVar(start, size, f"Unavail_{r_id}_{start}")
-                    unavail_list.append(ival)
-            
-            resource_unavail_intervals[r_id] = unavail_list
+        horizon = self._base_horizon()
+
+        # Miền start/end của từng task từ phân tích đường găng (release, phụ thuộc, giờ nghỉ)
+        feasible_starts = {}
+        bounds = {}
+        if self.config.get("tighten_domains", True):
+            feasible_starts = self._feasible_starts()
+            bounds, horizon = compute_time_bounds(self.tasks, horizon, self.frozen, feasible_starts)
+        self.horizon = horizon
+
+        # Máy giống hệt nhau: gộp thành pool (thay cho từng máy) hoặc phá đối xứng sau khi tạo biến
+        self._machine_symmetry(resource_map, resource_intervals, resource_demands)
+        # Máy phải giữ interval giờ nghỉ: có task mà miền start chưa loại các giờ nghỉ của máy
+        needs_breaks = set()
+        calendar_id = tables.calendar_id.tolist()
 
         # ---------------------------------------------------------
-        # 2. BUILD TASKS VARIABLES
+        # 1. BUILD TASKS VARIABLES
         # ---------------------------------------------------------
-        for t in self.tasks:
-            t_id = t.get("task_id") or t.get("TaskID")
-            if not t_id: continue
-
-            start_var = self.model.NewIntVar(0, horizon, f"{t_id}_start")
-            end_var = self.model.NewIntVar(0, horizon, f"{t_id}_end")
+        # Đổi sang list số nguyên Python một lần (CP-SAT không nhận numpy scalar nhanh bằng int)
+        durations = tables.duration.tolist()
+        releases = tables.release.tolist()
+        dues = tables.due.tolist()
+        priorities = tables.priority.tolist()
+        demands = tables.demand.tolist()
+        compat_ptr = tables.compat_ptr.tolist()
+        compat_idx = tables.compat_idx.tolist()
+        vars_by_index = []
+
+        for i, t_id in enumerate(tables.task_ids):
+            task_duration = durations[i]
+
+            flat = []
+            fixed = self.frozen.get(t_id)
+            if fixed:
+                # Task đã chốt: start/end cố định trên đúng máy đã gán
+                fixed_start = int(fixed["start_min"])
+                fixed_end = int(fixed["end_min"])
+                start_var = self.model.NewIntVar(fixed_start, fixed_start, f"{t_id}_start")
+                end_var = self.model.NewIntVar(fixed_end, fixed_end, f"{t_id}_end")
+                start_bounds = (fixed_start, fixed_start)
+            elif t_id in bounds:
+                # Miền đã thu hẹp: [earliest start, latest end], bỏ các khoảng task không vừa giờ nghỉ
+                earliest_start, latest_end = bounds[t_id]
+                latest_end = max(latest_end, earliest_start + task_duration)
+                latest_start = latest_end - task_duration
+                starts = feasible_starts.get(t_id)
+                flat = starts.clip(earliest_start, latest_start) if starts else []
+                if flat:
+                    start_var = self.model.NewIntVarFromDomain(
+                        cp_model.Domain.FromFlatIntervals(flat), f"{t_id}_start"
+                    )
+                else:
+                    start_var = self.model.NewIntVar(earliest_start, latest_start, f"{t_id}_start")
+                end_var = self.model.NewIntVar(earliest_start + task_duration, latest_end, f"{t_id}_end")
+                start_bounds = (earliest_start, latest_start)
+            else:
+                start_var = self.model.NewIntVar(0, horizon, f"{t_id}_start")
+                end_var = self.model.NewIntVar(0, horizon, f"{t_id}_end")
+                start_bounds = (0, horizon)
             
-            # Start After Constraint
-            start_after = int(t.get("start_after_min") or t.get("StartAfterMin") or 0)
-            if start_after > 0:
+            # Start After Constraint (đã nằm trong miền nếu có phân tích đường găng)
+            start_after = releases[i]
+            if start_after > 0 and not fixed and t_id not in bounds:
                 self.model.Add(start_var >= start_after)
 
             literals = []
@@ -161,7 +479,22 @@ class Engine:
             # [SOFT CONSTRAINT] Biến cho phép Drop task nếu không thể xếp lịch
             is_dropped = self.model.NewBoolVar(f"{t_id}_dropped")
             
-            compatible_ids = t.get("compatible_resource_ids") or t.get("CompatibleResourceIDs") or []
+            if fixed:
+                compatible_ids = [fixed["machine_id"]]
+                self.model.Add(is_dropped == 0)
+                interval_duration = fixed_end - fixed_start
+                needs_breaks.add(fixed["machine_id"])
+            else:
+                compatible = compat_idx[compat_ptr[i]:compat_ptr[i + 1]]
+                compatible_ids = [tables.resource_ids[j] for j in compatible]
+                if self.pool_of:
+                    # Các máy cùng pool chỉ còn một literal / interval
+                    compatible_ids = list(dict.fromkeys(self.pool_of.get(r_id, r_id) for r_id in compatible_ids))
+                interval_duration = task_duration
+                # Miền start đã bỏ mọi start cắt ngang giờ nghỉ khi các máy tương thích cùng một lịch;
+                # nếu không thì máy vẫn cần interval giờ nghỉ
+                if not (flat and len({calendar_id[j] for j in compatible}) == 1):
+                    needs_breaks.update(compatible_ids)
             
             for r_id in compatible_ids:
                 if r_id not in resource_map: continue
@@ -170,20 +503,12 @@ class Engine:
                 literals.append(is_selected)
                 r_ids.append(r_id)
 
-                # [FIX] Force int cho duration
-                duration = int(t.get("duration") or t.get("Duration") or 0)
-                
                 # Interval Optional: Chỉ active nếu chọn máy này
                 interval = self.model.NewOptionalIntervalVar(
-                    start_var, duration, end_var, is_selected, f"Int_{t_id}_{r_id}"
+                    start_var, interval_duration, end_var, is_selected, f"Int_{t_id}_{r_id}"
                 )
                 resource_intervals[r_id].append(interval)
-                
-                # Logic Demand
-                is_batch = t.get("is_batch") or t.get("IsBatch")
-                qty_raw = t.get("qty") or t.get("Qty") or 1
-                demand = int(qty_raw) if is_batch else 1
-                resource_demands[r_id].append(demand)
+                resource_demands[r_id].append(demands[i])
 
             # [QUAN TRỌNG] Ràng buộc chọn máy: Chọn 1 máy HOẶC bị Drop
             if literals:
@@ -192,39 +517,65 @@ class Engine:
                 # Không có máy nào tương thích -> Buộc phải Drop
                 self.model.Add(is_dropped == 1)
 
-            # Store info
-            prio_val = int(t.get("priority") or t.get("Priority") or 3)
-            due_val = int(t.get("due_at_min") or t.get("DueAtMin") or horizon)
-
             task_vars[t_id] = {
+                "index": i,
                 "start": start_var,
                 "end": end_var,
                 "literals": literals,
                 "is_dropped": is_dropped, # Lưu biến drop
                 "r_ids": r_ids,
-                "due": due_val,      
-                "priority": prio_val, 
-                
-                "depends_on": t.get("final_depends_on") or t.get("FinalDependsOn") or [],
-                "internal_dep": t.get("internal_dep") or t.get("InternalDep"),
-                
-                "original_order_id": t.get("original_order_id") or t.get("OriginalOrderID"),
-                "sub_task_completion_offsets": t.get("sub_task_completion_offsets") or t.get("SubTaskCompletionOffsets") or {}
+                "due": dues[i] or horizon,
+                "priority": priorities[i],
+                "original_order_id": tables.order_ids[i],
+                "is_frozen": bool(fixed),
+                "duration": task_duration,
+                "start_bounds": start_bounds
             }
+            vars_by_index.append(task_vars[t_id])
+
+        # ---------------------------------------------------------
+        # 2. BUILD UNAVAILABILITY INTERVALS (DUMMY TASKS)
+        # ---------------------------------------------------------
+        # Một bộ Fixed Interval cho mỗi lịch nghỉ (đã gộp khoảng giao / kề), máy cùng lịch dùng chung.
+        # Máy không có task nào cần (mọi miền start đã né giờ nghỉ) thì bỏ hẳn.
+        calendar_intervals = {}
+
+        def unavail_intervals_of(r_id):
+            if r_id not in needs_breaks:
+                return []
+            c = calendar_id[tables.resource_index[r_id]] if r_id in tables.resource_index else \
+                calendar_id[tables.resource_index[self.pools[r_id][0]]]
+            if c not in calendar_intervals:
+                calendar_intervals[c] = [
+                    self.model.NewFixedSizeIntervalVar(start, end - start, f"Unavail_c{c}_{start}")
+                    for start, end in tables.calendars[c]
+                ]
+            return calendar_intervals[c]
 
         # ---------------------------------------------------------
         # 3. APPLY RESOURCE CONSTRAINTS
         # ---------------------------------------------------------
+        break_refs = 0
         for r_id, r in resource_map.items():
+            if r_id in self.pool_of: continue  # Máy đã gộp vào pool
             intervals = resource_intervals[r_id]
-            unavail_intervals = resource_unavail_intervals.get(r_id, [])
+            unavail_intervals = unavail_intervals_of(r_id) if intervals else []
+            break_refs += len(unavail_intervals)
             all_intervals = intervals + unavail_intervals
             
             if not all_intervals: continue
             
-            if r.get("type") == "batch" or r.get("operation") == "washing":
+            if r.get("type") == "pool":
+                # Pool k máy serial giống nhau: mỗi task chiếm 1, giờ nghỉ chung chiếm cả k
+                pool_size = int(r["capacity"])
+                self.model.AddCumulative(
+                    all_intervals,
+                    [1] * len(intervals) + [pool_size] * len(unavail_intervals),
+                    pool_size
+                )
+            elif tables.cumulative[tables.resource_index[r_id]]:
                 # Cumulative Constraint (Máy giặt)
-                machine_capacity = int(r.get("capacity", 100))
+                machine_capacity = int(tables.capacity[tables.resource_index[r_id]])
                 task_demands = resource_demands[r_id]
                 
                 # Giờ nghỉ phải chiếm toàn bộ capacity để chặn
@@ -239,75 +590,295 @@ class Engine:
                 # No Overlap Constraint (Máy thường)
                 self.model.AddNoOverlap(all_intervals)
 
+        logger.info("break intervals", extra={
+            "windows": tables.raw_window_count,
+            "shared_intervals": sum(len(v) for v in calendar_intervals.values()),
+            "calendars_used": len(calendar_intervals),
+            "calendars": len(tables.calendars),
+            "break_uses": break_refs,
+        })
+
+        # ---------------------------------------------------------
+        # 3b. SEQUENCE-DEPENDENT SETUPS
+        # ---------------------------------------------------------
+        changeovers = self._add_setup_constraints(vars_by_index)
+
+        self._break_machine_symmetry(task_vars)
+
         # ---------------------------------------------------------
         # 4. APPLY DEPENDENCY CONSTRAINTS
         # ---------------------------------------------------------
-        for t_id, tv in task_vars.items():
-            # Chỉ áp dụng dependency nếu task KHÔNG bị drop (Enforce if not dropped)
-            # Tuy nhiên trong CP-SAT, biến start/end của optional interval bị disable không xác định
-            # Nên ta chỉ add constraint đơn giản, nếu drop thì constraint vẫn đúng vì start/end tự do
-            
+        # Chỉ áp dụng dependency nếu task KHÔNG bị drop (Enforce if not dropped)
+        # Tuy nhiên trong CP-SAT, biến start/end của optional interval bị disable không xác định
+        # Nên ta chỉ add constraint đơn giản, nếu drop thì constraint vẫn đúng vì start/end tự do
+        dep_ptr = tables.dep_ptr.tolist()
+        dep_idx = tables.dep_idx.tolist()
+        dep_lag = tables.dep_lag.tolist()
+        dep_is_start = tables.dep_is_start.tolist()
+        internal_dep = tables.internal_dep.tolist()
+
+        for i, tv in enumerate(vars_by_index):
             # A. General Dependencies
-            for parent_id in tv["depends_on"]:
-                if parent_id not in task_vars: continue
-                parent_tv = task_vars[parent_id]
-                
-                offsets = parent_tv["sub_task_completion_offsets"]
-                child_order_id = tv["original_order_id"]
-
-                # Logic Interleaved Batching
-                if offsets and child_order_id and child_order_id in offsets:
-                    lag_minutes = int(offsets[child_order_id]) 
-                    self.model.Add(
-                        tv["start"] >= parent_tv["start"] + lag_minutes + BUFFER_TIME
-                    )
+            for k in range(dep_ptr[i], dep_ptr[i + 1]):
+                parent_tv = vars_by_index[dep_idx[k]]
+                if dep_is_start[k]:
+                    # Logic Interleaved Batching
+                    self.model.Add(tv["start"] >= parent_tv["start"] + dep_lag[k] + BUFFER_TIME)
                 else:
-                    self.model.Add(
-                        tv["start"] >= parent_tv["end"] + BUFFER_TIME
-                    )
+                    self.model.Add(tv["start"] >= parent_tv["end"] + BUFFER_TIME)
 
             # B. Internal Slice Dependencies
-            prev_id = tv["internal_dep"]
-            if prev_id and prev_id in task_vars:
-                prev_tv = task_vars[prev_id]
+            if internal_dep[i] >= 0:
+                prev_tv = vars_by_index[internal_dep[i]]
                 self.model.Add(tv["start"] >= prev_tv["end"])
                 
                 # Ràng buộc slice cùng task phải cùng máy (nếu không bị drop)
-                for i, lit in enumerate(tv["literals"]):
-                    r_id = tv["r_ids"][i]
-                    if r_id in prev_tv["r_ids"]:
-                        idx_prev = prev_tv["r_ids"].index(r_id)
+                prev_lit_of = dict(zip(prev_tv["r_ids"], prev_tv["literals"]))
+                for r_id, lit in zip(tv["r_ids"], tv["literals"]):
+                    if r_id in prev_lit_of:
                         # lit == prev_lit
-                        self.model.Add(lit == prev_tv["literals"][idx_prev])
+                        self.model.Add(lit == prev_lit_of[r_id])
+                    elif prev_tv["is_frozen"]:
+                        # Slice trước đã chốt trên máy khác -> không được chọn máy này
+                        self.model.Add(lit == 0)
 
         # ---------------------------------------------------------
         # 5. OBJECTIVE FUNCTION
         # ---------------------------------------------------------
-        makespan = self.model.NewIntVar(0, horizon, "makespan")
-        objective_terms = []
-        
         # A. Penalty for Dropped Tasks (Ưu tiên cao nhất: Hạn chế Drop)
-        for _, tv in task_vars.items():
-            objective_terms.append(tv["is_dropped"] * DROP_PENALTY)
+        drops = sum(tv["is_dropped"] for tv in task_vars.values())
         
-        # B. Minimize Makespan
-        for _, tv in task_vars.items():
-            self.model.Add(makespan >= tv["end"])
-        objective_terms.append(makespan * 100)
-        
-        # C. Minimize Lateness
-        for _, tv in task_vars.items():
-            if tv["due"] < horizon:
-                delay = self.model.NewIntVar(0, horizon, f"delay")
-                self.model.Add(delay >= tv["end"] - tv["due"])
-                
-                prio = tv["priority"]
-                weight = int((6 - prio) * 1000) 
-                objective_terms.append(delay * weight)
-            
-        self.model.Minimize(sum(objective_terms))
+        # Task cuối của từng đơn: mọi task khác của đơn kết thúc trước một task cuối (cạnh end -> start)
+        with phase("order_sinks", self.timings):
+            sinks = order_sinks(self.tasks, dependency_edges(self.tasks))
+        known = {t.get("task_id") for t in self.tasks}
+        for t_id, tv in task_vars.items():
+            # Task chỉ có TaskID (ngoài đồ thị phụ thuộc theo task_id) là một đơn riêng
+            tv.update(order=tv["original_order_id"] or t_id, is_sink=t_id not in known)
+        for order, sink_ids in sinks.items():
+            for t_id in sink_ids:
+                if t_id in task_vars:
+                    task_vars[t_id].update(order=order, is_sink=True)
+        for tv in task_vars.values():
+            if tv["is_sink"] and not tv["is_frozen"]:
+                # Interval của task bị drop không còn buộc end = start + duration: giữ ràng buộc này
+                # trên task cuối để drop không xoá được trễ / makespan của cả đơn
+                self.model.Add(tv["end"] == tv["start"] + tv["duration"])
+
+        # B. Minimize Makespan (một ràng buộc max trên end của các task cuối)
+        makespan = self.model.NewIntVar(0, horizon, "makespan")
+        self.model.AddMaxEquality(makespan, [tv["end"] for tv in task_vars.values() if tv["is_sink"]])
+
+        # C. Minimize Lateness theo đơn: một biến trễ cho mỗi đơn, >= trễ của từng task cuối có hạn,
+        # trọng số theo priority cao nhất trong các task đó
+        self.order_lateness = {}
+        for t_id, tv in task_vars.items():
+            if tv["is_sink"] and tv["due"] < horizon:
+                entry = self.order_lateness.get(tv["order"])
+                if entry is None:
+                    entry = self.order_lateness[tv["order"]] = {
+                        "delay": self.model.NewIntVar(0, horizon, f"{tv['order']}_delay"),
+                        "constraints": {},
+                    }
+                # Giữ ràng buộc để kịch bản what-if đổi due / priority trên bản sao model
+                entry["constraints"][t_id] = self.model.Add(entry["delay"] >= tv["end"] - tv["due"])
+        delays = [entry["delay"] for entry in self.order_lateness.values()]
+        weights = [self.order_weight(task_vars, entry) for entry in self.order_lateness.values()]
+        lateness = cp_model.LinearExpr.WeightedSum(delays, weights) if delays else 0
+        logger.info("order objective", extra={"orders": len(sinks), "late_terms": len(delays),
+                                               "sinks": sum(1 for tv in task_vars.values() if tv["is_sink"])})
+
+        # Các thành phần giữ riêng cho chế độ lexicographic; objective_value luôn báo theo tổng có trọng số
+        # D. Minimize Changeovers (tuỳ chọn, chỉ máy dùng circuit)
+        changeover_weight = int(self.config.get("changeover_weight") or CHANGEOVER_WEIGHT)
+
+        self.objectives = {
+            "drops": drops,
+            "lateness": lateness,
+            "makespan": makespan,
+            "changeovers": changeovers,
+            "weighted": drops * DROP_PENALTY + makespan * MAKESPAN_WEIGHT + lateness + changeovers * changeover_weight,
+        }
+        self.model.Minimize(self.objectives["weighted"])
         return task_vars
 
+    @staticmethod
+    def order_weight(task_vars, entry) -> int:
+        """Trọng số trễ của một đơn: priority cao nhất (số nhỏ nhất) trong các task cuối có hạn"""
+        return max(int((6 - task_vars[t_id]["priority"]) * 1000) for t_id in entry["constraints"])
+
+    def _add_setup_constraints(self, vars_by_index):
+        """
+        Thời gian chuyển đổi giữa hai task khác mã hàng liền nhau trên máy serial có setup
+        (xem `setups`). Với `minimize_changeovers`, máy có ít task dùng circuit và trả về tổng
+        phút chuyển đổi cho objective; ngược lại trả về 0.
+        """
+        if not self.setup_machines:
+            return 0
+        tables = self.tables
+        items = []
+        for tv in vars_by_index:
+            item = SetupItem(tv, tables.design_ids[tv["index"]], tables.operations[tv["index"]])
+            item.lits = {r_id: lit for r_id, lit in zip(tv["r_ids"], tv["literals"]) if r_id in self.setup_machines}
+            if item.lits and item.design:
+                items.append(item)
+        with phase("setup_constraints", self.timings):
+            self.setups = SetupConstraints(self.model, self.setup_times).build(
+                items,
+                circuits=bool(self.config.get("minimize_changeovers", False)),
+                circuit_max_tasks=int(self.config.get("setup_circuit_max_tasks") or SETUP_CIRCUIT_MAX_TASKS),
+                neighbours=int(self.config.get("setup_neighbours") or SETUP_NEIGHBOURS),
+            )
+        return self.setups.changeovers
+
+    def _machine_symmetry(self, resource_map, resource_intervals, resource_demands):
+        """
+        Tìm các lớp máy hoán đổi được (cùng loại, capacity, lịch nghỉ, tập task tương thích).
+        Chế độ `symmetry_mode`:
+        - "break" (mặc định): giữ nguyên model, thêm ràng buộc thứ tự máy trong lớp
+          (xem `_break_machine_symmetry`).
+        - "pool": lớp máy serial (không có slice internal_dep) được thay bằng một resource
+          ảo "POOL:<i>" capacity = số máy, mỗi task chỉ còn một literal cho cả lớp; máy cụ
+          thể được gán lại khi trích lời giải (`assign_pooled_machines`).
+        - "off": không làm gì.
+        """
+        self.symmetry_classes = []
+        self.pools = {}
+        self.pool_of = {}
+        self.pool_resources = {}
+        mode = self.config.get("symmetry_mode", "break")
+        if mode not in ("break", "pool"):
+            return
+
+        # Máy có setup chỉ hoán đổi được với máy cùng bảng setup, và không gộp pool (mất thứ tự trên từng máy)
+        setup_tables = {r_id: self.setup_times.signature(r_id) for r_id in self.setup_machines}
+        for members in machine_equivalence_classes(self.resources, self.tasks, self.frozen, setup_tables):
+            if mode == "pool" and poolable(members, self.tasks, resource_map) \
+                    and not self.setup_machines.intersection(members):
+                pool_id = f"{POOL_PREFIX}{len(self.pools)}"
+                calendar = _calendar(resource_map[members[0]])
+                pool = {
+                    "id": pool_id,
+                    "type": "pool",
+                    "capacity": len(members),
+                    "unavailability": [{"start": start, "end": end} for start, end in calendar],
+                }
+                self.pools[pool_id] = members
+                self.pool_resources[pool_id] = pool
+                for r_id in members:
+                    self.pool_of[r_id] = pool_id
+                resource_map[pool_id] = pool
+                resource_intervals[pool_id] = []
+                resource_demands[pool_id] = []
+                n_tasks = sum(1 for t in self.tasks if members[0] in (t.get("compatible_resource_ids") or []))
+                logger.info("symmetry class pooled", extra={
+                    "machines": members, "tasks": n_tasks, "pool_id": pool_id,
+                    "removed": n_tasks * (len(members) - 1),
+                })
+            else:
+                # Task của lớp được điền sau khi tạo biến (xem `_break_machine_symmetry`)
+                self.symmetry_classes.append((members, []))
+
+    def _break_machine_symmetry(self, task_vars):
+        """
+        Phá đối xứng trong lớp k máy giống nhau: xét task của lớp theo thứ tự trong model,
+        task thứ j (tính từ 0) chỉ được dùng máy có chỉ số <= j. Mọi lịch đều đổi tên máy
+        được về dạng này (máy được dùng lần đầu theo thứ tự), nên không mất lời giải.
+        """
+        for members, task_ids in self.symmetry_classes:
+            task_ids[:] = [t_id for t_id, tv in task_vars.items() if members[0] in tv["r_ids"]]
+            fixed = 0
+            for j, t_id in enumerate(task_ids[:len(members) - 1]):
+                tv = task_vars[t_id]
+                lit_of = dict(zip(tv["r_ids"], tv["literals"]))
+                for r_id in members[j + 1:]:
+                    self.model.Add(lit_of[r_id] == 0)
+                    fixed += 1
+            logger.info("symmetry class ordered", extra={
+                "machines": members, "tasks": len(task_ids), "fixed_literals": fixed,
+            })
+
+    def _feasible_starts(self) -> Dict[str, FeasibleStarts]:
+        """
+        Thời điểm start hợp lệ của từng task: hợp các khoảng trống đủ dài trên các máy
+        tương thích. Cache theo (tập lịch nghỉ, duration) vì nhiều task / máy dùng chung lịch.
+        """
+        tables = self.tables
+        durations = tables.duration.tolist()
+        compat_ptr = tables.compat_ptr.tolist()
+        compat_idx = tables.compat_idx.tolist()
+        calendar_id = tables.calendar_id.tolist()
+        # Payload đã nén theo phút làm việc: task không tạm dừng được phải nằm trọn giữa hai mốc nghỉ
+        break_points = self.config.get(WORKING_TIME_BREAKS_KEY)
+        can_pause = tables.can_pause.tolist()
+        cache = {}
+        result = {}
+        for i, t_id in enumerate(tables.task_ids):
+            if t_id in self.frozen:
+                continue
+            duration = durations[i]
+            compatible = compat_idx[compat_ptr[i]:compat_ptr[i + 1]]
+            if duration <= 0 or not compatible:
+                continue
+            if break_points and not can_pause[i]:
+                key = ("segments", duration)
+                if key not in cache:
+                    cache[key] = FeasibleStarts(segment_start_intervals(break_points, duration))
+                result[t_id] = cache[key]
+                continue
+            calendars = tuple(sorted({calendar_id[j] for j in compatible}))
+            key = (calendars, duration)
+            if key not in cache:
+                intervals = []
+                for c in calendars:
+                    intervals.extend(free_start_intervals(tables.calendars[c], duration))
+                cache[key] = FeasibleStarts(intervals)
+            result[t_id] = cache[key]
+        return result
+
+    def _apply_hints(self, task_vars, hints, stats=None):
+        """
+        Đưa một lịch có sẵn (lịch lần trước hoặc heuristic) vào CP-SAT làm solution hint
+        (start var + literal chọn máy). Hint không còn hợp lệ (máy không còn tương thích,
+        start nằm ngoài miền của start var) được sửa lại trước khi dùng; nếu có `stats`
+        thì đếm số hint "kept" / "repaired" / "missing".
+        """
+        stats = stats if stats is not None else {"kept": 0, "repaired": 0, "missing": 0}
+        for t_id, tv in task_vars.items():
+            if tv["is_frozen"]:
+                continue
+            hint = hints.get(t_id)
+            if not hint:
+                stats["missing"] += 1
+                continue
+
+            repaired = False
+            start = int(hint.get("start_min", 0))
+            lower, upper = tv["start_bounds"]
+            if start < lower or start > upper:
+                start = min(max(start, lower), upper)
+                repaired = True
+
+            machine_id = self.pool_of.get(hint.get("machine_id"), hint.get("machine_id"))
+            if machine_id not in tv["r_ids"]:
+                if not tv["r_ids"]:
+                    stats["repaired"] += 1
+                    continue
+                # Máy cũ không còn tương thích -> gợi ý máy đầu tiên
+                machine_id = tv["r_ids"][0]
+                repaired = True
+
+            self.model.AddHint(tv["start"], start)
+            self.model.AddHint(tv["end"], start + tv["duration"])
+            self.model.AddHint(tv["is_dropped"], 0)
+            for r_id, lit in zip(tv["r_ids"], tv["literals"]):
+                self.model.AddHint(lit, 1 if r_id == machine_id else 0)
+
+            stats["repaired" if repaired else "kept"] += 1
+
+        if stats is self.hint_stats:
+            logger.info("solution hints", extra=self.hint_stats)
+
     def _extract_solution(self, task_vars):
         assignments = []
         overloads = []
@@ -355,14 +926,22 @@ class Engine:
                         "root_cause_code": "CAPACITY_FULL",
                         "bottleneck_resource_id": selected_res
                     })
+
+        if self.pools:
+            # Gán máy cụ thể cho task xếp trên pool, cập nhật máy nghẽn của task trễ
+            assign_pooled_machines(assignments, self.pools)
+            machine_of = {a["task_id"]: a["machine_id"] for a in assignments}
+            for o in overloads:
+                if o["status"] == "LATE":
+                    o["bottleneck_resource_id"] = machine_of.get(o["task_id"], o["bottleneck_resource_id"])
         
         if overloads:
             dropped_count = sum(1 for o in overloads if o["status"] == "DROPPED")
             late_count = sum(1 for o in overloads if o["status"] == "LATE")
-            print(f"\n⚠️  OVERLOAD SUMMARY: {dropped_count} DROPPED, {late_count} LATE")
-            if dropped_count > 0:
-                dropped_ids = [o["task_id"] for o in overloads if o["status"] == "DROPPED"][:10]
-                print(f"    -> Dropped: {dropped_ids} ...")
+            dropped_ids = [o["task_id"] for o in overloads if o["status"] == "DROPPED"][:10]
+            logger.warning("overload summary", extra={
+                "dropped": dropped_count, "late": late_count, "dropped_sample": dropped_ids,
+            })
 
         return assignments, overloads
 
@@ -370,57 +949,22 @@ class Engine:
         """Determine why a task was dropped"""
         if not tv.get("literals"):
             return "NO_COMPATIBLE_RESOURCE"
-        return "SLOT_TOO_SMALL_OR_CAPACITY_FULL"
-
-    def _diagnose_input_issues(self):
-        """Kiểm tra sơ bộ xem có task nào bất khả thi ngay từ đầu không"""
-        print("\n--- DIAGNOSING INPUT DATA ---")
-        resource_map = {r["id"]: r for r in self.resources}
-        
-        issues_found = False
-        for t in self.tasks:
-            duration = int(t.get("duration") or 0)
-            compatible_ids = t.get("compatible_resource_ids") or []
-            
-            if not compatible_ids:
-                print(f"❌ Task '{t.get('task_id')}' has NO compatible resources!")
-                issues_found = True
-                continue
-
-            max_slot_found = 0
-            # Tìm khoảng trống lớn nhất trên các máy tương thích
-            for r_id in compatible_ids:
-                if r_id not in resource_map: continue
-                res = resource_map[r_id]
-                windows = res.get("unavailability", [])
-                
-                # Tính max gap
-                current_time = 0
-                local_max = 0
-                sorted_windows = sorted(windows, key=lambda x: int(x['start']))
-                
-                for w in sorted_windows:
-                    w_start = int(w['start'])
-                    gap = w_start - current_time
-                    if gap > local_max: local_max = gap
-                    current_time = int(w['end'])
-                
-                # Check đoạn cuối đến vô cực (horizon giả định 1 tuần)
-                gap = 10080 - current_time 
-                if gap > local_max: local_max = gap
-                
-                if local_max > max_slot_found: max_slot_found = local_max
-            
-            if duration > max_slot_found:
-                print(f"⚠️  Task '{t.get('task_id')}' duration ({duration}m) > Max Slot ({max_slot_found}m). It will likely be DROPPED.")
-                issues_found = True
-        
-        if not issues_found:
-            print("✅ Input diagnosis passed. No obvious impossible tasks.")
-        print("-----------------------------\n")
+        # Task đã được chẩn đoán là không thể xếp (dài hơn mọi khoảng trống, ...)
+        return self._drop_codes.get(t_id, "SLOT_TOO_SMALL_OR_CAPACITY_FULL")
+
+    def _log_diagnostics(self):
+        report = self.diagnostics
+        summary = report["summary"]
+        if not report["issues"]:
+            logger.info("input diagnosis passed", extra={"tasks": summary["tasks"], "horizon": report["horizon"]})
+            return
+        logger.warning("input diagnosis found issues", extra={
+            "impossible_tasks": summary["impossible_tasks"], "counts": summary["counts"],
+            "issues_sample": report["issues"][:10],
+        })
 
     def _analyze_overlaps(self, task_vars):
-        resource_map = {r["id"]: r for r in self.resources}
+        resource_map = self.tables.resource_by_id
         for t_id, tv in task_vars.items():
             if self.solver.Value(tv["is_dropped"]) == 1: continue
 
@@ -434,9 +978,11 @@ class Engine:
                     break
             
             if selected_res:
-                windows = resource_map[selected_res].get("unavailability", [])
+                res = resource_map.get(selected_res) or self.pool_resources.get(selected_res, {})
+                windows = res.get("unavailability", [])
                 for w in windows:
                     w_start = int(w["start"])
                     w_end = int(w["end"])
                     if max(start, w_start) < min(end, w_end):
-                        print(f"❌ LOGIC ERROR: Task {t_id} overlaps break on {selected_res}")
\ No newline at end of file
+                        logger.error("logic error: task overlaps break",
+                                     extra={"task_id": t_id, "machine_id": selected_res})
\ No newline at end of file
@@ -0,0 +1,248 @@
+import logging
+import os
+from typing import Dict, Any, Optional, Tuple
+
+from .decomposition import DEFAULT_WINDOW_OVERLAP, DEFAULT_WINDOW_SIZE
+from .observability import GOVERNOR_ACTIONS_TOTAL
+from .routing import SOLVER_CONCURRENT_SOLVES, job_size, solver_cpu_share
+from .setups import SETUP_NEIGHBOURS, SetupTimes, setup_machines
+from .tables import ProblemTables
+
+logger = logging.getLogger(__name__)
+
+# Ngân sách bộ nhớ (MB) cho CP-SAT trên một host (mặc định: 80% giới hạn cgroup / RAM), chia đều
+# cho số lời giải chạy đồng thời như ngân sách CPU
+SOLVER_MEMORY_BUDGET_MB = int(os.getenv("SOLVER_MEMORY_BUDGET_MB", "0"))
+SOLVER_MEMORY_FRACTION = float(os.getenv("SOLVER_MEMORY_FRACTION", "0.8"))
+
+# Hệ số ước lượng bộ nhớ (đo trên benchmarks tier s / m / l, OR-Tools 9.x): process Python + OR-Tools,
+# payload + bảng chuẩn hoá theo task, model (proto) theo cặp task x máy và theo interval giờ nghỉ.
+# CP-SAT: lần tìm kiếm đầu (kể cả presolve) theo cặp; từ 2 worker trở lên thêm các bản model dùng
+# chung (một lần) rồi mỗi worker thêm phần cố định + theo cặp. Heuristic theo cặp
+GOVERNOR_BASE_MB = int(os.getenv("GOVERNOR_BASE_MB", "120"))
+GOVERNOR_KB_PER_TASK = float(os.getenv("GOVERNOR_KB_PER_TASK", "4"))
+GOVERNOR_BUILD_KB_PER_PAIR = float(os.getenv("GOVERNOR_BUILD_KB_PER_PAIR", "2"))
+GOVERNOR_KB_PER_BREAK = float(os.getenv("GOVERNOR_KB_PER_BREAK", "1"))
+GOVERNOR_SOLVE_KB_PER_PAIR = float(os.getenv("GOVERNOR_SOLVE_KB_PER_PAIR", "6"))
+GOVERNOR_PARALLEL_KB_PER_PAIR = float(os.getenv("GOVERNOR_PARALLEL_KB_PER_PAIR", "14"))
+GOVERNOR_MB_PER_WORKER = float(os.getenv("GOVERNOR_MB_PER_WORKER", "8"))
+GOVERNOR_WORKER_KB_PER_PAIR = float(os.getenv("GOVERNOR_WORKER_KB_PER_PAIR", "3.5"))
+GOVERNOR_HEURISTIC_KB_PER_PAIR = float(os.getenv("GOVERNOR_HEURISTIC_KB_PER_PAIR", "0.25"))
+# Cửa sổ rolling horizon nhỏ hơn ngưỡng này (task) thì xếp bằng heuristic thay vì chia cửa sổ
+GOVERNOR_MIN_WINDOW_TASKS = int(os.getenv("GOVERNOR_MIN_WINDOW_TASKS", "50"))
+
+# Lần giải bị ngắt giữa chừng (worker chết vì OOM) để lại khoá; lần giao lại chỉ chạy heuristic
+ATTEMPT_TTL_SECONDS = int(os.getenv("ATTEMPT_TTL_SECONDS", str(6 * 3600)))
+
+def host_memory_mb() -> int:
+    """Giới hạn bộ nhớ của container (cgroup v2 / v1) hoặc RAM vật lý của host"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 "không giới hạn" là một số rất lớn
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError):
+        return 0
+
+
+def solver_memory_share(concurrency: Optional[int]) -> int:
+    """Phần ngân sách bộ nhớ (MB) của một lời giải; 0 = không xác định được (governor tắt)"""
+    budget = SOLVER_MEMORY_BUDGET_MB or int(host_memory_mb() * SOLVER_MEMORY_FRACTION)
+    slots = SOLVER_CONCURRENT_SOLVES or concurrency or 1
+    return budget // slots
+
+
+def memory_size(tables: ProblemTables, payload: Dict[str, Any]) -> Dict[str, int]:
+    """
+    `job_size` cộng số cặp sắp thứ tự setup: mỗi task chạy được trên máy có setup được xếp
+    trước / sau với `setup_neighbours` task khác mã hàng (circuit trên máy nhỏ có cỡ tương đương).
+    """
+    size = job_size(tables)
+    config = payload.get("config") or {}
+    machines = set()
+    if config.get("setup_mode", "auto") != "off":
+        machines = setup_machines(payload, SetupTimes(payload))
+    setup_idx = {tables.resource_index[m] for m in machines if m in tables.resource_index}
+    compat, ptr = tables.compat_idx.tolist(), tables.compat_ptr.tolist()
+    setup_tasks = sum(1 for i in range(tables.n_tasks) if any(j in setup_idx for j in compat[ptr[i]:ptr[i + 1]]))
+    size["setup_pairs"] = setup_tasks * int(config.get("setup_neighbours") or SETUP_NEIGHBOURS)
+    return size
+
+
+def estimate_memory_mb(size: Dict[str, int], workers: int = 1, copies: int = 1, solves: int = 1) -> int:
+    """
+    Peak RSS ước lượng của một job: `copies` bản model (what-if: model chung cộng một bản sao cho
+    mỗi kịch bản đang giải), `solves` lần CP-SAT chạy cùng lúc chia nhau tổng cộng `workers` worker.
+    """
+    pairs = size["pairs"] + size.get("setup_pairs", 0)
+    build_kb = pairs * GOVERNOR_BUILD_KB_PER_PAIR + (size["intervals"] - size["pairs"]) * GOVERNOR_KB_PER_BREAK
+    per_solve = max(1, workers // solves)
+    solve_kb = pairs * GOVERNOR_SOLVE_KB_PER_PAIR
+    if per_solve > 1:
+        solve_kb += pairs * GOVERNOR_PARALLEL_KB_PER_PAIR + (per_solve - 1) * pairs * GOVERNOR_WORKER_KB_PER_PAIR
+    solve_mb = solve_kb / 1024 + (per_solve - 1) * GOVERNOR_MB_PER_WORKER
+    return int(GOVERNOR_BASE_MB + size["tasks"] * GOVERNOR_KB_PER_TASK / 1024
+               + copies * build_kb / 1024 + solves * solve_mb)
+
+
+def estimate_heuristic_mb(size: Dict[str, int]) -> int:
+    return int(GOVERNOR_BASE_MB + size["tasks"] * GOVERNOR_KB_PER_TASK / 1024
+               + size["pairs"] * GOVERNOR_HEURISTIC_KB_PER_PAIR / 1024)
+
+
+def _window_tasks(size: Dict[str, int], budget: int) -> int:
+    """Số task chốt mỗi cửa sổ rolling horizon (1 worker) để model của cửa sổ vừa ngân sách"""
+    fixed = GOVERNOR_BASE_MB + size["tasks"] * GOVERNOR_KB_PER_TASK / 1024
+    per_task = (estimate_memory_mb(size) - fixed) / max(1, size["tasks"])
+    room = budget - fixed
+    if room <= 0 or per_task <= 0:
+        return 0
+    # Cửa sổ gồm window_size task chốt cộng phần gối sang cửa sổ sau
+    return int(room / per_task * DEFAULT_WINDOW_SIZE / (DEFAULT_WINDOW_SIZE + DEFAULT_WINDOW_OVERLAP))
+
+
+def plan_memory(tables: ProblemTables, payload: Dict[str, Any], concurrency: Optional[int] = None,
+                allow_decompose: bool = True, scenarios: int = 0) -> Dict[str, Any]:
+    """
+    Chọn cách giải vừa ngân sách bộ nhớ trước khi dựng model. Thứ tự lùi dần: đủ worker,
+    bớt worker CP-SAT, rolling horizon (cửa sổ vừa ngân sách), chỉ heuristic, từ chối.
+    Config `memory_governor`: "auto" (mặc định), "reject" (không lùi sang chế độ khác) hoặc "off".
+    `scenarios` > 0: số kịch bản what-if giải song song trên bản sao của model chung.
+    """
+    copies, solves = (scenarios + 1, scenarios) if scenarios else (1, 1)
+    config = payload.get("config") or {}
+    governor = config.get("memory_governor", "auto")
+    budget = solver_memory_share(concurrency)
+    size = memory_size(tables, payload)
+    requested = int(config.get("num_search_workers") or solver_cpu_share(concurrency))
+    plan = {"action": "full", "budget_mb": budget, "num_search_workers": requested, **size,
+            "estimated_mb": estimate_memory_mb(size, requested, copies, solves)}
+    if governor == "off" or budget <= 0:
+        return plan
+
+    if config.get("mode") == "heuristic":
+        plan["estimated_mb"] = estimate_heuristic_mb(size)
+        if plan["estimated_mb"] > budget:
+            plan["action"] = "reject"
+        return plan
+
+    for workers in range(requested, 0, -1):
+        estimated = estimate_memory_mb(size, workers, copies, solves)
+        if estimated <= budget:
+            plan.update(num_search_workers=workers, estimated_mb=estimated,
+                        action="full" if workers == requested else "reduce_workers")
+            return plan
+
+    plan.update(num_search_workers=1, estimated_mb=estimate_memory_mb(size, 1, copies, solves))
+    if governor == "reject":
+        plan["action"] = "reject"
+        return plan
+    window = _window_tasks(size, budget) if allow_decompose and not scenarios else 0
+    if window >= GOVERNOR_MIN_WINDOW_TASKS:
+        window = min(window, int(config.get("window_size") or window))
+        plan.update(action="rolling_horizon", window_size=window)
+    elif estimate_heuristic_mb(size) <= budget and not scenarios:
+        plan.update(action="heuristic", estimated_mb=estimate_heuristic_mb(size))
+    else:
+        plan["action"] = "reject"
+    return plan
+
+
+def apply_memory_plan(payload: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Payload với config theo kế hoạch: `max_memory_mb` (giới hạn của CP-SAT), số worker,
+    rolling horizon hoặc chế độ heuristic. Kế hoạch "reject" không được áp (người gọi từ chối job).
+    """
+    config = dict(payload.get("config") or {})
+    if plan["budget_mb"] > 0 and config.get("memory_governor", "auto") != "off":
+        config["max_memory_mb"] = min(int(config.get("max_memory_mb") or plan["budget_mb"]), plan["budget_mb"])
+    config["num_search_workers"] = plan["num_search_workers"]
+    if plan["action"] == "rolling_horizon":
+        config.update(rolling_horizon=True, window_size=plan["window_size"])
+    elif plan["action"] == "heuristic":
+        config["mode"] = "heuristic"
+    return dict(payload, config=config)
+
+
+def _log_plan(payload: Dict[str, Any], plan: Dict[str, Any]):
+    GOVERNOR_ACTIONS_TOTAL.labels(action=plan["action"]).inc()
+    log = logger.info if plan["action"] == "full" else logger.warning
+    log("memory governor", extra={"job_id": payload.get("job_id"), **plan})
+
+
+def govern(payload: Dict[str, Any], concurrency: Optional[int] = None, allow_decompose: bool = True,
+           tables: Optional[ProblemTables] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(payload đã chỉnh, kế hoạch); kế hoạch "reject" thì payload giữ nguyên"""
+    plan = plan_memory(tables or ProblemTables(payload), payload, concurrency, allow_decompose)
+    _log_plan(payload, plan)
+    if plan["action"] == "reject":
+        return payload, plan
+    return apply_memory_plan(payload, plan), plan
+
+
+def govern_scenarios(base: Dict[str, Any], jobs: int, concurrency: Optional[int] = None,
+                     tables: Optional[ProblemTables] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Như `govern` cho một lô what-if (`jobs` lần giải, kể cả base): mỗi kịch bản giải song song
+    giữ một bản sao model, nên bớt số kịch bản chạy cùng lúc (`scenario_workers`) trước khi từ chối.
+    """
+    config = base.get("config") or {}
+    tables = tables or ProblemTables(base)
+    requested = int(config.get("num_search_workers") or solver_cpu_share(concurrency))
+    pool_size = max(1, min(jobs, int(config.get("scenario_workers") or requested)))
+    for parallel in range(pool_size, 0, -1):
+        plan = plan_memory(tables, base, concurrency, allow_decompose=False, scenarios=parallel)
+        if plan["action"] != "reject":
+            break
+    plan["scenario_workers"] = parallel
+    _log_plan(base, plan)
+    if plan["action"] == "reject":
+        return base, plan
+    payload = apply_memory_plan(base, plan)
+    payload["config"]["scenario_workers"] = parallel
+    return payload, plan
+
+
+def rejection(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Kết quả trả về cho job bị từ chối vì model vượt ngân sách bộ nhớ (hoặc đã làm sập worker)"""
+    if plan.get("redelivered"):
+        error = "A previous attempt of this job was interrupted (worker killed, likely out of memory); not retried"
+    else:
+        error = (f"Estimated {plan['estimated_mb']} MB exceeds the solver memory budget of "
+                 f"{plan['budget_mb']} MB ({plan['pairs']} task x machine pairs)")
+    return {
+        "status": "rejected",
+        "assignments": [],
+        "overloads": [],
+        "stop_reason": "memory_budget",
+        "error": error,
+        "stats": {"memory": plan},
+    }
+
+
+# ---------------------------------------------------------
+# Khoá "đang giải": worker bị kill (OOM) giữa chừng không xoá khoá, nên job được giao lại
+# (task_acks_late) biết lần trước đã làm sập worker và chỉ chạy heuristic
+# ---------------------------------------------------------
+def attempt_key(celery_task_id: str) -> str:
+    return f"cp:attempt:{celery_task_id}"
+
+
+class SolveAttempts:
+    def __init__(self, url: str, ttl: int = ATTEMPT_TTL_SECONDS):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def start(self, celery_task_id: str) -> bool:
+        """Đánh dấu bắt đầu giải; False nếu lần giao trước của task này chưa kết thúc"""
+        return bool(self.client.set(attempt_key(celery_task_id), 1, nx=True, ex=self.ttl))
+
+    def finish(self, celery_task_id: str):
+        self.client.delete(attempt_key(celery_task_id))
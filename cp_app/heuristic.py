@@ -0,0 +1,328 @@
+import bisect
+import heapq
+from typing import Dict, List, Any, Optional, Tuple
+
+from .analysis import compute_time_bounds, dependency_edges, order_sinks, topological_order
+from .setups import SetupTimes, setup_machines
+from .working_time import WORKING_TIME_BREAKS_KEY, crossing_break
+
+# Cùng trọng số với objective của Engine để so sánh được objective_value
+DROP_PENALTY = 1000000
+MAKESPAN_WEIGHT = 100
+
+
+def schedule_objective(tasks: List[Dict[str, Any]], assignments: List[Dict[str, Any]], dropped: int,
+                       sinks: Optional[Dict[str, List[str]]] = None) -> int:
+    """
+    Objective có trọng số của một lịch (không tính changeover), cùng công thức với Engine:
+    drop x DROP_PENALTY + makespan x MAKESPAN_WEIGHT + trễ theo đơn. Trễ của đơn là trễ lớn nhất
+    của các task cuối có hạn, trọng số theo priority cao nhất trong các task đó.
+    """
+    by_id = {t["task_id"]: t for t in tasks if t.get("task_id")}
+    if sinks is None:
+        sinks = order_sinks(list(by_id.values()), dependency_edges(list(by_id.values())))
+    end_of = {a["task_id"]: int(a["end_min"]) for a in assignments}
+    makespan = max(end_of.values(), default=0)
+    lateness_cost = 0
+    for sink_ids in sinks.values():
+        delay, weight = 0, 0
+        for t_id in sink_ids:
+            due_min = int(by_id[t_id].get("due_at_min") or 0)
+            if due_min <= 0:
+                continue
+            weight = max(weight, int((6 - int(by_id[t_id].get("priority") or 3)) * 1000))
+            if t_id in end_of:
+                delay = max(delay, end_of[t_id] - due_min)
+        lateness_cost += delay * weight
+    return dropped * DROP_PENALTY + makespan * MAKESPAN_WEIGHT + lateness_cost
+
+
+def _is_cumulative(r: Dict[str, Any]) -> bool:
+    return r.get("type") == "batch" or r.get("operation") == "washing"
+
+
+class _SerialTimeline:
+    """
+    Máy serial: danh sách khoảng bận (giờ nghỉ + task đã xếp) đã sắp xếp, không giao nhau.
+    Máy có setup (`setup(prev_key, key)` -> phút, key = (design_item_id, operation)) giữ thêm
+    các task đã xếp để chừa thời gian chuyển đổi với task liền trước / liền sau.
+    """
+
+    def __init__(self, windows: List[Dict[str, Any]], setup=None):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.setup = setup
+        self.task_starts: List[int] = []
+        self.task_ends: List[int] = []
+        self.task_keys: List[Tuple[Any, Any]] = []
+        for w in sorted(windows, key=lambda x: int(x["start"])):
+            start, end = int(w["start"]), int(w["end"])
+            if end <= start:
+                continue
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def _free_start(self, t: int, duration: int) -> int:
+        i = bisect.bisect_right(self.ends, t)
+        while i < len(self.starts):
+            if self.starts[i] - t >= duration:
+                return t
+            t = max(t, self.ends[i])
+            i += 1
+        return t
+
+    def earliest_start(self, t: int, duration: int, demand: int, key=None) -> int:
+        if self.setup is None or not key or not key[0]:
+            return self._free_start(t, duration)
+        while True:
+            t = self._free_start(t, duration)
+            k = bisect.bisect_right(self.task_starts, t)
+            shifted = t
+            if k > 0:
+                shifted = max(shifted, self.task_ends[k - 1] + self.setup(self.task_keys[k - 1], key))
+            if k < len(self.task_starts) and \
+                    shifted + duration + self.setup(key, self.task_keys[k]) > self.task_starts[k]:
+                # Không kịp chuyển đổi sang task liền sau: thử sau task đó
+                shifted = max(shifted, self.task_ends[k])
+            if shifted == t:
+                return t
+            t = shifted
+
+    def reserve(self, start: int, end: int, demand: int, key=None):
+        # Gộp với khoảng bận liền kề để máy đã kín lịch không phải duyệt lại từng task
+        i = bisect.bisect_left(self.starts, start)
+        if i > 0 and self.ends[i - 1] >= start:
+            i -= 1
+            self.ends[i] = max(self.ends[i], end)
+        else:
+            self.starts.insert(i, start)
+            self.ends.insert(i, end)
+        while i + 1 < len(self.starts) and self.starts[i + 1] <= self.ends[i]:
+            self.ends[i] = max(self.ends[i], self.ends.pop(i + 1))
+            self.starts.pop(i + 1)
+        if self.setup is not None and key and key[0]:
+            k = bisect.bisect_left(self.task_starts, start)
+            self.task_starts.insert(k, start)
+            self.task_ends.insert(k, end)
+            self.task_keys.insert(k, key)
+
+
+class _CumulativeTimeline:
+    """
+    Máy cumulative (giặt): hồ sơ tải dạng bậc thang, `loads[i]` là tải trên [times[i], times[i + 1]).
+    Giờ nghỉ chiếm toàn bộ capacity. Tìm chỗ / đặt task chỉ duyệt các bậc nằm trong khoảng của task
+    (tìm vị trí bằng bisect) thay vì toàn bộ hồ sơ.
+    """
+
+    def __init__(self, windows: List[Dict[str, Any]], capacity: int):
+        self.capacity = capacity
+        self.times: List[int] = [0]
+        self.loads: List[int] = [0]
+        for w in windows:
+            if int(w["end"]) > int(w["start"]):
+                self._add(max(0, int(w["start"])), int(w["end"]), capacity)
+
+    def _split(self, t: int) -> int:
+        """Chỉ số bậc bắt đầu đúng tại t (tách bậc chứa t nếu cần)"""
+        i = bisect.bisect_right(self.times, t) - 1
+        if self.times[i] == t:
+            return i
+        self.times.insert(i + 1, t)
+        self.loads.insert(i + 1, self.loads[i])
+        return i + 1
+
+    def _add(self, start: int, end: int, demand: int):
+        i, j = self._split(start), self._split(end)
+        for k in range(i, j):
+            self.loads[k] += demand
+
+    def earliest_start(self, t: int, duration: int, demand: int, key=None) -> Optional[int]:
+        if demand > self.capacity:
+            return None
+        limit = self.capacity - demand
+        times, loads = self.times, self.loads
+        i = bisect.bisect_right(times, t) - 1
+        start = t
+        while True:
+            # Bậc đầu tiên trong [start, start + duration) bị quá tải thì dời start sang cuối bậc đó
+            k = i
+            while k < len(times) and times[k] < start + duration and loads[k] <= limit:
+                k += 1
+            if k == len(times) or times[k] >= start + duration:
+                return start
+            while k < len(times) and loads[k] > limit:
+                k += 1
+            if k == len(times):
+                return None
+            start, i = times[k], k
+
+    def reserve(self, start: int, end: int, demand: int, key=None):
+        self._add(start, end, demand)
+
+
+class ListScheduler:
+    """
+    Heuristic list-scheduling nhanh (pure Python) dùng làm lời giải ban đầu cho CP-SAT,
+    fallback khi CP-SAT hết giờ mà chưa có lời giải, và cho chế độ `mode: "heuristic"`.
+
+    Task được xếp theo thứ tự topo, ưu tiên (due, priority, release). Mỗi task chọn máy
+    tương thích cho end sớm nhất, tôn trọng giờ nghỉ, capacity máy giặt, lag phụ thuộc,
+    thời gian chuyển đổi mã hàng và ràng buộc slice cùng máy.
+    """
+
+    def __init__(self, payload: Dict[str, Any], horizon: int,
+                 frozen: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.resources = {r["id"]: r for r in payload.get("resources", [])}
+        self.tasks = [t for t in payload.get("tasks", []) if t.get("task_id")]
+        self.horizon = horizon
+        self.frozen = frozen or {}
+        # Payload nén theo phút làm việc: task không tạm dừng được không vắt qua mốc nghỉ
+        self.break_points = (payload.get("config") or {}).get(WORKING_TIME_BREAKS_KEY) or []
+        self.setup_times = SetupTimes(payload)
+        self.setup_machines = set()
+        if (payload.get("config") or {}).get("setup_mode", "auto") != "off":
+            self.setup_machines = setup_machines(payload, self.setup_times)
+
+    def run(self) -> Dict[str, Any]:
+        by_id = {t["task_id"]: t for t in self.tasks}
+        edges = dependency_edges(self.tasks)
+        order = topological_order(list(by_id), edges)
+        bounds, horizon = compute_time_bounds(self.tasks, self.horizon, self.frozen)
+
+        timelines = {}
+        for r_id, r in self.resources.items():
+            windows = r.get("unavailability", [])
+            if _is_cumulative(r):
+                timelines[r_id] = _CumulativeTimeline(windows, int(r.get("capacity", 100)))
+            elif r_id in self.setup_machines:
+                timelines[r_id] = _SerialTimeline(windows, self._setup_of(r_id))
+            else:
+                timelines[r_id] = _SerialTimeline(windows)
+
+        parents: Dict[str, List[Tuple[str, str, int]]] = {t_id: [] for t_id in by_id}
+        children: Dict[str, List[str]] = {t_id: [] for t_id in by_id}
+        for parent_id, child_id, kind, lag in edges:
+            parents[child_id].append((parent_id, kind, lag))
+            children[parent_id].append(child_id)
+
+        placed: Dict[str, Tuple[int, int, str]] = {}
+        for t_id, a in self.frozen.items():
+            if t_id in by_id and a["machine_id"] in timelines:
+                start, end = int(a["start_min"]), int(a["end_min"])
+                placed[t_id] = (start, end, a["machine_id"])
+                timelines[a["machine_id"]].reserve(start, end, self._demand(by_id[t_id]), self._key(by_id[t_id]))
+
+        def key(t_id):
+            t = by_id[t_id]
+            due = int(t.get("due_at_min") or 0) or horizon
+            return (due, int(t.get("priority") or 3), bounds[t_id][0], t_id)
+
+        in_degree = {t_id: len(parents[t_id]) for t_id in by_id}
+        ready = [(key(t_id), t_id) for t_id in order if in_degree[t_id] == 0]
+        heapq.heapify(ready)
+
+        dropped: Dict[str, str] = {}
+        while ready:
+            _, t_id = heapq.heappop(ready)
+            if t_id not in placed:
+                self._place(by_id[t_id], bounds[t_id][0], parents[t_id], placed, dropped, timelines, horizon)
+            for c_id in children[t_id]:
+                in_degree[c_id] -= 1
+                if in_degree[c_id] == 0:
+                    heapq.heappush(ready, (key(c_id), c_id))
+
+        return self._result(by_id, placed, dropped, order_sinks(self.tasks, edges))
+
+    def _demand(self, t: Dict[str, Any]) -> int:
+        return int(t.get("qty") or 1) if t.get("is_batch") else 1
+
+    def _key(self, t: Dict[str, Any]) -> Tuple[Any, Any]:
+        return t.get("design_item_id"), t.get("operation")
+
+    def _setup_of(self, r_id: str):
+        return lambda prev, key: self.setup_times.between(r_id, prev[0], key[1], key[0])
+
+    def _place(self, t, earliest, parents, placed, dropped, timelines, horizon):
+        t_id = t["task_id"]
+        duration = int(t.get("duration") or 0)
+        demand = self._demand(t)
+        key = self._key(t)
+
+        est = earliest
+        for parent_id, kind, lag in parents:
+            if parent_id not in placed:
+                continue
+            p_start, p_end, _ = placed[parent_id]
+            est = max(est, p_start + lag if kind == "start" else p_end)
+
+        candidates = [r_id for r_id in (t.get("compatible_resource_ids") or []) if r_id in timelines]
+        if not candidates:
+            dropped[t_id] = "NO_COMPATIBLE_RESOURCE"
+            return
+        prev_id = t.get("internal_dep")
+        if prev_id and prev_id in placed:
+            # Slice cùng task phải cùng máy với slice trước
+            candidates = [r_id for r_id in candidates if r_id == placed[prev_id][2]]
+
+        best = None
+        for r_id in candidates:
+            start = timelines[r_id].earliest_start(est, duration, demand, key)
+            while start is not None and self.break_points and not t.get("can_pause"):
+                point = crossing_break(self.break_points, start, duration)
+                if point is None:
+                    break
+                start = timelines[r_id].earliest_start(point, duration, demand, key)
+            if start is None:
+                continue
+            if best is None or start + duration < best[1]:
+                best = (start, start + duration, r_id)
+
+        if best is None or best[1] > horizon:
+            dropped[t_id] = "SLOT_TOO_SMALL_OR_CAPACITY_FULL"
+            return
+        placed[t_id] = best
+        timelines[best[2]].reserve(best[0], best[1], demand, key)
+
+    def _result(self, by_id, placed, dropped, sinks) -> Dict[str, Any]:
+        assignments = []
+        overloads = []
+        for t_id, t in by_id.items():
+            if t_id in dropped:
+                overloads.append({
+                    "task_id": t_id,
+                    "order_id": t.get("original_order_id", ""),
+                    "status": "DROPPED",
+                    "delay_minutes": 0,
+                    "root_cause_code": dropped[t_id],
+                    "bottleneck_resource_id": ""
+                })
+                continue
+            start, end, r_id = placed[t_id]
+            assignments.append({
+                "task_id": t_id,
+                "machine_id": r_id,
+                "start_min": start,
+                "end_min": end,
+                "order_id": t.get("original_order_id", "")
+            })
+            due_min = int(t.get("due_at_min") or 0)
+            if due_min > 0 and end > due_min:
+                overloads.append({
+                    "task_id": t_id,
+                    "order_id": t.get("original_order_id", ""),
+                    "status": "LATE",
+                    "delay_minutes": end - due_min,
+                    "root_cause_code": "CAPACITY_FULL",
+                    "bottleneck_resource_id": r_id
+                })
+
+        return {
+            "status": "feasible",
+            "source": "heuristic",
+            "objective_value": schedule_objective(self.tasks, assignments, len(dropped), sinks),
+            "assignments": assignments,
+            "overloads": overloads,
+        }
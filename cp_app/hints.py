@@ -0,0 +1,98 @@
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Any, Iterable, Optional
+
+HINT_STORE = os.getenv("HINT_STORE", "redis")  # redis | file | none
+HINT_STORE_DIR = os.getenv("HINT_STORE_DIR", "/tmp/cp_hints")
+HINT_TTL_SECONDS = int(os.getenv("HINT_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def hint_key_for(payload: Dict[str, Any]) -> str:
+    """Khoá lưu hint: `config.hint_key` nếu backend gửi, mặc định là `job_id`"""
+    config = payload.get("config") or {}
+    return str(config.get("hint_key") or payload.get("job_id") or "")
+
+
+def _compact(assignments: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {
+        a["task_id"]: {"start_min": int(a["start_min"]), "machine_id": a["machine_id"]}
+        for a in assignments
+    }
+
+
+class HintStore(ABC):
+    """Lưu lịch đã chấp nhận gần nhất (start_min / machine_id theo task_id) để warm-start"""
+
+    @abstractmethod
+    def load(self, key: str, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def save(self, key: str, assignments: List[Dict[str, Any]]) -> None:
+        ...
+
+
+class RedisHintStore(HintStore):
+    def __init__(self, url: str, ttl: int = HINT_TTL_SECONDS):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def load(self, key, task_ids):
+        if not key or not task_ids:
+            return {}
+        values = self.client.hmget(f"cp:hints:{key}", task_ids)
+        return {t_id: json.loads(v) for t_id, v in zip(task_ids, values) if v}
+
+    def save(self, key, assignments):
+        if not key or not assignments:
+            return
+        name = f"cp:hints:{key}"
+        pipe = self.client.pipeline()
+        pipe.hset(name, mapping={t_id: json.dumps(h) for t_id, h in _compact(assignments).items()})
+        pipe.expire(name, self.ttl)
+        pipe.execute()
+
+
+class FileHintStore(HintStore):
+    """Bản thay thế cục bộ (dev / chạy offline): một file JSON cho mỗi khoá"""
+
+    def __init__(self, directory: str = HINT_STORE_DIR):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_.-]", "_", key) + ".json")
+
+    def load(self, key, task_ids):
+        path = self._path(key)
+        if not key or not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            stored = json.load(f)
+        return {t_id: stored[t_id] for t_id in task_ids if t_id in stored}
+
+    def save(self, key, assignments):
+        if not key or not assignments:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        stored = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+        stored.update(_compact(assignments))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, path)
+
+
+def get_hint_store() -> Optional[HintStore]:
+    if HINT_STORE == "file":
+        return FileHintStore()
+    if HINT_STORE == "redis":
+        from .celery_app import REDIS_URL
+        return RedisHintStore(REDIS_URL)
+    return None
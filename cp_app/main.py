@@ -1,9 +1,31 @@
-from fastapi import FastAPI
-from pydantic import BaseModel, Field
+import json
+import logging
+import uuid
+from celery.states import READY_STATES
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from .celery_app import celery_app
-from .tasks import optimize_schedule
+from .celery_app import celery_app, REDIS_URL
+from .progress import progress_channel, progress_snapshot_key
+from .control import cancel_key
+from .tasks import optimize_schedule, resolve_schedule, send_cancelled, solve_scenarios
+from .delivery import enqueue_delivery
+from .cache import RESULT_CACHE_ENABLED, ResultCache, payload_fingerprint
+from .analysis import planning_horizon
+from .diagnostics import diagnose_payload
+from .tables import ProblemTables
+from .routing import route_options
+from .governor import plan_memory
+from .blobs import BlobStore, payload_key, result_key
+from .observability import configure_logging, phase, render_metrics
+from .scenarios import MAX_SCENARIOS
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -32,6 +54,20 @@ class Machine(BaseModel):
     worker_req: int = 1
     routing: List[MachineRoute]
 
+class SolverSubTask(BaseModel):
+    """
+    Member of a batch task. Only identity fields are validated: the solver never reads
+    sub tasks, and validating them as full recursive SolverTask models dominated the
+    cost of large uploads. Other fields are ignored.
+    """
+    task_id: str
+    original_order_id: str = ""
+    group_id: str = ""
+    operation: str = ""
+    qty: float = 0
+    duration: int = 0
+    design_item_id: str = ""
+
 class SolverTask(BaseModel):
     task_id: str = Field(alias="task_id")
     original_order_id: str = Field(alias="original_order_id")
@@ -50,10 +86,11 @@ class SolverTask(BaseModel):
     internal_dep: str = Field(default="", alias="internal_dep")
     slice_index: int = Field(default=0, alias="slice_index")
     is_batch: bool = Field(default=False, alias="is_batch")
-    sub_tasks: Optional[List['SolverTask']] = Field(default=None, alias="sub_tasks")
+    sub_tasks: Optional[List[SolverSubTask]] = Field(default=None, alias="sub_tasks")
     design_item_id: str = Field(alias="design_item_id")
     compatible_resource_ids: List[str] = Field(default=[], alias="compatible_resource_ids")
     sub_task_completion_offsets: Optional[Dict[str, int]] = Field(default=None, alias="sub_task_completion_offsets")
+    can_pause: bool = Field(default=False, alias="can_pause")  # may run across breaks in working-time mode
     class Config:
         populate_by_name = True
 
@@ -61,6 +98,46 @@ class SolverConfig(BaseModel):
     horizon_minutes: int = 57600
     max_search_time: int = 300
     setup_time_minutes: int = 60
+    # Changeovers between design items on serial machines listed in `machines`: "auto" or "off"
+    setup_mode: str = "auto"
+    # Add total changeover minutes (machines with <= setup_circuit_max_tasks candidate tasks) to the objective
+    minimize_changeovers: bool = False
+    changeover_weight: Optional[int] = None
+    setup_circuit_max_tasks: Optional[int] = None
+    # Different-design neighbours (by earliest start) each task is sequenced against on larger machines
+    setup_neighbours: Optional[int] = None
+    # Early-stop policies
+    relative_gap_limit: Optional[float] = None   # e.g. 0.01 = stop within 1% of the bound
+    no_improvement_seconds: Optional[int] = None # stop when no better solution for N seconds
+    stop_on_zero_drops: bool = False             # stop at the first solution without dropped tasks
+    # Identical machines: "break" (order machines in a class), "pool" (one cumulative per class) or "off"
+    symmetry_mode: str = "break"
+    # Reject (HTTP 422) payloads containing tasks that can never be scheduled instead of dropping them
+    reject_impossible_tasks: bool = False
+    # "wall" or "working": solve on compressed working minutes (needs one shared calendar)
+    time_mode: str = "wall"
+    # Force the Celery queue ("interactive" / "batch"); routed by job size when unset
+    queue: Optional[str] = None
+    # CP-SAT workers; capped by the worker's per-host CPU budget
+    num_search_workers: Optional[int] = None
+    # "weighted" (one big-coefficient sum) or "lexicographic": minimize drops, then weighted lateness, then makespan
+    objective_mode: str = "weighted"
+    # Share of max_search_time per lexicographic stage (the last stage gets whatever time is left)
+    stage_time_fractions: Optional[List[float]] = None
+    # CP-SAT random seed (fixed seed + fixed num_search_workers for reproducible replays)
+    random_seed: Optional[int] = None
+    # Group loose washing tasks (same operation / design item / machines) into capacity-sized batches before
+    # solving; assignments are reported per original task with a `batch_id`
+    auto_batching: bool = False
+    batch_window_minutes: Optional[int] = None  # max spread of release / due dates inside one batch
+    batch_max_members: Optional[int] = None
+    # Memory governor: "auto" (fit the worker's memory budget by lowering CP-SAT workers, then rolling horizon,
+    # then heuristic only; reject when nothing fits), "reject" (never switch mode) or "off"
+    memory_governor: str = "auto"
+    # CP-SAT memory limit in MB (capped by the governor's budget)
+    max_memory_mb: Optional[int] = None
+    # Record this job for offline replay even when RECORD_PAYLOADS sampling would skip it
+    record: bool = False
 
 class SolverPayload(BaseModel):
     job_id: str
@@ -69,20 +146,377 @@ class SolverPayload(BaseModel):
     resources: List[SolverResource] = Field(default_factory=list)
     tasks: List[SolverTask]
 
+class Assignment(BaseModel):
+    task_id: str
+    machine_id: str
+    start_min: int
+    end_min: int
+    order_id: Optional[str] = ""
+
+class ScheduleDelta(BaseModel):
+    new_tasks: List[SolverTask] = Field(default_factory=list)
+    cancelled_task_ids: List[str] = Field(default_factory=list)
+    due_date_changes: Dict[str, int] = Field(default_factory=dict)
+    unavailability: Dict[str, List[TimeWindow]] = Field(default_factory=dict)
+
+class ResolvePayload(BaseModel):
+    job_id: str
+    base: SolverPayload
+    base_assignments: List[Assignment]
+    delta: ScheduleDelta = Field(default_factory=ScheduleDelta)
+    now_min: int = 0
+    frozen_window_min: int = 0
+
+class ScenarioOverride(ScheduleDelta):
+    """One what-if variant of the base plan (on top of the ScheduleDelta fields)"""
+    name: str
+    # Machines out of service for the whole plan
+    machines_down: List[str] = Field(default_factory=list)
+    priority_changes: Dict[str, int] = Field(default_factory=dict)
+    release_changes: Dict[str, int] = Field(default_factory=dict)
+    # Replace a resource's unavailability windows (e.g. an overtime calendar)
+    calendars: Dict[str, List[TimeWindow]] = Field(default_factory=dict)
+
+class ScenarioPayload(BaseModel):
+    job_id: str
+    base: SolverPayload
+    scenarios: List[ScenarioOverride]
+    include_assignments: bool = True
+
+async def raw_body(request: Request) -> bytes:
+    return await request.body()
+
+def parse_body(model, body: bytes):
+    """
+    Validate a JSON request body straight from bytes with pydantic-core, skipping the
+    intermediate json.loads() dict FastAPI would build. Errors keep FastAPI's 422 format.
+    """
+    try:
+        return model.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
+
+def queue_by_reference(task, data: Dict[str, Any], routing: Dict[str, Any], task_id: Optional[str] = None,
+                       ref_arg: str = "payload_ref", **kwargs) -> str:
+    """Store the payload once in Redis (msgpack + zstd) and queue the task with its key only"""
+    task_id = task_id or str(uuid.uuid4())
+    with phase("store_payload"):
+        size = BlobStore.from_url(REDIS_URL).put(payload_key(task_id), data)
+    logger.info("payload stored", extra={"key": payload_key(task_id), "bytes": size, "job_id": data.get("job_id")})
+    # job_id / fingerprint also go in the message headers: a revoked task never runs, and the
+    # worker's task_revoked handler only sees the headers
+    headers = {"job_id": data.get("job_id"), "fingerprint": kwargs.get("fingerprint")}
+    task.apply_async(kwargs={ref_arg: payload_key(task_id), "job_id": data.get("job_id"), **kwargs},
+                     task_id=task_id, headers=headers, **routing)
+    return task_id
+
+def diagnose_before_queue(data: Dict[str, Any], tables: Optional[ProblemTables] = None) -> Dict[str, Any]:
+    """
+    Synchronous input diagnosis (no solver). Payloads that cannot be scheduled at all
+    (dependency cycle, every task impossible) are rejected with HTTP 422, as are payloads
+    with any impossible task when `config.reject_impossible_tasks` is set.
+    """
+    config = data.get("config") or {}
+    tables = tables or ProblemTables(data)
+    report = diagnose_payload(tables, planning_horizon(config, int(tables.duration.sum())),
+                              hard_horizon=not config.get("tighten_domains", True))
+    if report["fatal"] or (config.get("reject_impossible_tasks") and not report["ok"]):
+        raise HTTPException(status_code=422, detail={
+            "message": "Payload cannot be scheduled",
+            "job_id": data.get("job_id"),
+            "diagnostics": report
+        })
+    return report
+
+def reject_oversized(data: Dict[str, Any], tables: ProblemTables, allow_decompose: bool = True,
+                     scenarios: int = 0) -> Dict[str, Any]:
+    """
+    Memory governor before queueing: a payload whose model does not fit the solver memory
+    budget even degraded (one CP-SAT worker, rolling horizon, heuristic only) is rejected
+    with HTTP 413. The worker plans again against its own concurrency.
+    """
+    plan = plan_memory(tables, data, allow_decompose=allow_decompose, scenarios=scenarios)
+    if plan["action"] == "reject":
+        raise HTTPException(status_code=413, detail={
+            "message": "Payload too large for the solver memory budget",
+            "job_id": data.get("job_id"),
+            "memory": plan
+        })
+    return plan
+
 @app.post("/api/v1/solve")
-async def create_solve_task(payload: SolverPayload):
-    """Queue optimization task to Celery"""
-    task = optimize_schedule.delay(payload.model_dump(by_alias=False))
-    
+def create_solve_task(background_tasks: BackgroundTasks, body: bytes = Depends(raw_body)):
+    """
+    Queue optimization task to Celery.
+    The payload is diagnosed first; impossible payloads are rejected before queueing.
+    Small, short jobs go to the interactive queue, the rest to the batch queue.
+    Identical payloads (same fingerprint, ignoring job_id and ordering) are answered
+    from the result cache, or merged onto the task already solving them.
+    The body is a SolverPayload; the worker receives only a reference to the stored payload.
+    """
+    with phase("validate"):
+        payload = parse_body(SolverPayload, body)
+        data = payload.model_dump(by_alias=False)
+    with phase("api_diagnose"):
+        tables = ProblemTables(data)
+        diagnostics = diagnose_before_queue(data, tables)
+        memory = reject_oversized(data, tables)
+    routing = route_options(tables, data.get("config") or {})
+    if not RESULT_CACHE_ENABLED:
+        task_id = queue_by_reference(optimize_schedule, data, routing)
+        return {
+            "message": "Optimization task queued",
+            "celery_task_id": task_id,
+            "job_id": payload.job_id,
+            "queue": routing["queue"],
+            "memory": memory["action"],
+            "diagnostics": diagnostics
+        }
+
+    fingerprint = payload_fingerprint(data)
+    cache = ResultCache.from_url(REDIS_URL)
+
+    def cached_response(cached):
+        result = dict(cached, job_id=payload.job_id)
+        # The solving task's stored result outlives the cache entry (BLOB_TTL_SECONDS >= cache TTL)
+        # Same idempotency key as a waiter delivery of that task, so a job gets its result only once
+        background_tasks.add_task(enqueue_delivery, f"{cached.get('task_id')}:{payload.job_id}",
+                                  job_id=payload.job_id, result_ref=result_key(cached.get("task_id")))
+        return {
+            "message": "Cached result",
+            "celery_task_id": cached.get("task_id"),
+            "job_id": payload.job_id,
+            "cached": True,
+            "result": result,
+            "diagnostics": diagnostics
+        }
+
+    cached = cache.get(fingerprint)
+    if cached:
+        return cached_response(cached)
+
+    def merged_response(running_task_id):
+        return {
+            "message": "Merged onto in-flight optimization task",
+            "celery_task_id": running_task_id,
+            "job_id": payload.job_id,
+            "diagnostics": diagnostics
+        }
+
+    # Claim the fingerprint or join the task holding it, atomically: the running task either
+    # sees this job in its waiter list when it finishes, or has already released the claim
+    task_id = str(uuid.uuid4())
+    running_task_id = cache.join_inflight(fingerprint, task_id, payload.job_id)
+    if running_task_id:
+        return merged_response(running_task_id)
+
+    queue_by_reference(optimize_schedule, data, routing, task_id=task_id, fingerprint=fingerprint)
     return {
         "message": "Optimization task queued",
-        "celery_task_id": task.id,
+        "celery_task_id": task_id,
+        "job_id": payload.job_id,
+        "queue": routing["queue"],
+        "memory": memory["action"],
+        "diagnostics": diagnostics
+    }
+
+@app.post("/api/v1/resolve")
+def create_resolve_task(body: bytes = Depends(raw_body)):
+    """
+    Queue incremental re-plan: only tasks outside the frozen window are re-solved.
+    The body is a ResolvePayload, passed to the worker by reference like /solve.
+    """
+    payload = parse_body(ResolvePayload, body)
+    request = payload.model_dump(by_alias=False)
+    tables = ProblemTables(request["base"])
+    reject_oversized(request["base"], tables, allow_decompose=False)
+    routing = route_options(tables, request["base"].get("config") or {})
+    task_id = queue_by_reference(resolve_schedule, request, routing, ref_arg="request_ref")
+
+    return {
+        "message": "Re-plan task queued",
+        "celery_task_id": task_id,
         "job_id": payload.job_id
     }
 
+@app.post("/api/v1/scenarios")
+def create_scenarios_task(body: bytes = Depends(raw_body)):
+    """
+    Queue a what-if batch: the base payload plus up to MAX_SCENARIOS small overrides.
+    The model is built once; each scenario is solved on a modified copy of it in parallel,
+    and the webhook carries one comparative report (per-scenario KPIs, deltas vs base, ranking).
+    """
+    payload = parse_body(ScenarioPayload, body)
+    names = [s.name for s in payload.scenarios]
+    if len(names) > MAX_SCENARIOS or len(set(names)) != len(names):
+        raise HTTPException(status_code=422, detail={
+            "message": f"Scenarios must have unique names, at most {MAX_SCENARIOS}",
+            "job_id": payload.job_id
+        })
+    request = payload.model_dump(by_alias=False)
+    tables = ProblemTables(request["base"])
+    diagnostics = diagnose_before_queue(request["base"], tables)
+    # One scenario at a time on a copy of the shared model; the worker lowers scenario parallelism to fit
+    memory = reject_oversized(request["base"], tables, allow_decompose=False, scenarios=1)
+    config = request["base"].get("config") or {}
+    # Worst case the scenarios run one after another: size the time limit for that
+    routing = route_options(tables, dict(config, max_search_time=int(config.get("max_search_time") or 300)
+                                         * (len(names) + 1)))
+    task_id = queue_by_reference(solve_scenarios, request, routing, ref_arg="request_ref")
+
+    return {
+        "message": "Scenario batch queued",
+        "celery_task_id": task_id,
+        "job_id": payload.job_id,
+        "scenarios": len(names) + 1,
+        "queue": routing["queue"],
+        "memory": memory["action"],
+        "diagnostics": diagnostics
+    }
+
+@app.get("/api/v1/solve/{celery_task_id}/result")
+def get_solve_result(celery_task_id: str):
+    """
+    Pull the stored result of a solve (same body as the webhook), as a fallback when
+    webhook delivery failed. 404 while the task is still queued or running.
+    """
+    result = BlobStore.from_url(REDIS_URL).get(result_key(celery_task_id))
+    if result is None:
+        raise HTTPException(status_code=404, detail={
+            "message": "Result not available",
+            "celery_task_id": celery_task_id,
+            "state": celery_app.AsyncResult(celery_task_id).state
+        })
+    return result
+
+CANCEL_TTL_SECONDS = 24 * 3600
+
+@app.delete("/api/v1/solve/{celery_task_id}")
+async def cancel_solve_task(celery_task_id: str, job_id: Optional[str] = None):
+    """
+    Cancel a solve. A running worker stops the search and still sends the best
+    solution found so far through the webhook; a queued task is revoked and its
+    jobs get a "cancelled" webhook.
+    A duplicate job merged onto the task (pass its `job_id`) is only detached from it.
+    The shared task itself is not cancelled while other jobs are still waiting on it.
+    """
+    if RESULT_CACHE_ENABLED:
+        cache = ResultCache.from_url(REDIS_URL)
+        fingerprint = cache.inflight_fingerprint(celery_task_id)
+        if fingerprint:
+            if job_id and cache.remove_waiter(fingerprint, job_id):
+                send_cancelled(celery_task_id, job_id)
+                return {
+                    "message": "Job detached from shared optimization task",
+                    "celery_task_id": celery_task_id,
+                    "job_id": job_id
+                }
+            waiting = cache.waiters(fingerprint)
+            if waiting:
+                raise HTTPException(status_code=409, detail={
+                    "message": "Task is shared with other jobs; cancel each merged job by its job_id",
+                    "celery_task_id": celery_task_id,
+                    "waiting_jobs": len(waiting)
+                })
+
+    import redis.asyncio as aioredis
+    client = aioredis.from_url(REDIS_URL)
+    try:
+        await client.set(cancel_key(celery_task_id), 1, ex=CANCEL_TTL_SECONDS)
+    finally:
+        await client.aclose()
+    celery_app.control.revoke(celery_task_id)
+
+    return {
+        "message": "Cancellation requested",
+        "celery_task_id": celery_task_id
+    }
+
+TERMINAL_PROGRESS_EVENTS = ("done", "failed")
+PROGRESS_KEEPALIVE_SECONDS = 15.0
+# The stream ends after this many keep-alives in a row without an event (unknown or
+# expired task ids would otherwise hold a Redis connection forever)
+PROGRESS_MAX_IDLE_KEEPALIVES = 40
+
+@app.get("/api/v1/solve/{celery_task_id}/progress")
+async def solve_progress(celery_task_id: str, stream: bool = True, timeout: float = 25.0):
+    """
+    Best-so-far progress of a running solve.
+    stream=true: Server-Sent Events until the solve finishes.
+    stream=false: long-poll, waits up to `timeout` seconds for the next event.
+    A finished solve returns (or streams) its final event immediately. When no event arrives
+    for a while, the Celery state is checked: a finished task closes the stream with a
+    terminal event, and an idle stream is closed after PROGRESS_MAX_IDLE_KEEPALIVES keep-alives.
+    """
+    import redis.asyncio as aioredis
+    client = aioredis.from_url(REDIS_URL)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(progress_channel(celery_task_id))
+    snapshot = await client.get(progress_snapshot_key(celery_task_id))
+    last = json.loads(snapshot) if snapshot else None
+
+    async def close():
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
+
+    async def next_event(wait: float):
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=wait)
+        return json.loads(message["data"]) if message else None
+
+    async def finished_state():
+        state = await run_in_threadpool(lambda: celery_app.AsyncResult(celery_task_id).state)
+        return state if state in READY_STATES else None
+
+    def is_terminal(event):
+        return bool(event) and event.get("type") in TERMINAL_PROGRESS_EVENTS
+
+    if not stream:
+        try:
+            if is_terminal(last):
+                return last
+            event = await next_event(timeout)
+            return event or last or {"type": "pending"}
+        finally:
+            await close()
+
+    async def events():
+        try:
+            event = last
+            if event:
+                yield f"data: {json.dumps(event)}\n\n"
+            idle = 0
+            while not is_terminal(event):
+                event = await next_event(PROGRESS_KEEPALIVE_SECONDS)
+                if event is None:
+                    state = await finished_state()
+                    if state:
+                        # The final event was published before we subscribed or has expired
+                        if state == "FAILURE":
+                            event = {"type": "failed", "state": state}
+                        else:
+                            event = {"type": "done", "state": state,
+                                     **({"status": "cancelled"} if state == "REVOKED" else {})}
+                        yield f"data: {json.dumps(event)}\n\n"
+                        break
+                    idle += 1
+                    if idle > PROGRESS_MAX_IDLE_KEEPALIVES:
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                idle = 0
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            await close()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics of the API process (all processes with PROMETHEUS_MULTIPROC_DIR)"""
+    data, content_type = render_metrics()
+    return Response(content=data, media_type=content_type)
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "cp-solver"}
-
-# Enable SolverTask to reference itself
-SolverTask.model_rebuild()
\ No newline at end of file
@@ -0,0 +1,141 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+# prometheus_client multiprocess mode (Celery prefork, nhiều worker uvicorn) đọc biến này
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# ---------------------------------------------------------
+# Structured logs: mỗi dòng là một JSON, tự gắn job_id / celery_task_id của job đang chạy
+# ---------------------------------------------------------
+_job_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("job_context", default={})
+
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+
+class JobContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _job_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({k: v for k, v in record.__dict__.items() if k not in _RESERVED and not k.startswith("_")})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Dạng đọc bằng mắt khi chạy local: message + các field dạng key=value"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {k: v for k, v in record.__dict__.items() if k not in _RESERVED and not k.startswith("_")}
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging() -> None:
+    """Cấu hình root logger một lần cho process (API hoặc Celery worker)"""
+    root = logging.getLogger()
+    if any(getattr(h, "_cp_handler", False) for h in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler._cp_handler = True
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    handler.addFilter(JobContextFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+
+def bind_job_context(**fields) -> contextvars.Token:
+    """Gắn các field (job_id, celery_task_id, ...) vào mọi log sau đó, tới khi `unbind_job_context`"""
+    return _job_context.set({**_job_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+def unbind_job_context(token: contextvars.Token) -> None:
+    _job_context.reset(token)
+
+
+@contextlib.contextmanager
+def job_context(**fields):
+    token = bind_job_context(**fields)
+    try:
+        yield
+    finally:
+        unbind_job_context(token)
+
+
+# ---------------------------------------------------------
+# Prometheus metrics
+# ---------------------------------------------------------
+_SIZE_BUCKETS = (100, 1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, float("inf"))
+_TIME_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf"))
+
+PHASE_SECONDS = Histogram("solver_phase_seconds", "Thời gian từng pha của một lần giải", ["phase"],
+                          buckets=_TIME_BUCKETS)
+JOBS_TOTAL = Counter("solver_jobs_total", "Số job đã xử lý theo kết quả", ["task", "status"])
+TASK_OUTCOMES_TOTAL = Counter("solver_task_outcomes_total", "Task được xếp / bị drop / trễ", ["outcome"])
+MODEL_VARIABLES = Histogram("cpsat_model_variables", "Số biến của model CP-SAT", buckets=_SIZE_BUCKETS)
+MODEL_CONSTRAINTS = Histogram("cpsat_model_constraints", "Số ràng buộc của model CP-SAT", buckets=_SIZE_BUCKETS)
+SEARCH_STATUS_TOTAL = Counter("cpsat_status_total", "Trạng thái kết thúc của CP-SAT", ["status"])
+SEARCH_CONFLICTS = Histogram("cpsat_conflicts", "Số conflict của một lần tìm kiếm", buckets=_SIZE_BUCKETS)
+SEARCH_BRANCHES = Histogram("cpsat_branches", "Số nhánh của một lần tìm kiếm", buckets=_SIZE_BUCKETS)
+SEARCH_WALLTIME = Histogram("cpsat_walltime_seconds", "Wall time của CP-SAT", buckets=_TIME_BUCKETS)
+SEARCH_GAP = Histogram("cpsat_relative_gap", "Gap tương đối objective / bound khi dừng",
+                       buckets=(0, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, float("inf")))
+WEBHOOK_DELIVERIES_TOTAL = Counter("webhook_deliveries_total", "Kết quả gửi webhook", ["outcome"])
+GOVERNOR_ACTIONS_TOTAL = Counter("solver_memory_governor_total", "Quyết định của governor bộ nhớ theo job", ["action"])
+WORKER_PEAK_RSS = Histogram("worker_peak_rss_mb", "Peak RSS (MB) của process worker sau mỗi task", ["task"],
+                            buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384, float("inf")))
+
+
+@contextlib.contextmanager
+def phase(name: str, timings: Optional[Dict[str, float]] = None, **fields):
+    """Đo thời gian một pha: ghi histogram, log và cộng dồn vào `timings` (giây)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        PHASE_SECONDS.labels(phase=name).observe(elapsed)
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0.0) + elapsed, 4)
+        logging.getLogger("cp_app.phase").info("phase done", extra={
+            "phase": name, "duration_ms": round(elapsed * 1000, 1), **fields
+        })
+
+
+def metrics_registry():
+    """Registry gộp mọi process khi chạy multiprocess mode, ngược lại registry mặc định"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics():
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
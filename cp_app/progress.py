@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, Any, Optional
+
+from ortools.sat.python import cp_model
+
+from .symmetry import assign_pooled_machines
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_THROTTLE_SECONDS = float(os.getenv("PROGRESS_THROTTLE_SECONDS", "2"))
+PROGRESS_TTL_SECONDS = int(os.getenv("PROGRESS_TTL_SECONDS", "3600"))
+
+
+def progress_channel(celery_task_id: str) -> str:
+    """Kênh Redis pub/sub nhận từng sự kiện tiến độ"""
+    return f"cp:progress:{celery_task_id}"
+
+
+def progress_snapshot_key(celery_task_id: str) -> str:
+    """Khoá Redis giữ sự kiện mới nhất (cho client kết nối muộn / long-poll)"""
+    return f"cp:progress:last:{celery_task_id}"
+
+
+class RedisProgressPublisher:
+    """Đẩy sự kiện tiến độ của một lần solve lên Redis; lỗi Redis không làm hỏng lần solve"""
+
+    def __init__(self, url: str, celery_task_id: str, ttl: int = PROGRESS_TTL_SECONDS):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.celery_task_id = celery_task_id
+        self.ttl = ttl
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        try:
+            data = json.dumps(event)
+            pipe = self.client.pipeline()
+            pipe.set(progress_snapshot_key(self.celery_task_id), data, ex=self.ttl)
+            pipe.publish(progress_channel(self.celery_task_id), data)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("could not publish progress", extra={"error": str(e)})
+
+
+class SolutionProgressCallback(cp_model.CpSolverSolutionCallback):
+    """
+    Gọi `publish` với mỗi lời giải cải thiện của CP-SAT: objective, bound, gap, thời gian
+    và (tuỳ chọn) toàn bộ assignment. Có throttle để không spam khi solver tìm ra
+    nhiều lời giải liên tiếp; lời giải tốt nhất bị bỏ qua do throttle được gửi ở `flush`
+    (không kèm assignment vì lúc đó solver đã dừng, lịch đầy đủ sẽ có trong kết quả cuối).
+
+    Callback cũng ghi lại thời điểm cải thiện gần nhất (cho `SolveWatchdog`) và dừng sớm
+    ở lời giải đầu tiên không drop task nào nếu bật `stop_on_zero_drops`.
+    """
+
+    def __init__(self, publish: Optional[Callable[[Dict[str, Any]], None]], task_vars: Dict[str, Dict[str, Any]],
+                 throttle_seconds: float = PROGRESS_THROTTLE_SECONDS, include_assignments: bool = False,
+                 stop_on_zero_drops: bool = False, pools: Optional[Dict[str, Any]] = None,
+                 stage: Optional[str] = None):
+        super().__init__()
+        self.publish = publish
+        self.task_vars = task_vars
+        self.throttle_seconds = throttle_seconds
+        self.include_assignments = include_assignments
+        self.stop_on_zero_drops = stop_on_zero_drops
+        self.pools = pools or {}
+        # Tầng objective đang giải (chế độ lexicographic): objective / bound của sự kiện là của tầng này
+        self.stage = stage
+        self.solution_count = 0
+        self.last_sent = 0.0
+        self.last_improvement: Optional[float] = None
+        self.stop_reason: Optional[str] = None
+        self.pending: Optional[Dict[str, Any]] = None
+
+    def on_solution_callback(self):
+        self.solution_count += 1
+        self.last_improvement = time.monotonic()
+        if self.stop_on_zero_drops and not any(self.Value(tv["is_dropped"]) for tv in self.task_vars.values()):
+            self.stop_reason = "zero_drops"
+            self.StopSearch()
+        if not self.publish:
+            return
+        objective = self.ObjectiveValue()
+        bound = self.BestObjectiveBound()
+        event = {
+            "type": "solution",
+            "solution": self.solution_count,
+            "objective": objective,
+            "bound": bound,
+            "gap": abs(objective - bound) / max(1.0, abs(objective)),
+            "elapsed": round(self.WallTime(), 3),
+        }
+        if self.stage:
+            event["stage"] = self.stage
+        now = time.monotonic()
+        if now - self.last_sent < self.throttle_seconds:
+            self.pending = event
+            return
+        if self.include_assignments:
+            event["assignments"] = self._assignments()
+        self._send(event)
+
+    def flush(self):
+        if self.pending and self.publish:
+            self._send(self.pending)
+
+    def _send(self, event: Dict[str, Any]):
+        self.publish(event)
+        self.last_sent = time.monotonic()
+        self.pending = None
+
+    def _assignments(self):
+        assignments = []
+        for t_id, tv in self.task_vars.items():
+            if self.Value(tv["is_dropped"]):
+                continue
+            for r_id, lit in zip(tv["r_ids"], tv["literals"]):
+                if self.Value(lit):
+                    start = self.Value(tv["start"])
+                    assignments.append({
+                        "task_id": t_id,
+                        "machine_id": r_id,
+                        "start_min": start,
+                        "end_min": start + tv["duration"],
+                        "order_id": tv.get("original_order_id", "")
+                    })
+                    break
+        if self.pools:
+            assign_pooled_machines(assignments, self.pools)
+        return assignments
@@ -0,0 +1,240 @@
+import base64
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+
+from .blobs import decode_blob, encode_blob
+
+logger = logging.getLogger(__name__)
+
+# Ghi lại payload production (opt-in) để tái hiện job chậm offline (xem benchmarks/replay.py)
+RECORD_PAYLOADS = os.getenv("RECORD_PAYLOADS", "0") == "1"
+RECORD_DIR = os.getenv("RECORD_DIR", "recordings")
+RECORD_ANONYMIZE = os.getenv("RECORD_ANONYMIZE", "1") == "1"
+RECORD_SAMPLE_RATE = float(os.getenv("RECORD_SAMPLE_RATE", "1.0"))
+# Chỉ ghi job giải lâu hơn ngưỡng (giây, 0 = mọi job)
+RECORD_MIN_SECONDS = float(os.getenv("RECORD_MIN_SECONDS", "0"))
+# Xoay file khi vượt RECORD_MAX_BYTES, giữ RECORD_BACKUPS file cũ (payloads.jsonl.1, .2, ...)
+RECORD_MAX_BYTES = int(os.getenv("RECORD_MAX_BYTES", str(256 * 1024 * 1024)))
+RECORD_BACKUPS = int(os.getenv("RECORD_BACKUPS", "5"))
+
+RECORD_FILE = "payloads.jsonl"
+
+
+# ---------------------------------------------------------
+# Ẩn danh: thay ID bằng mã tuần tự theo thứ tự sắp xếp của ID gốc (cùng loại), nên mọi
+# tham chiếu chéo và thứ tự sắp xếp (model dựng theo thứ tự ID) vẫn giữ nguyên
+# ---------------------------------------------------------
+def _collect_ids(payload: Dict[str, Any], hints: Optional[Dict[str, Dict[str, Any]]]) -> Dict[str, set]:
+    ids = {"task": set(), "order": set(), "design": set(), "resource": set()}
+
+    def task_ids(t):
+        ids["task"].update([t.get("task_id"), t.get("parent_task_id"), t.get("internal_dep"),
+                            *(t.get("original_depends_on") or []), *(t.get("final_depends_on") or [])])
+        ids["order"].update([t.get("original_order_id"), t.get("group_id"),
+                             *(t.get("sub_task_completion_offsets") or {})])
+        ids["design"].add(t.get("design_item_id"))
+
+    for t in payload.get("tasks", []):
+        task_ids(t)
+        ids["resource"].update(t.get("compatible_resource_ids") or [])
+        for sub in t.get("sub_tasks") or []:
+            task_ids(sub)
+    for r in payload.get("resources", []):
+        ids["resource"].add(r.get("id"))
+    for m in payload.get("machines", []):
+        ids["resource"].add(m.get("id"))
+        ids["design"].update(route.get("design_item_id") for route in m.get("routing") or [])
+    for t_id, hint in (hints or {}).items():
+        ids["task"].add(t_id)
+        ids["resource"].add(hint.get("machine_id"))
+    for values in ids.values():
+        values.discard(None)
+        values.discard("")
+    return ids
+
+
+def _pseudonyms(values: set, prefix: str) -> Dict[str, str]:
+    width = len(str(len(values)))
+    mapping = {}
+    for k, value in enumerate(sorted(values)):
+        code = f"{prefix}{k:0{width}d}"
+        # Giữ tiền tố có nghĩa với solver / backend (task giả, pool máy)
+        mapping[value] = f"DUMMY_{code}" if value.startswith("DUMMY_") else code
+    return mapping
+
+
+def anonymize(payload: Dict[str, Any], hints: Optional[Dict[str, Dict[str, Any]]] = None
+              ) -> Tuple[Dict[str, Any], Optional[Dict[str, Dict[str, Any]]]]:
+    """Bản sao payload (và hints) với mọi ID task / đơn / mã hàng / máy đã được thay"""
+    ids = _collect_ids(payload, hints)
+    task, order = _pseudonyms(ids["task"], "T"), _pseudonyms(ids["order"], "O")
+    design, resource = _pseudonyms(ids["design"], "D"), _pseudonyms(ids["resource"], "R")
+
+    def sub(mapping, value):
+        return mapping.get(value, value) if value else value
+
+    def anon_task(t):
+        t = dict(t)
+        for key in ("task_id", "parent_task_id", "internal_dep"):
+            if key in t:
+                t[key] = sub(task, t[key])
+        for key in ("original_depends_on", "final_depends_on"):
+            if t.get(key):
+                t[key] = [sub(task, p) for p in t[key]]
+        for key in ("original_order_id", "group_id"):
+            if key in t:
+                t[key] = sub(order, t[key])
+        if "design_item_id" in t:
+            t["design_item_id"] = sub(design, t["design_item_id"])
+        if t.get("compatible_resource_ids"):
+            t["compatible_resource_ids"] = [sub(resource, r) for r in t["compatible_resource_ids"]]
+        if t.get("sub_task_completion_offsets"):
+            t["sub_task_completion_offsets"] = {sub(order, k): v for k, v in t["sub_task_completion_offsets"].items()}
+        if t.get("sub_tasks"):
+            t["sub_tasks"] = [anon_task(s) for s in t["sub_tasks"]]
+        return t
+
+    job_id = str(payload.get("job_id") or "")
+    anon = dict(payload)
+    anon["job_id"] = "job-" + hashlib.sha1(job_id.encode()).hexdigest()[:12]
+    anon["tasks"] = [anon_task(t) for t in payload.get("tasks", [])]
+    anon["resources"] = [dict(r, id=sub(resource, r.get("id"))) for r in payload.get("resources", [])]
+    anon["machines"] = [
+        dict(m, id=sub(resource, m.get("id")),
+             routing=[dict(route, design_item_id=sub(design, route.get("design_item_id")))
+                      for route in m.get("routing") or []])
+        for m in payload.get("machines", [])
+    ]
+    anon_hints = None
+    if hints is not None:
+        anon_hints = {sub(task, t_id): dict(h, machine_id=sub(resource, h.get("machine_id")))
+                      for t_id, h in hints.items()}
+    return anon, anon_hints
+
+
+# ---------------------------------------------------------
+# Bản ghi JSONL: payload / hints nén (msgpack + zstd, base64) kèm kết quả và solver stats
+# ---------------------------------------------------------
+def _pack(obj: Any) -> Optional[str]:
+    return base64.b64encode(encode_blob(obj)).decode() if obj is not None else None
+
+
+def _unpack(data: Optional[str]) -> Any:
+    return decode_blob(base64.b64decode(data)) if data else None
+
+
+def outcome_of(result: Dict[str, Any]) -> Dict[str, Any]:
+    overloads = result.get("overloads") or []
+    return {
+        "status": result.get("status"),
+        "solver_status": result.get("solver_status"),
+        "objective_value": result.get("objective_value"),
+        "scheduled": len(result.get("assignments") or []),
+        "dropped": sum(1 for o in overloads if o["status"] == "DROPPED"),
+        "late": sum(1 for o in overloads if o["status"] == "LATE"),
+        "stop_reason": result.get("stop_reason"),
+    }
+
+
+class PayloadRecorder:
+    """
+    Ghi payload đã giải (kèm hints warm-start, kết quả, solver stats) vào file JSONL, một
+    dòng một job. Nhiều worker process cùng ghi một thư mục: khoá file (flock) quanh mỗi
+    lần ghi và lần xoay file.
+    """
+
+    def __init__(self, directory: str = RECORD_DIR, max_bytes: int = RECORD_MAX_BYTES,
+                 backups: int = RECORD_BACKUPS, anonymize_ids: bool = RECORD_ANONYMIZE,
+                 sample_rate: float = RECORD_SAMPLE_RATE, min_seconds: float = RECORD_MIN_SECONDS):
+        self.directory = directory
+        self.path = os.path.join(directory, RECORD_FILE)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.anonymize_ids = anonymize_ids
+        self.sample_rate = sample_rate
+        self.min_seconds = min_seconds
+
+    @classmethod
+    def from_env(cls) -> Optional["PayloadRecorder"]:
+        return cls() if RECORD_PAYLOADS else None
+
+    def should_record(self, payload: Dict[str, Any], seconds: float) -> bool:
+        if (payload.get("config") or {}).get("record"):
+            return True
+        return seconds >= self.min_seconds and random.random() < self.sample_rate
+
+    def record(self, payload: Dict[str, Any], result: Dict[str, Any], seconds: float,
+               celery_task_id: Optional[str] = None,
+               hints: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        if not self.should_record(payload, seconds):
+            return False
+        if self.anonymize_ids:
+            payload, hints = anonymize(payload, hints)
+        entry = {
+            "recorded_at": time.time(),
+            "job_id": payload.get("job_id"),
+            "celery_task_id": celery_task_id,
+            "anonymized": self.anonymize_ids,
+            "tasks": len(payload.get("tasks", [])),
+            "resources": len(payload.get("resources", [])),
+            "seconds": round(seconds, 3),
+            "outcome": outcome_of(result),
+            "stats": result.get("stats"),
+            "payload": _pack(payload),
+            "hints": _pack(hints or None),
+        }
+        line = (json.dumps(entry, default=str) + "\n").encode()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, "ab") as f:
+                    f.write(line)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        logger.info("payload recorded", extra={"path": self.path, "bytes": len(line), "tasks": entry["tasks"]})
+        return True
+
+    def _rotate(self):
+        for k in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{k}"):
+                os.replace(f"{self.path}.{k}", f"{self.path}.{k + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def recording_files(path: str) -> List[str]:
+    """File bản ghi theo thứ tự thời gian (file xoay cũ nhất trước); `path` là file hoặc thư mục"""
+    if not os.path.isdir(path):
+        return [path]
+    base = os.path.join(path, RECORD_FILE)
+    rotated = sorted((f for f in os.listdir(path) if f.startswith(RECORD_FILE + ".") and f.rsplit(".", 1)[1].isdigit()),
+                     key=lambda f: int(f.rsplit(".", 1)[1]), reverse=True)
+    files = [os.path.join(path, f) for f in rotated]
+    return files + ([base] if os.path.exists(base) else [])
+
+
+def read_recordings(path: str) -> Iterator[Dict[str, Any]]:
+    """Các bản ghi (chưa giải nén payload); dòng hỏng (ghi dở) bị bỏ qua"""
+    for file in recording_files(path):
+        with open(file) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def load_recording(entry: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """(payload, hints) của một bản ghi"""
+    return _unpack(entry["payload"]), _unpack(entry.get("hints")) or {}
@@ -0,0 +1,153 @@
+import logging
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from .analysis import dependency_edges
+from .decomposition import build_frozen_payload, merge_windows
+
+logger = logging.getLogger(__name__)
+
+
+def _overlaps(a_start: int, a_end: int, b_start: int, b_end: int) -> bool:
+    return max(a_start, b_start) < min(a_end, b_end)
+
+
+def apply_delta(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Áp delta lên payload gốc: thêm task mới, huỷ task, đổi due date.
+    Phụ thuộc trỏ tới task đã huỷ bị bỏ đi. `unavailability` mới được xử lý riêng
+    trong `build_resolve_payload` vì còn phụ thuộc vào các task đã chạy.
+    """
+    cancelled = set(delta.get("cancelled_task_ids") or [])
+    due_changes = delta.get("due_date_changes") or {}
+    new_tasks = {t["task_id"]: t for t in (delta.get("new_tasks") or [])}
+
+    tasks = []
+    for t in list(base.get("tasks", [])) + list(new_tasks.values()):
+        t_id = t.get("task_id")
+        if t_id in cancelled:
+            continue
+        if t_id in new_tasks and t is not new_tasks[t_id]:
+            continue  # Task mới cùng ID thay thế task cũ
+        t = dict(t)
+        t["final_depends_on"] = [p for p in (t.get("final_depends_on") or []) if p not in cancelled]
+        if t.get("internal_dep") in cancelled:
+            t["internal_dep"] = ""
+        if t_id in due_changes:
+            t["due_at_min"] = int(due_changes[t_id])
+        tasks.append(t)
+
+    payload = dict(base)
+    payload["tasks"] = tasks
+    return payload
+
+
+def build_resolve_payload(request: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Dựng bài toán re-plan từ lịch gốc + delta.
+
+    Task đã bắt đầu (start_min < now_min) hoặc nằm trong cửa sổ đóng băng
+    (start_min < now_min + frozen_window_min) trở thành hằng số. Task đóng băng chưa chạy
+    nhưng trùng lịch hỏng máy mới thì được giải lại cùng các task con/cháu chưa chạy. Task đã chạy không bị dời:
+    lịch hỏng máy chồng lên nó được cắt để bắt đầu sau khi task kết thúc.
+
+    Trả về (payload con chỉ gồm task còn lại, frozen, hints từ lịch gốc, assignment đã chốt).
+    """
+    now = int(request.get("now_min") or 0)
+    frozen_until = now + int(request.get("frozen_window_min") or 0)
+    delta = request.get("delta") or {}
+    payload = apply_delta(request["base"], delta)
+
+    tasks_by_id = {t["task_id"]: t for t in payload["tasks"]}
+    resource_ids = {r["id"] for r in payload.get("resources", [])}
+    base_assignments = {
+        a["task_id"]: a for a in (request.get("base_assignments") or [])
+        if a["task_id"] in tasks_by_id and a["machine_id"] in resource_ids
+    }
+    started = {t_id for t_id, a in base_assignments.items() if int(a["start_min"]) < now}
+
+    # Lịch hỏng máy mới: cắt phần chồng lên task đang chạy
+    new_windows: Dict[str, List[Dict[str, int]]] = {}
+    for r_id, windows in (delta.get("unavailability") or {}).items():
+        for w in windows:
+            start, end = int(w["start"]), int(w["end"])
+            for t_id in started:
+                a = base_assignments[t_id]
+                if a["machine_id"] == r_id and _overlaps(start, end, int(a["start_min"]), int(a["end_min"])):
+                    start = max(start, int(a["end_min"]))
+            if end > start:
+                new_windows.setdefault(r_id, []).append({"start": start, "end": end})
+
+    # Task chưa chạy trùng lịch hỏng máy được giải lại, kéo theo mọi task con/cháu chưa chạy
+    # (nếu không, task cha bị dời có thể kết thúc sau task con vẫn đóng băng)
+    thawed = [
+        t_id for t_id, a in base_assignments.items()
+        if t_id not in started and any(
+            _overlaps(w["start"], w["end"], int(a["start_min"]), int(a["end_min"]))
+            for w in new_windows.get(a["machine_id"], [])
+        )
+    ]
+    children: Dict[str, List[str]] = {}
+    for parent_id, child_id, _, _ in dependency_edges(payload["tasks"]):
+        children.setdefault(parent_id, []).append(child_id)
+    unfrozen = set()
+    while thawed:
+        t_id = thawed.pop()
+        if t_id in unfrozen or t_id in started:
+            continue
+        unfrozen.add(t_id)
+        thawed.extend(children.get(t_id, []))
+
+    frozen: Dict[str, Dict[str, Any]] = {}
+    for t_id, a in base_assignments.items():
+        if int(a["start_min"]) >= frozen_until or t_id in unfrozen:
+            continue
+        frozen[t_id] = a
+
+    resources = []
+    for r in payload.get("resources", []):
+        if r["id"] in new_windows:
+            r = dict(r)
+            # Gộp để tránh các fixed interval chồng nhau trong AddNoOverlap
+            r["unavailability"] = merge_windows(list(r.get("unavailability", [])) + new_windows[r["id"]])
+        resources.append(r)
+    payload["resources"] = resources
+
+    # Task còn lại không được xếp vào quá khứ
+    remaining = []
+    for t_id, t in tasks_by_id.items():
+        if t_id in frozen:
+            continue
+        t = dict(t)
+        t["start_after_min"] = max(int(t.get("start_after_min") or 0), now)
+        remaining.append(t)
+
+    hints = {
+        t_id: {"start_min": int(a["start_min"]), "machine_id": a["machine_id"]}
+        for t_id, a in base_assignments.items() if t_id not in frozen
+    }
+    config = dict(payload.get("config") or {})
+    sub_payload, sub_frozen = build_frozen_payload(payload, remaining, frozen, tasks_by_id, config)
+    return sub_payload, sub_frozen, hints, list(frozen.values())
+
+
+def resolve_schedule(request: Dict[str, Any],
+                     progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     should_cancel: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+    """Giải lại phần lịch chưa đóng băng và ghép với phần đã chốt"""
+    from .engine import Engine
+
+    sub_payload, frozen, hints, frozen_assignments = build_resolve_payload(request)
+    logger.info("re-plan", extra={"frozen": len(frozen_assignments),
+                                  "to_resolve": len(sub_payload["tasks"]) - len(frozen)})
+
+    if len(sub_payload["tasks"]) == len(frozen):
+        result = {"status": "feasible", "assignments": [], "overloads": []}
+    else:
+        result = Engine(sub_payload, frozen=frozen, hints=hints, progress=progress,
+                        should_cancel=should_cancel).solve()
+
+    solved = [a for a in result.get("assignments", []) if a["task_id"] not in frozen]
+    result["assignments"] = frozen_assignments + solved
+    result["overloads"] = [o for o in result.get("overloads", []) if o["task_id"] not in frozen]
+    result["frozen_count"] = len(frozen_assignments)
+    return result
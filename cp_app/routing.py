@@ -0,0 +1,89 @@
+import logging
+import os
+from typing import Dict, Any, Optional
+
+from .celery_app import INTERACTIVE_QUEUE, BATCH_QUEUE
+from .tables import ProblemTables
+
+logger = logging.getLogger(__name__)
+
+# Ngưỡng job "interactive": số cặp task x máy tương thích, số interval (cặp + giờ nghỉ)
+# và thời gian tìm kiếm yêu cầu. Vượt một ngưỡng bất kỳ -> hàng đợi batch
+INTERACTIVE_MAX_PAIRS = int(os.getenv("INTERACTIVE_MAX_PAIRS", "5000"))
+INTERACTIVE_MAX_INTERVALS = int(os.getenv("INTERACTIVE_MAX_INTERVALS", "20000"))
+INTERACTIVE_MAX_SEARCH_TIME = int(os.getenv("INTERACTIVE_MAX_SEARCH_TIME", "60"))
+
+# Time limit (giây) của task Celery theo hàng đợi; luôn >= max_search_time + phần dự phòng
+INTERACTIVE_TIME_LIMIT = int(os.getenv("INTERACTIVE_TIME_LIMIT", "120"))
+BATCH_TIME_LIMIT = int(os.getenv("BATCH_TIME_LIMIT", "1800"))
+TIME_LIMIT_GRACE_SECONDS = int(os.getenv("TIME_LIMIT_GRACE_SECONDS", "60"))
+
+# Redis transport: 0 = ưu tiên cao nhất, 9 = thấp nhất
+INTERACTIVE_PRIORITY = int(os.getenv("INTERACTIVE_PRIORITY", "0"))
+BATCH_PRIORITY = int(os.getenv("BATCH_PRIORITY", "6"))
+
+# Số core dành cho CP-SAT trên một host (mặc định: toàn bộ core), chia đều cho số lời giải
+# chạy đồng thời trên host (mặc định: concurrency của worker)
+SOLVER_CPU_BUDGET = int(os.getenv("SOLVER_CPU_BUDGET", "0")) or os.cpu_count() or 1
+SOLVER_CONCURRENT_SOLVES = int(os.getenv("SOLVER_CONCURRENT_SOLVES", "0"))
+
+
+def job_size(tables: ProblemTables) -> Dict[str, int]:
+    """
+    Kích thước model ước lượng từ bảng chuẩn hoá: mỗi cặp task x máy tương thích là một
+    interval tuỳ chọn, cộng các interval giờ nghỉ của những lịch được máy tương thích dùng tới.
+    """
+    used = set(tables.compat_idx.tolist())
+    calendars = {int(tables.calendar_id[j]) for j in used}
+    pairs = int(len(tables.compat_idx))
+    return {
+        "tasks": tables.n_tasks,
+        "pairs": pairs,
+        "intervals": pairs + sum(len(tables.calendars[c]) for c in calendars),
+    }
+
+
+def classify_job(size: Dict[str, int], config: Dict[str, Any]) -> str:
+    """"interactive" cho job nhỏ và ngắn, "batch" cho phần còn lại (config `queue` ép lựa chọn)"""
+    forced = config.get("queue")
+    if forced in ("interactive", "batch"):
+        return forced
+    if (size["pairs"] <= INTERACTIVE_MAX_PAIRS
+            and size["intervals"] <= INTERACTIVE_MAX_INTERVALS
+            and int(config.get("max_search_time") or 300) <= INTERACTIVE_MAX_SEARCH_TIME):
+        return "interactive"
+    return "batch"
+
+
+def route_options(tables: ProblemTables, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Tham số `apply_async` (queue, priority, time limit) cho một job"""
+    size = job_size(tables)
+    job_class = classify_job(size, config)
+    if job_class == "interactive":
+        queue, priority, limit = INTERACTIVE_QUEUE, INTERACTIVE_PRIORITY, INTERACTIVE_TIME_LIMIT
+    else:
+        queue, priority, limit = BATCH_QUEUE, BATCH_PRIORITY, BATCH_TIME_LIMIT
+    soft_limit = max(limit, int(config.get("max_search_time") or 300) + TIME_LIMIT_GRACE_SECONDS)
+    logger.info("job routed", extra={"job_class": job_class, "queue": queue, **size})
+    return {
+        "queue": queue,
+        "priority": priority,
+        "soft_time_limit": soft_limit,
+        "time_limit": soft_limit + TIME_LIMIT_GRACE_SECONDS,
+    }
+
+
+def solver_cpu_share(concurrency: Optional[int]) -> int:
+    slots = SOLVER_CONCURRENT_SOLVES or concurrency or 1
+    return max(1, SOLVER_CPU_BUDGET // slots)
+
+
+def apply_cpu_budget(config: Dict[str, Any], concurrency: Optional[int]) -> Dict[str, Any]:
+    """
+    Config có `num_search_workers` theo phần core của một lời giải trên host: giá trị
+    trong payload được giữ nếu nhỏ hơn, nhưng không vượt phần được chia.
+    """
+    share = solver_cpu_share(concurrency)
+    requested = config.get("num_search_workers")
+    workers = min(int(requested), share) if requested else share
+    return dict(config, num_search_workers=workers)
@@ -0,0 +1,307 @@
+import copy
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from ortools.sat.python import cp_model
+
+from .decomposition import merge_windows
+from .observability import phase
+from .replan import apply_delta
+
+logger = logging.getLogger(__name__)
+
+BASE_SCENARIO = "base"
+MAX_SCENARIOS = int(os.getenv("MAX_SCENARIOS", "20"))
+
+# Máy ngừng, đổi priority / due / release chỉ sửa bound / literal / hệ số objective trên bản sao
+# model dùng chung; các thay đổi sau (task mới / huỷ, lịch nghỉ) đổi cấu trúc model -> dựng lại
+STRUCTURAL_FIELDS = ("new_tasks", "cancelled_task_ids", "unavailability", "calendars")
+
+INT64_MAX = 2 ** 63 - 1
+
+
+def apply_scenario(payload: Dict[str, Any], scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Payload đầy đủ của một kịch bản: task mới / huỷ / đổi due (như delta re-plan), đổi
+    priority / release, máy ngừng chạy (bỏ khỏi danh sách máy tương thích), thêm giờ nghỉ
+    (`unavailability`) hoặc thay cả lịch nghỉ của máy (`calendars`, VD lịch tăng ca).
+    """
+    payload = apply_delta(payload, scenario)
+    down = set(scenario.get("machines_down") or [])
+    priorities = scenario.get("priority_changes") or {}
+    releases = scenario.get("release_changes") or {}
+    if down or priorities or releases:
+        tasks = []
+        for t in payload["tasks"]:
+            t_id = t.get("task_id")
+            if down or t_id in priorities or t_id in releases:
+                t = dict(t)
+                if down:
+                    t["compatible_resource_ids"] = [r for r in t.get("compatible_resource_ids") or [] if r not in down]
+                if t_id in priorities:
+                    t["priority"] = int(priorities[t_id])
+                if t_id in releases:
+                    t["start_after_min"] = int(releases[t_id])
+            tasks.append(t)
+        payload["tasks"] = tasks
+
+    extra_windows = scenario.get("unavailability") or {}
+    calendars = scenario.get("calendars") or {}
+    if extra_windows or calendars:
+        resources = []
+        for r in payload.get("resources", []):
+            if r["id"] in calendars or r["id"] in extra_windows:
+                r = dict(r)
+                windows = calendars.get(r["id"], r.get("unavailability", []))
+                r["unavailability"] = merge_windows(list(windows) + list(extra_windows.get(r["id"], [])))
+            resources.append(r)
+        payload["resources"] = resources
+    return payload
+
+
+def _restrict_domain(proto, var_index: int, lower: int, upper: int = INT64_MAX) -> bool:
+    """Giao miền của biến với [lower, upper] ngay trên proto; False nếu miền rỗng (không đổi gì)"""
+    var = proto.variables[var_index]
+    domain = cp_model.Domain.from_flat_intervals(list(var.domain)).intersection_with(cp_model.Domain(lower, upper))
+    if domain.is_empty():
+        return False
+    var.domain.clear()
+    var.domain.extend(domain.flattened_intervals())
+    return True
+
+
+class SharedScenarioModel:
+    """
+    Model CP-SAT của payload gốc dựng một lần (chẩn đoán, biến, ràng buộc, hint heuristic).
+    Mỗi kịch bản chỉ đổi bound / literal trên một bản sao proto: máy ngừng -> literal chọn
+    máy cố định 0, release muộn hơn -> thu miền start, due / priority -> sửa ràng buộc
+    lateness và hệ số objective. Kịch bản đổi cấu trúc (task mới / huỷ, lịch nghỉ, release
+    sớm hơn miền đã thu hẹp) không dùng được model chung (`supports`).
+    """
+
+    def __init__(self, payload: Dict[str, Any], hints: Optional[Dict[str, Dict[str, Any]]] = None):
+        from .engine import Engine
+        self.engine = Engine(payload, hints=hints)
+        self.task_vars, self.heuristic_result = self.engine.build()
+        self._clone_lock = threading.Lock()
+
+    def supports(self, scenario: Dict[str, Any]) -> bool:
+        if any(scenario.get(field) for field in STRUCTURAL_FIELDS):
+            return False
+        resource_ids = set(self.engine.tables.resource_ids)
+        if any(r_id not in resource_ids for r_id in scenario.get("machines_down") or []):
+            return False
+        changed = [*(scenario.get("priority_changes") or {}), *(scenario.get("due_date_changes") or {}),
+                   *(scenario.get("release_changes") or {})]
+        if any(t_id not in self.task_vars or self.task_vars[t_id]["is_frozen"] for t_id in changed):
+            return False
+        # Release sớm hơn miền start đã thu hẹp cần dựng lại model
+        for t_id, release in (scenario.get("release_changes") or {}).items():
+            lower, upper = self.task_vars[t_id]["start_bounds"]
+            if not lower <= int(release) <= upper:
+                return False
+        return True
+
+    def variant(self, scenario: Dict[str, Any], payload: Dict[str, Any],
+                should_cancel: Optional[Callable[[], bool]] = None):
+        """(Engine trỏ tới bản sao model đã áp kịch bản, task_vars tương ứng) để `solve_built`"""
+        with self._clone_lock:
+            model = self.engine.model.clone()
+        proto = model.Proto()
+        task_vars = {t_id: dict(tv) for t_id, tv in self.task_vars.items()}
+
+        down = set(scenario.get("machines_down") or [])
+        if down:
+            for tv in task_vars.values():
+                for r_id, lit in zip(tv["r_ids"], tv["literals"]):
+                    if r_id in down:
+                        _restrict_domain(proto, lit.Index(), 0, 0)
+
+        for t_id, release in (scenario.get("release_changes") or {}).items():
+            tv = task_vars[t_id]
+            _restrict_domain(proto, tv["start"].Index(), int(release))
+            tv["start_bounds"] = (int(release), tv["start_bounds"][1])
+
+        objective = proto.objective
+        position = {var: k for k, var in enumerate(objective.vars)}
+        # Trễ tính theo đơn trên các task cuối (xem Engine): đổi priority / due của task cuối sửa
+        # ràng buộc trễ và hệ số objective của đơn; task giữa chỉ đổi hạn dùng để báo LATE
+        order_lateness = {order: dict(entry, constraints=dict(entry["constraints"]))
+                          for order, entry in self.engine.order_lateness.items()}
+        changed_orders = set()
+        for t_id, priority in (scenario.get("priority_changes") or {}).items():
+            tv = task_vars[t_id]
+            tv["priority"] = int(priority)
+            if tv["is_sink"]:
+                changed_orders.add(tv["order"])
+
+        for t_id, due in (scenario.get("due_date_changes") or {}).items():
+            tv = task_vars[t_id]
+            tv["due"] = int(due)
+            if not tv["is_sink"]:
+                continue
+            end = model.GetIntVarFromProtoIndex(tv["end"].Index())
+            entry = order_lateness.get(tv["order"])
+            if entry and t_id in entry["constraints"]:
+                # delay - end >= -due
+                linear = proto.constraints[entry["constraints"][t_id].Index()].linear
+                linear.vars.clear()
+                linear.vars.extend([entry["delay"].Index(), end.Index()])
+                linear.coeffs.clear()
+                linear.coeffs.extend([1, -1])
+                linear.domain.clear()
+                linear.domain.extend([-int(due), INT64_MAX])
+                continue
+            if entry is None:
+                # Đơn chưa có hạn trong model gốc: thêm biến trễ và hạng lateness vào objective
+                delay = model.NewIntVar(0, self.engine.horizon, f"{tv['order']}_delay")
+                entry = order_lateness[tv["order"]] = {"delay": delay, "constraints": {}}
+                position[delay.Index()] = len(objective.vars)
+                objective.vars.append(delay.Index())
+                objective.coeffs.append(0)
+            entry["constraints"][t_id] = model.Add(entry["delay"] >= end - int(due))
+            changed_orders.add(tv["order"])
+
+        for order in changed_orders:
+            entry = order_lateness.get(order)
+            if entry:
+                objective.coeffs[position[entry["delay"].Index()]] = self.engine.order_weight(task_vars, entry)
+
+        view = copy.copy(self.engine)
+        view.payload = payload
+        view.config = payload.get("config", {})
+        view.tasks = payload.get("tasks", [])
+        view.model = model
+        view.solver = cp_model.CpSolver()
+        view.progress = None
+        view.should_cancel = should_cancel
+        view.stop_reason = None
+        view.timings = {}
+        view.search_stats = None
+        view.stages = []
+        view.hint_stats = dict(self.engine.hint_stats)
+        view.order_lateness = order_lateness
+        variables = [model.GetIntVarFromProtoIndex(v) for v in objective.vars]
+        view.objectives = dict(self.engine.objectives,
+                               weighted=cp_model.LinearExpr.WeightedSum(variables, list(objective.coeffs)))
+        return view, task_vars
+
+
+def scenario_summary(name: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Các chỉ số so sánh của một kịch bản"""
+    overloads = result.get("overloads") or []
+    assignments = result.get("assignments") or []
+    return {
+        "name": name,
+        "status": result.get("status"),
+        "objective_value": result.get("objective_value"),
+        "scheduled": len(assignments),
+        "dropped": sum(1 for o in overloads if o["status"] == "DROPPED"),
+        "late": sum(1 for o in overloads if o["status"] == "LATE"),
+        "total_delay_minutes": sum(o.get("delay_minutes", 0) for o in overloads if o["status"] == "LATE"),
+        "makespan": max((a["end_min"] for a in assignments), default=0),
+    }
+
+
+COMPARED_METRICS = ("objective_value", "scheduled", "dropped", "late", "total_delay_minutes", "makespan")
+
+
+def compare_scenarios(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Chênh lệch của từng kịch bản so với kịch bản gốc và thứ hạng (ít drop, ít trễ, makespan ngắn)"""
+    base = next((s for s in summaries if s["name"] == BASE_SCENARIO and s["status"] == "feasible"), None)
+    deltas = {}
+    for s in summaries:
+        if base is None or s is base or s["status"] != "feasible":
+            continue
+        deltas[s["name"]] = {
+            m: s[m] - base[m] for m in COMPARED_METRICS if s[m] is not None and base[m] is not None
+        }
+    feasible = [s for s in summaries if s["status"] == "feasible"]
+    ranking = [s["name"] for s in sorted(feasible, key=lambda s: (s["dropped"], s["total_delay_minutes"], s["makespan"]))]
+    return {"baseline": base["name"] if base else None, "delta_vs_baseline": deltas, "ranking": ranking}
+
+
+def solve_scenarios(payload: Dict[str, Any], scenarios: List[Dict[str, Any]],
+                    hints: Optional[Dict[str, Dict[str, Any]]] = None,
+                    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    should_cancel: Optional[Callable[[], bool]] = None,
+                    include_assignments: bool = True) -> Dict[str, Any]:
+    """
+    Giải payload gốc (kịch bản "base") cùng các kịch bản what-if và gộp thành một báo cáo.
+
+    Model dựng một lần (`SharedScenarioModel`); kịch bản chỉ đổi bound / literal giải trên
+    bản sao của nó, kịch bản đổi cấu trúc được dựng lại từ payload đã áp thay đổi. Các
+    kịch bản chạy song song trên thread (CP-SAT nhả GIL khi giải), mỗi kịch bản nhận một
+    phần `num_search_workers` và toàn bộ `max_search_time`. Kịch bản chạy trên model chung
+    mà infeasible (VD release muộn đẩy task sau không còn chỗ) được giải lại bằng model riêng.
+    """
+    from .engine import Engine
+
+    config = dict(payload.get("config") or {})
+    # Một model duy nhất cho mọi kịch bản: không tách thành phần / cửa sổ / trục giờ làm việc,
+    # objective có trọng số (hệ số lateness được sửa theo priority của kịch bản)
+    config.update(decompose_components=False, rolling_horizon=False, time_mode="wall", objective_mode="weighted")
+    if any(s.get("machines_down") for s in scenarios):
+        # Thứ tự máy trong lớp đối xứng / pool máy sai khi một máy trong lớp ngừng chạy
+        config["symmetry_mode"] = "off"
+
+    jobs = [{"name": BASE_SCENARIO}] + [s for s in scenarios if s.get("name") != BASE_SCENARIO]
+    cpu_budget = int(config.get("num_search_workers") or os.cpu_count() or 1)
+    pool_size = max(1, min(len(jobs), int(config.get("scenario_workers") or cpu_budget)))
+    config["num_search_workers"] = max(1, cpu_budget // pool_size)
+    base_payload = dict(payload, config=config)
+
+    with phase("scenario_build"):
+        shared = SharedScenarioModel(base_payload, hints=hints)
+    logger.info("scenario model built", extra={"scenarios": len(jobs), "pool_size": pool_size,
+                                                "num_search_workers": config["num_search_workers"]})
+
+    def run(scenario: Dict[str, Any]) -> Tuple[Dict[str, Any], str, float]:
+        started = time.time()
+        scenario_payload = apply_scenario(base_payload, scenario)
+        if shared.supports(scenario):
+            engine, task_vars = shared.variant(scenario, scenario_payload, should_cancel)
+            result = engine.solve_built(task_vars, shared.heuristic_result if scenario is jobs[0] else None)
+            if result["status"] != "infeasible":
+                return result, "shared", round(time.time() - started, 3)
+            logger.info("scenario infeasible on shared model, rebuilding", extra={"scenario": scenario["name"]})
+        result = Engine(scenario_payload, hints=hints, should_cancel=should_cancel).solve()
+        return result, "rebuilt", round(time.time() - started, 3)
+
+    outcomes: Dict[str, Tuple[Dict[str, Any], str, float]] = {}
+    with ThreadPoolExecutor(max_workers=pool_size) as pool:
+        futures = {pool.submit(run, s): s["name"] for s in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                outcomes[name] = future.result()
+            except Exception as e:
+                logger.error("scenario failed", extra={"scenario": name, "error": str(e)})
+                outcomes[name] = ({"status": "failed", "error": str(e)}, "failed", 0.0)
+            result, mode, wall_time = outcomes[name]
+            if progress:
+                progress({"type": "scenario", "scenario": name, "mode": mode, "status": result["status"],
+                          "objective": result.get("objective_value"), "wall_time": wall_time,
+                          "done": len(outcomes), "scenarios_total": len(jobs)})
+
+    reports = []
+    for s in jobs:
+        result, mode, wall_time = outcomes[s["name"]]
+        report = dict(scenario_summary(s["name"], result), mode=mode, wall_time=wall_time,
+                      stop_reason=result.get("stop_reason"))
+        if result.get("error"):
+            report["error"] = result["error"]
+        if include_assignments:
+            report["assignments"] = result.get("assignments", [])
+            report["overloads"] = result.get("overloads", [])
+        reports.append(report)
+
+    return {
+        "status": "feasible" if any(r["status"] == "feasible" for r in reports) else "infeasible",
+        "scenarios": reports,
+        "comparison": compare_scenarios(reports),
+    }
@@ -0,0 +1,306 @@
+import logging
+import os
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from ortools.sat.python import cp_model
+
+logger = logging.getLogger(__name__)
+
+# Máy có không quá SETUP_CIRCUIT_MAX_TASKS task ứng viên dùng AddCircuit (đếm được thời gian chuyển đổi)
+SETUP_CIRCUIT_MAX_TASKS = int(os.getenv("SETUP_CIRCUIT_MAX_TASKS", "25"))
+# Số task khác mã hàng gần nhất (theo earliest start) được ghép cặp với mỗi task
+SETUP_NEIGHBOURS = int(os.getenv("SETUP_NEIGHBOURS", "8"))
+# Số vị trí tối đa duyệt tới (bỏ qua task cùng mã hàng) = hệ số x SETUP_NEIGHBOURS
+SETUP_SCAN_FACTOR = 4
+
+
+class SetupTimes:
+    """
+    Thời gian chuyển đổi (phút) khi máy chuyển sang mã hàng khác: `routing[].setup_time` của
+    máy cho (operation, design_item_id) của task sau, không có route thì `setup_time_minutes`
+    của config. Chỉ máy khai báo trong `machines` có setup; task cùng mã hàng liền nhau không tốn.
+    """
+
+    def __init__(self, payload: Dict[str, Any]):
+        config = payload.get("config") or {}
+        self.default = int(config.get("setup_time_minutes") or 0)
+        self.routes: Dict[str, Dict[Tuple[Optional[str], Optional[str]], int]] = {}
+        for m in payload.get("machines") or []:
+            self.routes[m["id"]] = {
+                (route.get("operation"), route.get("design_item_id")): int(round(float(route.get("setup_time") or 0)))
+                for route in m.get("routing") or []
+            }
+
+    def has_setups(self, machine_id: str) -> bool:
+        return machine_id in self.routes
+
+    def minutes(self, machine_id: str, operation: Optional[str], design: Optional[str]) -> int:
+        routes = self.routes.get(machine_id)
+        if routes is None or not design:
+            return 0
+        return routes.get((operation, design), self.default)
+
+    def between(self, machine_id: str, prev_design: Optional[str], operation: Optional[str],
+                design: Optional[str]) -> int:
+        """Setup khi `design` chạy ngay sau `prev_design` trên máy"""
+        if not prev_design or prev_design == design:
+            return 0
+        return self.minutes(machine_id, operation, design)
+
+    def signature(self, machine_id: str):
+        """Bảng setup của máy, để hai máy chỉ hoán đổi được khi cùng bảng"""
+        routes = self.routes.get(machine_id)
+        return None if routes is None else tuple(sorted(routes.items(), key=repr))
+
+
+def setup_machines(payload: Dict[str, Any], setup_times: SetupTimes) -> Set[str]:
+    """
+    Máy serial có setup thật sự: khai báo trong `machines`, có task tương thích thuộc
+    từ 2 mã hàng trở lên và setup khác 0 cho ít nhất một mã hàng.
+    """
+    resources = {r["id"]: r for r in payload.get("resources", [])}
+    # Gom theo danh sách máy tương thích trước: nhiều task dùng chung một danh sách dài
+    by_compatible: Dict[Tuple[str, ...], Set[Tuple[Optional[str], str]]] = {}
+    for t in payload.get("tasks", []):
+        design = t.get("design_item_id")
+        if design:
+            key = tuple(t.get("compatible_resource_ids") or ())
+            by_compatible.setdefault(key, set()).add((t.get("operation"), design))
+    designs: Dict[str, Set[Tuple[Optional[str], str]]] = {}
+    for compatible, items in by_compatible.items():
+        for r_id in compatible:
+            if setup_times.has_setups(r_id):
+                designs.setdefault(r_id, set()).update(items)
+    result = set()
+    for r_id, items in designs.items():
+        r = resources.get(r_id)
+        if r is None or r.get("type") in ("batch", "pool") or r.get("operation") == "washing":
+            continue
+        if len({d for _, d in items}) > 1 and any(setup_times.minutes(r_id, op, d) for op, d in items):
+            result.add(r_id)
+    return result
+
+
+# ---------------------------------------------------------
+# Model: task ứng viên của máy nhóm theo mã hàng, chỉ ràng buộc cặp khác mã hàng.
+# - Máy nhỏ (khi cần tối thiểu thời gian chuyển đổi): AddCircuit trên thứ tự task của máy.
+# - Còn lại: mỗi task ghép với tối đa `neighbours` task khác mã hàng gần nhất theo earliest
+#   start, cặp dùng chung một biến thứ tự và một biến "cùng máy" cho mọi máy chung.
+# ---------------------------------------------------------
+class SetupItem:
+    __slots__ = ("tv", "design", "operation", "lits")
+
+    def __init__(self, tv: Dict[str, Any], design: Optional[str], operation: Optional[str]):
+        self.tv = tv
+        self.design = design
+        self.operation = operation
+        # máy có setup -> literal chọn máy
+        self.lits: Dict[str, Any] = {}
+
+
+class SetupConstraints:
+    """
+    Ràng buộc setup phụ thuộc thứ tự trên `model`; `items[k].lits` chỉ chứa máy có setup
+    (xem `setup_machines`). Giữ lại các biến phụ để hint được từ một lịch có sẵn.
+    """
+
+    def __init__(self, model: cp_model.CpModel, setup_times: SetupTimes):
+        self.model = model
+        self.setup_times = setup_times
+        # (máy, task theo thứ tự node, arc (a, b) -> biến)
+        self.circuits: List[Tuple[str, List[SetupItem], Dict[Tuple[int, int], Any]]] = []
+        # (task trước, task sau, biến cùng máy, biến thứ tự)
+        self.pairs: List[Tuple[SetupItem, SetupItem, Any, Any]] = []
+        self.number: Dict[str, int] = {}
+        # chỉ số task -> (số thứ tự máy, literal chạy trên máy có setup)
+        self.machine_vars: Dict[int, Tuple[Any, Any]] = {}
+        self.setup_exprs: Dict[int, Any] = {}
+        # Tổng phút chuyển đổi trên các máy circuit (0 nếu không có)
+        self.changeovers = 0
+        self.stats: Dict[str, int] = {}
+
+    def build(self, items: List[SetupItem], circuits: bool = False,
+              circuit_max_tasks: int = SETUP_CIRCUIT_MAX_TASKS, neighbours: int = SETUP_NEIGHBOURS):
+        members: Dict[str, List[SetupItem]] = {}
+        for item in items:
+            for r_id in item.lits:
+                members.setdefault(r_id, []).append(item)
+
+        terms = []
+        arcs = 0
+        for r_id in [r_id for r_id, m in members.items() if circuits and len(m) <= circuit_max_tasks]:
+            arcs += self._add_circuit(r_id, members.pop(r_id), terms)
+        self._add_pairwise(members, neighbours)
+
+        if terms:
+            self.changeovers = cp_model.LinearExpr.WeightedSum([arc for arc, _ in terms], [m for _, m in terms])
+        self.stats = {
+            "machines": len(self.circuits) + len(members),
+            "circuit_machines": len(self.circuits),
+            "arcs": arcs,
+            "pairs": len(self.pairs),
+            "tasks": len(items),
+        }
+        if circuits and members:
+            logger.warning("changeovers only minimized on circuit machines", extra={
+                "pairwise_machines": len(members), "circuit_max_tasks": circuit_max_tasks,
+            })
+        logger.info("setup constraints", extra=self.stats)
+        return self
+
+    def _add_circuit(self, r_id: str, items: List[SetupItem], terms) -> int:
+        """Node 0 là điểm đầu / cuối; task không chạy trên máy bị bỏ qua bằng self-loop"""
+        model = self.model
+        arc_vars = {(0, 0): model.NewBoolVar(f"setup_{r_id}_empty")}
+        arcs = [(0, 0, arc_vars[0, 0])]
+        for a, prev in enumerate(items, start=1):
+            arc_vars[0, a] = model.NewBoolVar(f"setup_{r_id}_first_{a}")
+            arc_vars[a, 0] = model.NewBoolVar(f"setup_{r_id}_last_{a}")
+            arcs += [(0, a, arc_vars[0, a]), (a, 0, arc_vars[a, 0]), (a, a, prev.lits[r_id].Not())]
+            for b, nxt in enumerate(items, start=1):
+                minutes = self.setup_times.between(r_id, prev.design, nxt.operation, nxt.design)
+                # Bỏ arc không thể xảy ra theo miền start (task sau phải bắt đầu trước khi task trước xong)
+                if a == b or nxt.tv["start_bounds"][1] < prev.tv["start_bounds"][0] + prev.tv["duration"]:
+                    continue
+                arc = arc_vars[a, b] = model.NewBoolVar(f"setup_{r_id}_{a}_{b}")
+                arcs.append((a, b, arc))
+                if prev.tv["is_frozen"] and nxt.tv["is_frozen"]:
+                    # Hai task đã chốt: giữ nguyên lịch cũ kể cả khi thiếu thời gian chuyển đổi
+                    model.Add(nxt.tv["start"] >= prev.tv["end"]).OnlyEnforceIf(arc)
+                else:
+                    model.Add(nxt.tv["start"] >= prev.tv["end"] + minutes).OnlyEnforceIf(arc)
+                if minutes:
+                    terms.append((arc, minutes))
+        model.AddCircuit(arcs)
+        self.circuits.append((r_id, items, arc_vars))
+        return len(arcs)
+
+    def _machine_of(self, item: SetupItem):
+        # Số thứ tự máy có setup đang chạy task (0 = máy khác / bị drop) và literal "chạy trên máy có setup"
+        t_id = item.tv["index"]
+        if t_id not in self.machine_vars:
+            lits = {r_id: lit for r_id, lit in item.lits.items() if r_id in self.number}
+            m = self.model.NewIntVar(0, len(self.number), f"setup_machine_{t_id}")
+            self.model.Add(m == sum(self.number[r_id] * lit for r_id, lit in lits.items()))
+            on = self.model.NewBoolVar(f"setup_on_{t_id}")
+            self.model.Add(on == sum(lits.values()))
+            self.machine_vars[t_id] = (m, on)
+        return self.machine_vars[t_id]
+
+    def _setup_before(self, item: SetupItem):
+        # Phút setup trước `item` trên máy được chọn: hằng số nếu mọi máy như nhau, ngược lại
+        # tuyến tính theo literal chọn máy (chỉ dùng khi cặp cùng máy)
+        t_id = item.tv["index"]
+        if t_id not in self.setup_exprs:
+            lits = [(r_id, lit) for r_id, lit in item.lits.items() if r_id in self.number]
+            minutes = [self.setup_times.minutes(r_id, item.operation, item.design) for r_id, _ in lits]
+            if len(set(minutes)) == 1:
+                self.setup_exprs[t_id] = minutes[0]
+            else:
+                self.setup_exprs[t_id] = cp_model.LinearExpr.WeightedSum([lit for _, lit in lits], minutes)
+        return self.setup_exprs[t_id]
+
+    def _add_pairwise(self, members: Dict[str, List[SetupItem]], neighbours: int):
+        """
+        Cặp (k, l) khác mã hàng, k có earliest start sớm hơn: nếu cùng máy thì task sau bắt đầu
+        sau task trước cộng setup của máy cho task sau. Setup chỉ phụ thuộc task sau nên ràng
+        buộc mọi cặp là chính xác; giới hạn láng giềng là xấp xỉ (vi phạm được báo sau khi giải).
+        """
+        if not members:
+            return
+        self.number = {r_id: n for n, r_id in enumerate(members, start=1)}
+        machines_of: Dict[int, Set[str]] = {}
+        by_id: Dict[int, SetupItem] = {}
+        max_setup = 0
+        for r_id, items in members.items():
+            for item in items:
+                by_id[id(item)] = item
+                machines_of.setdefault(id(item), set()).add(r_id)
+                max_setup = max(max_setup, self.setup_times.minutes(r_id, item.operation, item.design))
+        order = sorted(by_id.values(), key=lambda it: (it.tv["start_bounds"][0], it.tv["start_bounds"][1]))
+
+        scan = max(1, neighbours) * SETUP_SCAN_FACTOR
+        for pos, prev in enumerate(order):
+            latest_end = prev.tv["start_bounds"][1] + prev.tv["duration"]
+            found = 0
+            for nxt in order[pos + 1:pos + 1 + scan]:
+                if found >= neighbours or nxt.tv["start_bounds"][0] >= latest_end + max_setup:
+                    break
+                if prev.design == nxt.design or (prev.tv["is_frozen"] and nxt.tv["is_frozen"]):
+                    continue
+                if not machines_of[id(prev)] & machines_of[id(nxt)]:
+                    continue
+                found += 1
+                self._add_pair(prev, nxt)
+
+    def _add_pair(self, prev: SetupItem, nxt: SetupItem):
+        model = self.model
+        m_prev, on_prev = self._machine_of(prev)
+        m_next, _ = self._machine_of(nxt)
+        name = f"{prev.tv['index']}_{nxt.tv['index']}"
+        same = model.NewBoolVar(f"setup_same_{name}")
+        before = model.NewBoolVar(f"setup_before_{name}")
+        model.Add(m_prev != m_next).OnlyEnforceIf(same.Not())
+        model.Add(nxt.tv["start"] >= prev.tv["end"] + self._setup_before(nxt)).OnlyEnforceIf([same, on_prev, before])
+        model.Add(prev.tv["start"] >= nxt.tv["end"] + self._setup_before(prev)).OnlyEnforceIf(
+            [same, on_prev, before.Not()])
+        self.pairs.append((prev, nxt, same, before))
+
+    def hint(self, placement: Dict[int, Tuple[str, int]]):
+        """
+        Hint các biến phụ theo một lịch: `placement` là chỉ số task -> (máy, start); task
+        không có trong `placement` coi như bị drop.
+        """
+        model = self.model
+        for r_id, items, arc_vars in self.circuits:
+            nodes = sorted((placement[item.tv["index"]][1], a) for a, item in enumerate(items, start=1)
+                           if placement.get(item.tv["index"], (None,))[0] == r_id)
+            used = {(0, 0)} if not nodes else set(zip([0] + [a for _, a in nodes], [a for _, a in nodes] + [0]))
+            for arc, var in arc_vars.items():
+                model.AddHint(var, 1 if arc in used else 0)
+
+        for prev, nxt, same, before in self.pairs:
+            (m_prev, start_prev), (m_next, start_next) = [
+                (self.number.get(machine, 0), start)
+                for machine, start in (placement.get(item.tv["index"], (None, 0)) for item in (prev, nxt))
+            ]
+            model.AddHint(same, int(m_prev == m_next))
+            model.AddHint(before, int(start_prev <= start_next))
+        for index, (m, on) in self.machine_vars.items():
+            number = self.number.get(placement.get(index, (None, 0))[0], 0)
+            model.AddHint(m, number)
+            model.AddHint(on, int(number > 0))
+
+
+def changeover_summary(assignments: List[Dict[str, Any]], task_info: Dict[str, Tuple[Optional[str], Optional[str]]],
+                       setup_times: SetupTimes) -> Dict[str, Any]:
+    """
+    Số lần / tổng phút chuyển đổi của lịch (task liên tiếp khác mã hàng trên cùng máy) và số
+    chỗ khoảng cách giữa hai task ngắn hơn setup (do giới hạn láng giềng hoặc lịch heuristic).
+    `task_info`: task_id -> (design_item_id, operation).
+    """
+    by_machine: Dict[str, List[Dict[str, Any]]] = {}
+    for a in assignments:
+        if setup_times.has_setups(a["machine_id"]):
+            by_machine.setdefault(a["machine_id"], []).append(a)
+
+    count = minutes = 0
+    violations = []
+    for r_id, items in by_machine.items():
+        items.sort(key=lambda a: (a["start_min"], a["end_min"]))
+        for prev, nxt in zip(items, items[1:]):
+            prev_design, _ = task_info.get(prev["task_id"], (None, None))
+            design, operation = task_info.get(nxt["task_id"], (None, None))
+            setup = setup_times.between(r_id, prev_design, operation, design)
+            if not setup:
+                continue
+            count += 1
+            minutes += setup
+            if nxt["start_min"] - prev["end_min"] < setup:
+                violations.append({"machine_id": r_id, "task_id": nxt["task_id"], "after": prev["task_id"],
+                                   "gap": nxt["start_min"] - prev["end_min"], "setup": setup})
+    if violations:
+        logger.warning("schedule misses changeover time", extra={
+            "violations": len(violations), "sample": violations[:5],
+        })
+    return {"count": count, "minutes": minutes, "violations": len(violations)}
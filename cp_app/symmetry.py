@@ -0,0 +1,113 @@
+import heapq
+import logging
+from typing import Dict, List, Any, Optional, Set
+
+from .tables import merge_calendar
+
+logger = logging.getLogger(__name__)
+
+POOL_PREFIX = "POOL:"
+
+
+def _calendar(r: Dict[str, Any]):
+    """Lịch nghỉ đã gộp (tuple) để so sánh hai máy có cùng lịch hay không"""
+    return merge_calendar((int(w["start"]), int(w["end"])) for w in r.get("unavailability", []))
+
+
+def machine_equivalence_classes(resources: List[Dict[str, Any]], tasks: List[Dict[str, Any]],
+                                frozen: Optional[Dict[str, Dict[str, Any]]] = None,
+                                setup_tables: Optional[Dict[str, Any]] = None) -> List[List[str]]:
+    """
+    Nhóm các máy hoán đổi được cho nhau: cùng type / capacity / operation, cùng lịch nghỉ,
+    cùng tập task tương thích và cùng bảng setup (`setup_tables`: máy -> bảng so sánh được).
+    Máy đang giữ task frozen bị loại vì không còn đối xứng.
+    Chỉ trả về các lớp có từ 2 máy trở lên, máy trong lớp giữ thứ tự của payload.
+    """
+    frozen = frozen or {}
+    setup_tables = setup_tables or {}
+    frozen_machines = {a["machine_id"] for a in frozen.values()}
+    resource_ids = {r["id"] for r in resources}
+
+    compatible_tasks: Dict[str, List[str]] = {r_id: [] for r_id in resource_ids}
+    for t in tasks:
+        t_id = t.get("task_id")
+        if not t_id or t_id in frozen:
+            continue
+        for r_id in t.get("compatible_resource_ids") or []:
+            if r_id in compatible_tasks:
+                compatible_tasks[r_id].append(t_id)
+
+    classes: Dict[Any, List[str]] = {}
+    for r in resources:
+        r_id = r["id"]
+        if r_id in frozen_machines or not compatible_tasks[r_id]:
+            continue
+        signature = (
+            r.get("type"), int(r.get("capacity") or 1), r.get("operation"),
+            _calendar(r), tuple(sorted(compatible_tasks[r_id])), setup_tables.get(r_id),
+        )
+        classes.setdefault(signature, []).append(r_id)
+    return [members for members in classes.values() if len(members) > 1]
+
+
+def poolable(members: List[str], tasks: List[Dict[str, Any]], resource_map: Dict[str, Dict[str, Any]]) -> bool:
+    """
+    Một lớp máy serial gộp được thành một cumulative capacity = số máy khi không task nào
+    của lớp bị ràng buộc cùng máy với slice khác (internal_dep): khi đó mọi lịch thoả
+    cumulative đều chia lại được về từng máy bằng tô màu khoảng (interval graph).
+    """
+    if any(resource_map[r_id].get("type") == "batch" or resource_map[r_id].get("operation") == "washing"
+           for r_id in members):
+        return False
+    member_set = set(members)
+    class_tasks: Set[str] = {
+        t["task_id"] for t in tasks
+        if t.get("task_id") and member_set & set(t.get("compatible_resource_ids") or [])
+    }
+    for t in tasks:
+        prev_id = t.get("internal_dep")
+        if prev_id and (t.get("task_id") in class_tasks or prev_id in class_tasks):
+            return False
+    return True
+
+
+def assign_pooled_machines(assignments: List[Dict[str, Any]], pools: Dict[str, List[str]]) -> None:
+    """
+    Đổi machine_id dạng "POOL:<i>" về máy cụ thể trong lớp: xếp task theo start,
+    gán cho máy rảnh sớm nhất (tô màu interval graph, không cần quá số máy của lớp).
+    """
+    by_pool: Dict[str, List[Dict[str, Any]]] = {}
+    for a in assignments:
+        if str(a["machine_id"]).startswith(POOL_PREFIX):
+            by_pool.setdefault(a["machine_id"], []).append(a)
+
+    for pool_id, items in by_pool.items():
+        free = [(0, i, r_id) for i, r_id in enumerate(pools[pool_id])]
+        heapq.heapify(free)
+        for a in sorted(items, key=lambda x: (x["start_min"], x["end_min"])):
+            free_at, i, r_id = heapq.heappop(free)
+            if free_at > a["start_min"]:
+                logger.error("logic error: pool over capacity", extra={"pool_id": pool_id, "at": a["start_min"]})
+            a["machine_id"] = r_id
+            heapq.heappush(free, (a["end_min"], i, r_id))
+
+
+def canonical_hints(hints: Dict[str, Dict[str, Any]], classes: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Đánh lại tên máy trong hint theo thứ tự xuất hiện trong từng lớp (task đầu tiên dùng
+    máy đầu của lớp, ...), để hint vẫn thoả ràng buộc phá đối xứng của chế độ "break".
+    `classes` là danh sách (máy của lớp, task của lớp theo thứ tự trong model).
+    """
+    result = dict(hints)
+    for members, task_ids in classes:
+        member_set = set(members)
+        relabel: Dict[str, str] = {}
+        for t_id in task_ids:
+            hint = result.get(t_id)
+            if not hint or hint.get("machine_id") not in member_set:
+                continue
+            machine_id = hint["machine_id"]
+            if machine_id not in relabel:
+                relabel[machine_id] = members[len(relabel)]
+            result[t_id] = {**hint, "machine_id": relabel[machine_id]}
+    return result
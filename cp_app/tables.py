@@ -0,0 +1,143 @@
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+
+def merge_calendar(windows) -> Tuple[Tuple[int, int], ...]:
+    """Gộp các khoảng (start, end) giao nhau hoặc kề nhau, bỏ khoảng rỗng, sắp theo start"""
+    merged: List[List[int]] = []
+    for start, end in sorted(windows):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return tuple((start, end) for start, end in merged)
+
+
+def _field(d: Dict[str, Any], name: str, legacy: str, default=None):
+    """Đọc field theo tên snake_case, fallback tên CamelCase cũ"""
+    value = d.get(name)
+    if not value:
+        value = d.get(legacy)
+    return value if value else default
+
+
+class ProblemTables:
+    """
+    Bảng chuẩn hoá của payload, dựng một lần trước khi build model.
+
+    Task và resource được đánh chỉ số nguyên theo thứ tự trong payload. Thuộc tính số
+    (duration, release, due, priority, demand) là mảng NumPy; máy tương thích và phụ thuộc
+    lưu dạng CSR: các phần tử của task i nằm trong `idx[ptr[i]:ptr[i + 1]]`.
+
+    - `compat_ptr` / `compat_idx`: chỉ số resource tương thích (bỏ ID không có trong payload,
+      bỏ trùng, giữ thứ tự).
+    - `dep_ptr` / `dep_idx`: chỉ số task cha theo `final_depends_on` (chỉ cha có trong payload);
+      `dep_is_start[k]` / `dep_lag[k]` cho cạnh interleaved batching (start con >= start cha + lag),
+      ngược lại là cạnh end -> start.
+    - `internal_dep[i]`: chỉ số slice trước (-1 nếu không có).
+    - `due[i]` = 0 nếu task không có hạn.
+    - `calendars`: các lịch nghỉ khác nhau (đã gộp khoảng giao / kề nhau), `calendar_id[j]` là
+      lịch của resource j; `unavailability[j]` = `calendars[calendar_id[j]]`.
+    """
+
+    def __init__(self, payload: Dict[str, Any]):
+        resources = payload.get("resources", [])
+        self.resource_ids: List[str] = [r["id"] for r in resources]
+        self.resource_index: Dict[str, int] = {r_id: j for j, r_id in enumerate(self.resource_ids)}
+        self.resources: List[Dict[str, Any]] = list(resources)
+        self.resource_by_id: Dict[str, Dict[str, Any]] = dict(zip(self.resource_ids, self.resources))
+        self.capacity = np.array([int(r.get("capacity", 100)) for r in resources], dtype=np.int64)
+        self.cumulative = np.array(
+            [r.get("type") == "batch" or r.get("operation") == "washing" for r in resources], dtype=bool
+        )
+        # Máy cùng lịch nghỉ dùng chung một bản lịch
+        self.calendars: List[Tuple[Tuple[int, int], ...]] = []
+        calendar_index: Dict[Tuple[Tuple[int, int], ...], int] = {}
+        calendar_id: List[int] = []
+        for r in resources:
+            calendar = merge_calendar((int(w["start"]), int(w["end"])) for w in r.get("unavailability", []))
+            if calendar not in calendar_index:
+                calendar_index[calendar] = len(self.calendars)
+                self.calendars.append(calendar)
+            calendar_id.append(calendar_index[calendar])
+        self.calendar_id = np.array(calendar_id, dtype=np.int64)
+        self.unavailability: List[Tuple[Tuple[int, int], ...]] = [self.calendars[c] for c in calendar_id]
+        self.raw_window_count = sum(len(r.get("unavailability", [])) for r in resources)
+
+        tasks = [t for t in payload.get("tasks", []) if t.get("task_id") or t.get("TaskID")]
+        self.task_ids: List[str] = [t.get("task_id") or t.get("TaskID") for t in tasks]
+        self.task_index: Dict[str, int] = {t_id: i for i, t_id in enumerate(self.task_ids)}
+
+        self.order_ids: List[Optional[str]] = [_field(t, "original_order_id", "OriginalOrderID") for t in tasks]
+        # Mã hàng / công đoạn: tra thời gian chuyển đổi (setup) giữa hai task liên tiếp trên máy
+        self.design_ids: List[Optional[str]] = [_field(t, "design_item_id", "DesignItemID") for t in tasks]
+        self.operations: List[Optional[str]] = [_field(t, "operation", "Operation") for t in tasks]
+        self.duration = np.array([int(_field(t, "duration", "Duration", 0)) for t in tasks], dtype=np.int64)
+        self.release = np.array([int(_field(t, "start_after_min", "StartAfterMin", 0)) for t in tasks], dtype=np.int64)
+        self.due = np.array([int(_field(t, "due_at_min", "DueAtMin", 0)) for t in tasks], dtype=np.int64)
+        self.priority = np.array([int(_field(t, "priority", "Priority", 3)) for t in tasks], dtype=np.int64)
+        self.can_pause = np.array([bool(_field(t, "can_pause", "CanPause", False)) for t in tasks], dtype=bool)
+        self.demand = np.array([
+            int(_field(t, "qty", "Qty", 1)) if _field(t, "is_batch", "IsBatch", False) else 1 for t in tasks
+        ], dtype=np.int64)
+
+        compat_ptr = [0]
+        compat_idx: List[int] = []
+        # task index -> ID máy tương thích không có trong resources (bị bỏ qua)
+        self.unknown_resource_refs: Dict[int, List[str]] = {}
+        for i, t in enumerate(tasks):
+            seen = set()
+            for r_id in _field(t, "compatible_resource_ids", "CompatibleResourceIDs", []):
+                j = self.resource_index.get(r_id)
+                if j is None:
+                    self.unknown_resource_refs.setdefault(i, []).append(r_id)
+                elif j not in seen:
+                    seen.add(j)
+                    compat_idx.append(j)
+            compat_ptr.append(len(compat_idx))
+        self.compat_ptr = np.array(compat_ptr, dtype=np.int64)
+        self.compat_idx = np.array(compat_idx, dtype=np.int64)
+
+        dep_ptr = [0]
+        dep_idx: List[int] = []
+        dep_lag: List[int] = []
+        dep_is_start: List[bool] = []
+        internal_dep: List[int] = []
+        for i, t in enumerate(tasks):
+            child_order_id = self.order_ids[i]
+            for parent_id in _field(t, "final_depends_on", "FinalDependsOn", []):
+                p = self.task_index.get(parent_id)
+                if p is None:
+                    continue
+                offsets = _field(tasks[p], "sub_task_completion_offsets", "SubTaskCompletionOffsets", {})
+                dep_idx.append(p)
+                if offsets and child_order_id and child_order_id in offsets:
+                    dep_is_start.append(True)
+                    dep_lag.append(int(offsets[child_order_id]))
+                else:
+                    dep_is_start.append(False)
+                    dep_lag.append(0)
+            dep_ptr.append(len(dep_idx))
+
+            prev_id = _field(t, "internal_dep", "InternalDep")
+            internal_dep.append(self.task_index.get(prev_id, -1) if prev_id else -1)
+        self.dep_ptr = np.array(dep_ptr, dtype=np.int64)
+        self.dep_idx = np.array(dep_idx, dtype=np.int64)
+        self.dep_lag = np.array(dep_lag, dtype=np.int64)
+        self.dep_is_start = np.array(dep_is_start, dtype=bool)
+        self.internal_dep = np.array(internal_dep, dtype=np.int64)
+
+    @property
+    def n_tasks(self) -> int:
+        return len(self.task_ids)
+
+    def compatible(self, i: int) -> np.ndarray:
+        """Chỉ số resource tương thích của task i"""
+        return self.compat_idx[self.compat_ptr[i]:self.compat_ptr[i + 1]]
+
+    def parents(self, i: int) -> range:
+        """Vị trí (trong dep_idx / dep_lag / dep_is_start) các cạnh cha của task i"""
+        return range(int(self.dep_ptr[i]), int(self.dep_ptr[i + 1]))
@@ -1,9 +1,28 @@
-import requests
+import logging
 import os
-from .celery_app import celery_app
+import time
+from celery.signals import task_revoked
+from .celery_app import celery_app, REDIS_URL
 from .engine import Engine
+from .hints import get_hint_store, hint_key_for
+from .progress import RedisProgressPublisher
+from .control import RedisCancellation
+from .cache import RESULT_CACHE_ENABLED, ResultCache
+from .routing import apply_cpu_budget
+from .governor import SolveAttempts, govern, govern_scenarios, rejection
+from .blobs import BlobStore, result_key
+from .delivery import enqueue_delivery
+from .observability import JOBS_TOTAL, phase
+from .recorder import PayloadRecorder
+from . import replan, scenarios
+
+logger = logging.getLogger(__name__)
+
+SOLVE_TASK_NAMES = ("optimize_schedule", "resolve_schedule", "solve_scenarios")
+# Kết quả được cache: lời giải CP-SAT trên model đầy đủ (bớt worker vẫn giải cùng model)
+CACHEABLE_SOLVER_STATUSES = ("OPTIMAL", "FEASIBLE")
+CACHEABLE_MEMORY_ACTIONS = ("full", "reduce_workers")
 
-WEBHOOK_URL = os.getenv("WEBHOOK_URL", "http://backend:8082/api/webhook/solver")
 
 def filter_dummy_tasks(assignments):
     """
@@ -41,46 +60,395 @@ def filter_dummy_overloads(overloads):
             
     return cleaned_overloads
 
+def _save_hints(hint_store, hint_key, result, assignments):
+    if hint_store and result["status"] == "feasible":
+        try:
+            hint_store.save(hint_key, assignments)
+        except Exception as e:
+            logger.warning("could not save hints", extra={"error": str(e)})
+
+def _response_data(celery_task_id, job_id, result, clean_assignments, clean_overloads):
+    return {
+        "job_id": job_id,
+        "task_id": celery_task_id,
+        "status": result["status"],
+        "assignments": clean_assignments,
+        "overloads": clean_overloads,
+        "hints": result.get("hints"),
+        "stop_reason": result.get("stop_reason"),
+        "solver_status": result.get("solver_status"),
+        "diagnostics": result.get("diagnostics"),
+        "solver_stats": result.get("stats")
+    }
+
+def _send_result(celery_task_id, job_id, result, clean_assignments, clean_overloads):
+    response_data = _response_data(celery_task_id, job_id, result, clean_assignments, clean_overloads)
+    return deliver_response(celery_task_id, response_data)
+
+def deliver_response(celery_task_id, response_data):
+    """Lưu kết quả rồi xếp webhook vào hàng đợi gửi; worker quay lại giải ngay"""
+    result_ref = _store_result(celery_task_id, response_data)
+    enqueue_delivery(f"{celery_task_id}:{response_data.get('job_id')}", result_ref=result_ref,
+                     message=None if result_ref else response_data)
+    return "Result saved, delivery queued"
+
+def _send_failure(celery_task_id, job_id, e, store=True):
+    logger.error("job failed", extra={"job_id": job_id, "error": str(e)})
+    message = {
+        "job_id": job_id,
+        "task_id": celery_task_id,
+        "status": "failed",
+        "error": str(e)
+    }
+    if store:
+        _store_result(celery_task_id, message)
+    try:
+        enqueue_delivery(f"{celery_task_id}:{job_id}:failed", message=message)
+    except Exception as delivery_error:
+        logger.error("could not queue failure webhook", extra={"error": str(delivery_error)})
+
+def _blob_store():
+    try:
+        return BlobStore.from_url(REDIS_URL)
+    except Exception as e:
+        logger.warning("blob store unavailable", extra={"error": str(e)})
+        return None
+
+def _load_ref(payload, payload_ref):
+    """Payload truyền thẳng (kiểu cũ) hoặc đọc từ blob Redis theo key tham chiếu"""
+    if payload is not None:
+        return payload
+    with phase("load_payload"):
+        payload = BlobStore.from_url(REDIS_URL).get(payload_ref)
+    if payload is None:
+        raise ValueError(f"Payload {payload_ref} not found (expired?)")
+    return payload
+
+def _store_result(celery_task_id, response_data):
+    """Lưu kết quả (msgpack + zstd) để đọc lại theo task ID; trả về key, None nếu không lưu được"""
+    store = _blob_store()
+    if not store:
+        return None
+    try:
+        with phase("store_result"):
+            size = store.put(result_key(celery_task_id), response_data)
+        logger.info("result stored", extra={"key": result_key(celery_task_id), "bytes": size})
+        return result_key(celery_task_id)
+    except Exception as e:
+        logger.warning("could not store result", extra={"error": str(e)})
+        return None
+
+def _load_hints(payload):
+    """Warm-start: lấy lịch đã chấp nhận lần trước làm hint"""
+    hint_store = None
+    hint_key = hint_key_for(payload)
+    hints = {}
+    try:
+        hint_store = get_hint_store()
+        if hint_store:
+            task_ids = [t.get("task_id") for t in payload.get("tasks", []) if t.get("task_id")]
+            hints = hint_store.load(hint_key, task_ids)
+    except Exception as e:
+        logger.warning("hint store unavailable", extra={"error": str(e)})
+    return hint_store, hint_key, hints
+
+def _with_cpu_budget(payload):
+    """Payload với `num_search_workers` theo ngân sách CPU của host (chia cho concurrency worker)"""
+    concurrency = _worker_concurrency()
+    config = apply_cpu_budget(payload.get("config") or {}, concurrency)
+    logger.info("cpu budget", extra={"num_search_workers": config["num_search_workers"], "concurrency": concurrency})
+    return dict(payload, config=config)
+
+def _worker_concurrency():
+    return celery_app.conf.worker_concurrency or os.cpu_count()
+
+def _solve_attempts():
+    try:
+        return SolveAttempts(REDIS_URL)
+    except Exception as e:
+        logger.warning("attempt tracking unavailable", extra={"error": str(e)})
+        return None
+
+def _start_attempt(attempts, celery_task_id):
+    """True nếu lần giao trước của task này bị ngắt giữa chừng (VD process bị kill vì OOM)"""
+    if not attempts:
+        return False
+    try:
+        return not attempts.start(celery_task_id)
+    except Exception as e:
+        logger.warning("could not mark solve attempt", extra={"error": str(e)})
+        return False
+
+def _finish_attempt(attempts, celery_task_id):
+    if attempts:
+        try:
+            attempts.finish(celery_task_id)
+        except Exception as e:
+            logger.warning("could not clear solve attempt", extra={"error": str(e)})
+
+def _with_memory_budget(payload, redelivered=False, allow_decompose=True):
+    """
+    Payload vừa ngân sách bộ nhớ của một lời giải (governor) và kế hoạch đã chọn. Job được giao
+    lại sau khi làm sập worker chỉ chạy heuristic, không dựng lại model đã gây OOM.
+    """
+    if redelivered:
+        logger.warning("job redelivered after an interrupted solve, running heuristic only")
+        payload = dict(payload, config=dict(payload.get("config") or {}, mode="heuristic"))
+    payload, plan = govern(payload, _worker_concurrency(), allow_decompose=allow_decompose)
+    if redelivered:
+        plan["redelivered"] = True
+    return payload, plan
+
+def _send_rejection(publisher, celery_task_id, job_id, plan, task_name):
+    """Job vượt ngân sách bộ nhớ: trả trạng thái "rejected" (không raise, để job không bị giao lại)"""
+    result = rejection(plan)
+    _publish_done(publisher, result)
+    response_data = dict(_response_data(celery_task_id, job_id, result, [], []), error=result["error"])
+    status = deliver_response(celery_task_id, response_data)
+    JOBS_TOTAL.labels(task=task_name, status="rejected").inc()
+    return status, response_data
+
+def _record_payload(celery_task_id, payload, hints, result, seconds):
+    """Ghi payload + kết quả cho replay offline (RECORD_PAYLOADS=1); lỗi ghi không làm hỏng job"""
+    try:
+        recorder = PayloadRecorder.from_env()
+        if recorder:
+            recorder.record(payload, result, seconds, celery_task_id=celery_task_id, hints=hints)
+    except Exception as e:
+        logger.warning("could not record payload", extra={"error": str(e)})
+
+def _progress_publisher(celery_task_id):
+    try:
+        return RedisProgressPublisher(REDIS_URL, celery_task_id)
+    except Exception as e:
+        logger.warning("progress publisher unavailable", extra={"error": str(e)})
+        return None
+
+def _publish_done(publisher, result):
+    if publisher:
+        publisher.publish({
+            "type": "done",
+            "status": result["status"],
+            "objective": result.get("objective_value"),
+        })
+
+def _publish_failed(publisher, e):
+    if publisher:
+        publisher.publish({"type": "failed", "error": str(e)})
+
+def _result_cache():
+    if not RESULT_CACHE_ENABLED:
+        return None
+    try:
+        return ResultCache.from_url(REDIS_URL)
+    except Exception as e:
+        logger.warning("result cache unavailable", extra={"error": str(e)})
+        return None
+
+def _cacheable(response_data, should_cancel=None):
+    """
+    Chỉ cache lời giải CP-SAT đầy đủ: không phải lịch heuristic (CP-SAT UNKNOWN, chạy lại sau khi
+    worker sập), không bị governor hạ cấp (rolling horizon / heuristic), không dở dang vì bị huỷ
+    """
+    memory = (response_data.get("solver_stats") or {}).get("memory") or {}
+    return (response_data["status"] == "feasible"
+            and response_data.get("solver_status") in CACHEABLE_SOLVER_STATUSES
+            and memory.get("action", "full") in CACHEABLE_MEMORY_ACTIONS and not memory.get("redelivered")
+            and response_data.get("stop_reason") != "cancelled" and not (should_cancel and should_cancel()))
+
+def _finish_cached(fingerprint, response_data, should_cancel=None):
+    """Lưu kết quả vào cache và gửi cho các job trùng đã gộp vào task này"""
+    cache = _result_cache() if fingerprint else None
+    if not cache:
+        return
+    try:
+        if _cacheable(response_data, should_cancel):
+            cache.put(fingerprint, response_data)
+        waiters = cache.finish_inflight(fingerprint)
+    except Exception as e:
+        logger.warning("could not update result cache", extra={"error": str(e)})
+        return
+    task_id = response_data["task_id"]
+    for job_id in waiters:
+        if job_id != response_data["job_id"]:
+            enqueue_delivery(f"{task_id}:{job_id}", job_id=job_id, result_ref=result_key(task_id))
+
+def send_cancelled(celery_task_id, job_id):
+    """Báo job bị huỷ trước khi được giải (không có lịch)"""
+    message = {
+        "job_id": job_id,
+        "task_id": celery_task_id,
+        "status": "cancelled",
+        "stop_reason": "cancelled",
+        "assignments": [],
+        "overloads": [],
+    }
+    enqueue_delivery(f"{celery_task_id}:{job_id}:cancelled", message=message)
+
+@task_revoked.connect
+def _after_revoke(sender=None, request=None, **extra):
+    """
+    Task bị revoke khi còn trong hàng đợi không bao giờ chạy: bỏ đánh dấu in-flight (job trùng
+    sau đó không gộp vào task chết) và báo "cancelled" cho job cùng các job đã gộp vào nó
+    """
+    if request is None or getattr(sender, "name", None) not in SOLVE_TASK_NAMES:
+        return
+    # Chỉ có header của message (kwargs chưa được giải mã): job_id / fingerprint do API gắn vào header
+    celery_task_id = request.id
+    fingerprint = getattr(request, "fingerprint", None)
+    job_ids = [getattr(request, "job_id", None)]
+    try:
+        cache = _result_cache() if fingerprint else None
+        if cache:
+            job_ids += cache.finish_inflight(fingerprint)
+        publisher = _progress_publisher(celery_task_id)
+        if publisher:
+            publisher.publish({"type": "done", "status": "cancelled"})
+        for job_id in dict.fromkeys(j for j in job_ids if j):
+            send_cancelled(celery_task_id, job_id)
+    except Exception as e:
+        logger.error("could not report revoked task", extra={"celery_task_id": celery_task_id, "error": str(e)})
+    JOBS_TOTAL.labels(task=sender.name, status="cancelled").inc()
+
 @celery_app.task(bind=True, name="optimize_schedule")
-def optimize_schedule(self, payload: dict):
+def optimize_schedule(self, payload: dict = None, fingerprint: str = None, payload_ref: str = None,
+                      job_id: str = None):
+    publisher = _progress_publisher(self.request.id)
+    job_id = job_id or (payload or {}).get("job_id")
+    attempts = _solve_attempts()
     try:
-        print(f"[Task {self.request.id}] Starting...")
+        logger.info("solve started")
+        redelivered = _start_attempt(attempts, self.request.id)
+        payload = _load_ref(payload, payload_ref)
+        job_id = payload.get("job_id")
 
-        engine = Engine(payload)
+        payload, memory = _with_memory_budget(_with_cpu_budget(payload), redelivered)
+        if memory["action"] == "reject":
+            status, response_data = _send_rejection(publisher, self.request.id, job_id, memory, self.name)
+            _finish_cached(fingerprint, response_data)
+            return status
+
+        hint_store, hint_key, hints = _load_hints(payload)
+
+        should_cancel = RedisCancellation(REDIS_URL, self.request.id)
+        engine = Engine(payload, hints=hints, progress=publisher.publish if publisher else None,
+                        should_cancel=should_cancel)
+        started = time.perf_counter()
         result = engine.solve()
+        result.setdefault("stats", {})["memory"] = memory
+        _publish_done(publisher, result)
+        _record_payload(self.request.id, payload, hints, result, time.perf_counter() - started)
         
         raw_assignments = result.get("assignments", [])
         overloads = result.get("overloads", [])
         clean_assignments = filter_dummy_tasks(raw_assignments)
         clean_overloads = filter_dummy_overloads(overloads)
-        response_data = {
-            "job_id": payload.get("job_id"),
-            "task_id": self.request.id,
-            "status": result["status"],
-            "assignments": clean_assignments,
-            "overloads": clean_overloads
-        }
 
-        print(f"Sending back to main service: {WEBHOOK_URL}")
-
-        print(f"Response Data: {response_data}")
-        
-        resp = requests.post(WEBHOOK_URL, json=response_data, timeout=10)
-        
-        if resp.status_code == 200:
-            return "Callback Successful"
-        else:
-            print(f"⚠️ Callback Failed: {resp.text}")
-            return "Callback Failed"
+        _save_hints(hint_store, hint_key, result, clean_assignments)
+        response_data = _response_data(self.request.id, job_id, result, clean_assignments, clean_overloads)
+        status = deliver_response(self.request.id, response_data)
+        _finish_cached(fingerprint, response_data, should_cancel)
+        JOBS_TOTAL.labels(task=self.name, status=result["status"]).inc()
+        return status
 
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        _publish_failed(publisher, e)
+        _send_failure(self.request.id, job_id, e)
+        JOBS_TOTAL.labels(task=self.name, status="failed").inc()
+        if fingerprint:
+            cache = _result_cache()
+            for waiter in (cache.finish_inflight(fingerprint) if cache else []):
+                if waiter != job_id:
+                    _send_failure(self.request.id, waiter, e, store=False)
+        raise e
+    finally:
+        _finish_attempt(attempts, self.request.id)
+
+@celery_app.task(bind=True, name="resolve_schedule")
+def resolve_schedule(self, request: dict = None, request_ref: str = None, job_id: str = None):
+    """Re-plan từ lịch gốc + delta, giữ nguyên phần đã chạy / đóng băng"""
+    publisher = _progress_publisher(self.request.id)
+    job_id = job_id or (request or {}).get("job_id")
+    attempts = _solve_attempts()
+    try:
+        logger.info("re-plan started")
+        redelivered = _start_attempt(attempts, self.request.id)
+        request = _load_ref(request, request_ref)
+        job_id = request.get("job_id")
+        # Task đã chốt là hằng số trong model: không chia cửa sổ rolling horizon
+        base, memory = _with_memory_budget(_with_cpu_budget(request["base"]), redelivered, allow_decompose=False)
+        if memory["action"] == "reject":
+            return _send_rejection(publisher, self.request.id, job_id, memory, self.name)[0]
+        request = dict(request, base=base)
+
+        result = replan.resolve_schedule(request, progress=publisher.publish if publisher else None,
+                                         should_cancel=RedisCancellation(REDIS_URL, self.request.id))
+        _publish_done(publisher, result)
+
+        clean_assignments = filter_dummy_tasks(result.get("assignments", []))
+        clean_overloads = filter_dummy_overloads(result.get("overloads", []))
+
         try:
-            requests.post(WEBHOOK_URL, json={
-                "job_id": payload.get("job_id"),
-                "status": "failed",
-                "error": str(e)
-            }, timeout=5)
-        except:
-            pass
-        raise e
\ No newline at end of file
+            hint_store = get_hint_store()
+        except Exception as e:
+            logger.warning("hint store unavailable", extra={"error": str(e)})
+            hint_store = None
+        _save_hints(hint_store, hint_key_for(request["base"]), result, clean_assignments)
+        status = _send_result(self.request.id, job_id, result, clean_assignments, clean_overloads)
+        JOBS_TOTAL.labels(task=self.name, status=result["status"]).inc()
+        return status
+
+    except Exception as e:
+        _publish_failed(publisher, e)
+        _send_failure(self.request.id, job_id, e)
+        JOBS_TOTAL.labels(task=self.name, status="failed").inc()
+        raise e
+    finally:
+        _finish_attempt(attempts, self.request.id)
+
+@celery_app.task(bind=True, name="solve_scenarios")
+def solve_scenarios(self, request: dict = None, request_ref: str = None, job_id: str = None):
+    """What-if: giải payload gốc và các kịch bản trên model dựng chung, trả một báo cáo so sánh"""
+    publisher = _progress_publisher(self.request.id)
+    job_id = job_id or (request or {}).get("job_id")
+    attempts = _solve_attempts()
+    try:
+        logger.info("scenarios started")
+        redelivered = _start_attempt(attempts, self.request.id)
+        request = _load_ref(request, request_ref)
+        job_id = request.get("job_id")
+        base, memory = govern_scenarios(_with_cpu_budget(request["base"]), len(request.get("scenarios") or []) + 1,
+                                        _worker_concurrency())
+        if redelivered:
+            # Kịch bản luôn giải bằng CP-SAT trên model chung (không có chế độ heuristic): không thử lại
+            logger.warning("what-if batch redelivered after an interrupted solve, rejecting")
+            memory = dict(memory, action="reject", redelivered=True)
+        if memory["action"] == "reject":
+            return _send_rejection(publisher, self.request.id, job_id, memory, self.name)[0]
+        _, _, hints = _load_hints(base)
+
+        report = scenarios.solve_scenarios(
+            base, request.get("scenarios") or [], hints=hints,
+            progress=publisher.publish if publisher else None,
+            should_cancel=RedisCancellation(REDIS_URL, self.request.id),
+            include_assignments=request.get("include_assignments", True),
+        )
+        if publisher:
+            publisher.publish({"type": "done", "status": report["status"], "ranking": report["comparison"]["ranking"]})
+        for s in report["scenarios"]:
+            if "assignments" in s:
+                s["assignments"] = filter_dummy_tasks(s["assignments"])
+                s["overloads"] = filter_dummy_overloads(s["overloads"])
+
+        response_data = {"job_id": job_id, "task_id": self.request.id, **report}
+        status = deliver_response(self.request.id, response_data)
+        JOBS_TOTAL.labels(task=self.name, status=report["status"]).inc()
+        return status
+
+    except Exception as e:
+        _publish_failed(publisher, e)
+        _send_failure(self.request.id, job_id, e)
+        JOBS_TOTAL.labels(task=self.name, status="failed").inc()
+        raise e
+    finally:
+        _finish_attempt(attempts, self.request.id)
@@ -0,0 +1,156 @@
+import bisect
+import logging
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from .analysis import OPEN_END
+from .tables import merge_calendar
+
+logger = logging.getLogger(__name__)
+
+# Config nội bộ của payload đã nén: các mốc giờ nghỉ trên trục phút làm việc
+WORKING_TIME_BREAKS_KEY = "working_time_breaks"
+
+
+class WorkingCalendar:
+    """
+    Ánh xạ giữa phút thực (wall-clock) và phút làm việc của một lịch nghỉ:
+    phút làm việc = phút thực - tổng phút nghỉ trước đó. Mỗi giờ nghỉ co lại
+    thành một mốc (`break_points`) trên trục phút làm việc. Giờ nghỉ giao nhau / kề nhau
+    được gộp trước (`merge_calendar`), nên các mốc tăng ngặt.
+    """
+
+    def __init__(self, windows: Tuple[Tuple[int, int], ...]):
+        windows = merge_calendar(windows)
+        self.starts = [start for start, _ in windows]
+        self.ends = [end for _, end in windows]
+        # before[k] = tổng phút nghỉ của k giờ nghỉ đầu tiên
+        self.before = [0]
+        for start, end in windows:
+            self.before.append(self.before[-1] + end - start)
+        self.break_points = [start - self.before[k] for k, start in enumerate(self.starts)]
+
+    def to_working(self, t: int) -> int:
+        k = bisect.bisect_right(self.starts, t) - 1
+        if k < 0:
+            return t
+        if t < self.ends[k]:
+            # Rơi vào giờ nghỉ -> mốc của giờ nghỉ đó
+            return self.starts[k] - self.before[k]
+        return t - self.before[k + 1]
+
+    def to_wall_start(self, w: int) -> int:
+        # Start đúng tại mốc nghỉ -> bắt đầu sau giờ nghỉ
+        return w + self.before[bisect.bisect_right(self.break_points, w)]
+
+    def to_wall_end(self, w: int) -> int:
+        # End đúng tại mốc nghỉ -> kết thúc trước giờ nghỉ
+        return w + self.before[bisect.bisect_left(self.break_points, w)]
+
+
+def segment_start_intervals(break_points: List[int], duration: int) -> List[Tuple[int, int]]:
+    """Start hợp lệ (trục phút làm việc) cho task không được tạm dừng qua giờ nghỉ"""
+    intervals = []
+    current = 0
+    for point in break_points:
+        if point - current >= duration:
+            intervals.append((current, point - duration))
+        current = max(current, point)
+    intervals.append((current, OPEN_END))
+    return intervals
+
+
+def crossing_break(break_points: List[int], start: int, duration: int) -> Optional[int]:
+    """Mốc nghỉ đầu tiên nằm hẳn bên trong (start, start + duration), None nếu không có"""
+    k = bisect.bisect_right(break_points, start)
+    if k < len(break_points) and break_points[k] < start + duration:
+        return break_points[k]
+    return None
+
+
+def shared_calendar(payload: Dict[str, Any]) -> Optional[Tuple[Tuple[int, int], ...]]:
+    """Lịch nghỉ chung của mọi máy được task dùng tới (None nếu các máy khác lịch)"""
+    used = {r_id for t in payload.get("tasks", []) for r_id in (t.get("compatible_resource_ids") or [])}
+    calendars = {
+        merge_calendar((int(w["start"]), int(w["end"])) for w in r.get("unavailability", []))
+        for r in payload.get("resources", []) if r["id"] in used
+    }
+    return calendars.pop() if len(calendars) == 1 else None
+
+
+def compress_payload(payload: Dict[str, Any], calendar: WorkingCalendar) -> Dict[str, Any]:
+    """Payload trên trục phút làm việc: máy không còn giờ nghỉ, release / due đổi sang phút làm việc"""
+    config = {k: v for k, v in (payload.get("config") or {}).items() if k != "time_mode"}
+    config[WORKING_TIME_BREAKS_KEY] = calendar.break_points
+    # Task không tạm dừng được chỉ giữ ràng buộc qua miền start (cần phân tích đường găng)
+    config["tighten_domains"] = True
+    compressed = dict(payload, config=config)
+    compressed["resources"] = [dict(r, unavailability=[]) for r in payload.get("resources", [])]
+    compressed["tasks"] = [dict(t) for t in payload.get("tasks", [])]
+    for t in compressed["tasks"]:
+        if t.get("start_after_min"):
+            t["start_after_min"] = calendar.to_working(int(t["start_after_min"]))
+        if t.get("due_at_min"):
+            t["due_at_min"] = calendar.to_working(int(t["due_at_min"]))
+    return compressed
+
+
+def _to_working_schedule(schedule: Dict[str, Dict[str, Any]], calendar: WorkingCalendar):
+    converted = {}
+    for t_id, a in schedule.items():
+        a = dict(a)
+        for field in ("start_min", "end_min"):
+            if field in a:
+                a[field] = calendar.to_working(int(a[field]))
+        converted[t_id] = a
+    return converted
+
+
+def expand_assignments(assignments: List[Dict[str, Any]], calendar: WorkingCalendar) -> None:
+    for a in assignments:
+        a["start_min"] = calendar.to_wall_start(a["start_min"])
+        a["end_min"] = calendar.to_wall_end(a["end_min"])
+
+
+def solve_working_time(payload: Dict[str, Any], frozen: Optional[Dict[str, Dict[str, Any]]] = None,
+                       hints: Optional[Dict[str, Dict[str, Any]]] = None,
+                       progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       should_cancel: Optional[Callable[[], bool]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Chế độ `time_mode: "working"`: giải trên trục phút làm việc (giờ nghỉ bị nén đi nên
+    không còn interval giờ nghỉ nào), rồi đổi start / end về phút thực. Task có `can_pause`
+    được chạy vắt qua giờ nghỉ (duration tính theo phút làm việc); task khác phải nằm trọn
+    trong một khoảng làm việc.
+
+    Chỉ áp dụng khi mọi máy dùng chung một lịch nghỉ; trả None nếu không áp dụng được.
+    Lag interleaved batching và độ trễ trong objective được tính theo phút làm việc.
+    """
+    from .engine import Engine
+
+    windows = shared_calendar(payload)
+    if not windows:
+        logger.warning("working-time mode needs one shared, non-empty calendar; solving in wall-clock minutes")
+        return None
+    calendar = WorkingCalendar(windows)
+    logger.info("working-time mode", extra={"breaks": len(windows)})
+
+    def working_progress(event):
+        if event.get("assignments"):
+            expand_assignments(event["assignments"], calendar)
+        progress(event)
+
+    result = Engine(
+        compress_payload(payload, calendar),
+        frozen=_to_working_schedule(frozen or {}, calendar),
+        hints=_to_working_schedule(hints or {}, calendar),
+        progress=working_progress if progress else None,
+        should_cancel=should_cancel,
+    ).solve()
+
+    expand_assignments(result.get("assignments", []), calendar)
+    due = {t.get("task_id"): int(t.get("due_at_min") or 0) for t in payload.get("tasks", [])}
+    end = {a["task_id"]: a["end_min"] for a in result.get("assignments", [])}
+    for o in result.get("overloads", []):
+        if o["status"] == "LATE" and o["task_id"] in end:
+            o["delay_minutes"] = end[o["task_id"]] - due[o["task_id"]]
+    result["time_mode"] = "working"
+    return result
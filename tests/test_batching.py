@@ -0,0 +1,97 @@
+from cp_app.batching import AUTO_BATCH_PREFIX, batch_payload, expand_batches, plan_batches
+
+
+def _task(task_id, order_id, due=0, depends_on=(), operation="washing", machines=("W1",)):
+    return {
+        "task_id": task_id,
+        "original_order_id": order_id,
+        "operation": operation,
+        "design_item_id": "D1",
+        "qty": 10,
+        "priority": 3,
+        "final_depends_on": list(depends_on),
+        "start_after_min": 0,
+        "due_at_min": due,
+        "duration": 60,
+        "compatible_resource_ids": list(machines),
+    }
+
+
+def _payload(tasks):
+    return {
+        "resources": [
+            {"id": "W1", "type": "batch", "operation": "washing", "capacity": 100, "unavailability": []},
+            {"id": "S1", "type": "serial", "capacity": 1, "unavailability": []},
+        ],
+        "tasks": tasks,
+        "config": {},
+    }
+
+
+def _ids(batches):
+    return sorted(sorted(m["task_id"] for m in b) for b in batches)
+
+
+def test_sink_members_batch_only_within_their_order():
+    payload = _payload([
+        _task("A1", "O1", due=100), _task("A2", "O1", due=120),
+        _task("B1", "O2", due=100), _task("B2", "O2", due=110),
+    ])
+    assert _ids(plan_batches(payload)) == [["A1", "A2"], ["B1", "B2"]]
+
+
+def test_non_sink_members_batch_across_orders():
+    payload = _payload([
+        _task("A1", "O1"), _task("B1", "O2"),
+        _task("A2", "O1", depends_on=["A1"], operation="sewing", machines=("S1",)),
+        _task("B2", "O2", depends_on=["B1"], operation="sewing", machines=("S1",)),
+    ])
+    assert _ids(plan_batches(payload)) == [["A1", "B1"]]
+
+
+def test_batch_payload_rewires_dependencies_to_the_batch():
+    payload = _payload([
+        _task("A1", "O1"), _task("B1", "O2"),
+        _task("A2", "O1", depends_on=["A1"], operation="sewing", machines=("S1",)),
+        _task("B2", "O2", depends_on=["B1"], operation="sewing", machines=("S1",)),
+    ])
+    batched, members_of = batch_payload(payload, plan_batches(payload))
+    batch_id = f"{AUTO_BATCH_PREFIX}0"
+    assert list(members_of) == [batch_id]
+    by_id = {t["task_id"]: t for t in batched["tasks"]}
+    assert "A1" not in by_id and "B1" not in by_id
+    assert by_id["A2"]["final_depends_on"] == [batch_id]
+    assert by_id["B2"]["final_depends_on"] == [batch_id]
+    assert [s["task_id"] for s in by_id[batch_id]["sub_tasks"]] == ["A1", "B1"]
+    assert by_id[batch_id]["qty"] == 20
+    assert batched["config"]["auto_batching"] is False
+
+
+def test_expand_batches_restores_ids_and_member_lateness():
+    payload = _payload([_task("A1", "O1", due=100), _task("A2", "O1", due=200)])
+    _, members_of = batch_payload(payload, plan_batches(payload))
+    batch_id = f"{AUTO_BATCH_PREFIX}0"
+    result = {
+        "assignments": [
+            {"task_id": batch_id, "machine_id": "W1", "start_min": 90, "end_min": 150},
+            {"task_id": "X", "machine_id": "S1", "start_min": 0, "end_min": 10},
+        ],
+        "overloads": [{"task_id": batch_id, "status": "LATE", "delay_minutes": 50}],
+    }
+    expand_batches(result, members_of)
+
+    by_task = {a["task_id"]: a for a in result["assignments"]}
+    assert set(by_task) == {"A1", "A2", "X"}
+    assert by_task["A1"]["batch_id"] == batch_id and by_task["A1"]["order_id"] == "O1"
+    assert (by_task["A2"]["start_min"], by_task["A2"]["end_min"]) == (90, 150)
+    assert "batch_id" not in by_task["X"]
+    late = {o["task_id"]: o["delay_minutes"] for o in result["overloads"] if o["status"] == "LATE"}
+    assert late == {"A1": 50}
+
+
+def test_expand_batches_drops_every_member():
+    payload = _payload([_task("A1", "O1"), _task("A2", "O1")])
+    _, members_of = batch_payload(payload, plan_batches(payload))
+    result = {"assignments": [], "overloads": [{"task_id": f"{AUTO_BATCH_PREFIX}0", "status": "DROPPED"}]}
+    expand_batches(result, members_of)
+    assert sorted(o["task_id"] for o in result["overloads"]) == ["A1", "A2"]
@@ -0,0 +1,50 @@
+from cp_app.replan import build_resolve_payload, resolve_schedule
+
+
+def _task(task_id, machine, depends_on=()):
+    return {
+        "task_id": task_id,
+        "original_order_id": "O1",
+        "operation": "op",
+        "qty": 1,
+        "priority": 3,
+        "final_depends_on": list(depends_on),
+        "start_after_min": 0,
+        "duration": 60,
+        "compatible_resource_ids": [machine],
+    }
+
+
+def _request():
+    base = {
+        "job_id": "replan-test",
+        "resources": [
+            {"id": "M1", "type": "serial", "capacity": 1, "unavailability": []},
+            {"id": "M2", "type": "serial", "capacity": 1, "unavailability": []},
+        ],
+        "tasks": [_task("A", "M1"), _task("B", "M2", depends_on=["A"])],
+        "config": {"max_search_time": 5, "num_search_workers": 1},
+    }
+    return {
+        "base": base,
+        "base_assignments": [
+            {"task_id": "A", "machine_id": "M1", "start_min": 10, "end_min": 70},
+            {"task_id": "B", "machine_id": "M2", "start_min": 70, "end_min": 130},
+        ],
+        "now_min": 0,
+        "frozen_window_min": 200,
+        "delta": {"unavailability": {"M1": [{"start": 0, "end": 100}]}},
+    }
+
+
+def test_breakdown_unfreezes_descendants():
+    _, frozen, _, frozen_assignments = build_resolve_payload(_request())
+    assert frozen == {}
+    assert frozen_assignments == []
+
+
+def test_resolved_parent_ends_before_child():
+    result = resolve_schedule(_request())
+    by_id = {a["task_id"]: a for a in result["assignments"]}
+    assert by_id["A"]["start_min"] >= 100
+    assert by_id["B"]["start_min"] >= by_id["A"]["end_min"]
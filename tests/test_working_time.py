@@ -0,0 +1,77 @@
+from cp_app.analysis import OPEN_END
+from cp_app.working_time import WorkingCalendar, crossing_break, segment_start_intervals
+
+
+def test_to_working_collapses_breaks():
+    calendar = WorkingCalendar(((60, 120), (200, 230)))
+    assert calendar.break_points == [60, 140]
+    assert [calendar.to_working(t) for t in (0, 59, 60, 90, 119, 120, 199, 200, 229, 230)] == \
+        [0, 59, 60, 60, 60, 60, 139, 140, 140, 140]
+
+
+def test_start_and_end_at_a_break_point_map_to_opposite_sides_of_the_break():
+    calendar = WorkingCalendar(((60, 120),))
+    assert calendar.to_wall_start(60) == 120
+    assert calendar.to_wall_end(60) == 60
+    assert (calendar.to_wall_start(59), calendar.to_wall_end(59)) == (59, 59)
+    assert (calendar.to_wall_start(61), calendar.to_wall_end(61)) == (121, 121)
+
+
+def test_break_at_time_zero():
+    calendar = WorkingCalendar(((0, 30),))
+    assert calendar.break_points == [0]
+    assert calendar.to_working(10) == 0
+    assert calendar.to_wall_start(0) == 30
+    assert calendar.to_wall_end(10) == 40
+
+
+def test_adjacent_and_overlapping_windows_are_one_break():
+    for windows in (((60, 90), (90, 120)), ((60, 100), (80, 120)), ((90, 120), (60, 90))):
+        calendar = WorkingCalendar(windows)
+        assert calendar.break_points == [60]
+        assert calendar.to_working(130) == 70
+        assert calendar.to_wall_start(60) == 120
+        assert calendar.to_wall_end(60) == 60
+
+
+def test_due_inside_a_break_is_met_by_ending_before_the_break():
+    calendar = WorkingCalendar(((60, 120),))
+    due = calendar.to_working(90)
+    assert due == 60
+    assert calendar.to_wall_end(due) <= 90
+    # Kết thúc sau giờ nghỉ thì trễ
+    assert calendar.to_wall_end(due + 1) > 90
+
+
+def test_round_trip_outside_breaks():
+    calendar = WorkingCalendar(((60, 120), (200, 230)))
+    for t in list(range(0, 60)) + list(range(121, 200)) + list(range(231, 300)):
+        w = calendar.to_working(t)
+        assert calendar.to_wall_start(w) == t
+        assert calendar.to_wall_end(w) == t
+
+
+def test_segment_start_intervals_keep_tasks_inside_one_segment():
+    assert segment_start_intervals([60, 140], 30) == [(0, 30), (60, 110), (140, OPEN_END)]
+    # Task vừa khít đoạn làm việc
+    assert segment_start_intervals([60, 140], 60) == [(0, 0), (60, 80), (140, OPEN_END)]
+    # Task dài hơn đoạn làm việc không được đặt trong đoạn đó
+    assert segment_start_intervals([60, 140], 90) == [(140, OPEN_END)]
+    assert segment_start_intervals([0], 30) == [(0, OPEN_END)]
+    assert segment_start_intervals([], 30) == [(0, OPEN_END)]
+
+
+def test_segment_starts_map_to_wall_intervals_without_a_break():
+    calendar = WorkingCalendar(((60, 120), (200, 230)))
+    duration = 30
+    for low, high in segment_start_intervals(calendar.break_points, duration):
+        for w in range(low, min(high, 300) + 1):
+            start, end = calendar.to_wall_start(w), calendar.to_wall_end(w + duration)
+            assert end - start == duration
+            assert crossing_break(calendar.break_points, w, duration) is None
+
+
+def test_crossing_break_ignores_breaks_at_the_task_edges():
+    assert crossing_break([60], 30, 30) is None
+    assert crossing_break([60], 60, 30) is None
+    assert crossing_break([60], 31, 30) == 60